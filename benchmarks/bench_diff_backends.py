@@ -0,0 +1,97 @@
+"""
+Compare the CPU cost of the two diff backends on recorded revisions.
+
+Record a corpus of recent mainspace edits (needs network access)::
+
+    python -m benchmarks.bench_diff_backends record revisions.jsonl.gz --count 200
+
+Then benchmark both backends against it, offline::
+
+    python -m benchmarks.bench_diff_backends compare revisions.jsonl.gz
+
+Only the local work is timed: parsing the ``action=compare`` HTML for the ``compare`` backend and diffing the two
+wikitexts for the ``local`` backend. Network time is not included.
+"""
+import gzip
+import json
+import time
+
+import click
+import pywikibot
+from pywikibot import diff
+
+from macron_monitor.DiffProvider import line_diff, parse_revision_content
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument('corpus', type=click.Path(dir_okay=False))
+@click.option('--count', default=100, help='Number of recent edits to record')
+def record(corpus, count):
+    """Record old/new wikitext and the rendered HTML diff of recent edits into CORPUS."""
+    site = pywikibot.Site('en', 'wikipedia')
+    recorded = 0
+    with gzip.open(corpus, 'wt', encoding='utf-8') as out:
+        for change in site.recentchanges(namespaces=[0], changetype='edit', bot=False, total=count):
+            old_revid, new_revid = change['old_revid'], change['revid']
+            response = site.simple_request(action='query', prop='revisions', revids=[old_revid, new_revid],
+                                           rvprop='ids|content', rvslots='main', formatversion=2).submit()
+            texts = parse_revision_content(response)
+            if old_revid not in texts or new_revid not in texts:
+                continue
+            out.write(json.dumps({
+                'title': change['title'],
+                'revision': {'old': old_revid, 'new': new_revid},
+                'old_text': texts[old_revid],
+                'new_text': texts[new_revid],
+                'html': site.compare(old=old_revid, diff=new_revid),
+            }) + '\n')
+            recorded += 1
+    click.echo(f'Recorded {recorded} revisions to {corpus}')
+
+
+@cli.command()
+@click.argument('corpus', type=click.Path(exists=True, dir_okay=False))
+@click.option('--repeat', default=5, help='Number of passes over the corpus per backend')
+def compare(corpus, repeat):
+    """Time both backends over every revision in CORPUS and check that they agree."""
+    with gzip.open(corpus, 'rt', encoding='utf-8') as records:
+        revisions = [json.loads(line) for line in records]
+    if not revisions:
+        raise click.ClickException(f'{corpus} contains no revisions')
+
+    compare_seconds = _time(lambda r: diff.html_comparator(r['html']), revisions, repeat)
+    local_seconds = _time(lambda r: line_diff(r['old_text'], r['new_text']), revisions, repeat)
+
+    agreeing = sum(
+        1 for r in revisions
+        if _normalise(diff.html_comparator(r['html'])) == _normalise(line_diff(r['old_text'], r['new_text']))
+    )
+
+    edits = len(revisions) * repeat
+    click.echo(f'{len(revisions)} revisions, {repeat} passes')
+    click.echo(f'compare: {compare_seconds / edits * 1000:8.3f} ms/edit  {edits / compare_seconds:10.1f} edits/s')
+    click.echo(f'local:   {local_seconds / edits * 1000:8.3f} ms/edit  {edits / local_seconds:10.1f} edits/s')
+    click.echo(f'speedup: {compare_seconds / local_seconds:.1f}x')
+    click.echo(f'identical changed lines on {agreeing}/{len(revisions)} revisions')
+
+
+def _time(backend, revisions, repeat) -> float:
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for revision in revisions:
+            backend(revision)
+    return time.perf_counter() - start
+
+
+def _normalise(comparands: dict) -> dict:
+    # the rendered diff drops blank changed lines and may pair moved paragraphs differently
+    return {side: sorted(line for line in lines if line.strip()) for side, lines in comparands.items()}
+
+
+if __name__ == '__main__':
+    cli()
@@ -0,0 +1,205 @@
+"""
+Load test the monitor end to end against a local fake of the recentchange stream and the MediaWiki API.
+
+    python -m benchmarks.bench_load --rates 10,100,1000 --step-seconds 30 --workers 8 --latency-ms 50
+
+The fake (see ``benchmarks.fake_wikimedia``) runs in its own process and sends edits at each rate in turn. The
+monitor runs here exactly as it does in production, with the ``fast`` stream backend, except that its site and
+alert pages talk to the fake API and the WPNZ article list is fixed. For each step this reports the throughput the
+monitor sustained and its lag behind the stream; ``--curve`` writes lag and throughput for every second to a CSV.
+"""
+import csv
+import logging
+import multiprocessing
+import socket
+import time
+from collections import defaultdict
+from typing import Iterator, List, Optional, Tuple
+
+import click
+import pywikibot
+import requests
+
+from benchmarks.bench_replay import ReplayArticleProvider, percentile
+from benchmarks.fake_wikimedia import API_PATH, STREAM_PATH, SYNTHETIC_WPNZ_TITLES, parse_rates, serve
+from macron_monitor import module_logger
+from macron_monitor.AlertWriter import AlertWriter
+from macron_monitor.FastEventStream import FastEventStream
+from macron_monitor.MacronMonitor import DIFF_BACKENDS, MacronMonitor
+from macron_monitor.RequestScheduler import DEFAULT_RATES
+
+
+class FakeApiSite:
+    """The parts of ``pywikibot.Site`` the monitor uses, pointed at the fake API."""
+
+    def __init__(self, server_url: str) -> None:
+        self.server_url = server_url
+        self.session = requests.Session()
+
+    def base_url(self, path: str) -> str:
+        return self.server_url + path
+
+    def apipath(self) -> str:
+        return API_PATH
+
+    def scriptpath(self) -> str:
+        return '/w'
+
+    def login(self) -> None:
+        self.request(action='login', lgname='MacronMonitor')
+
+    def compare(self, old: int, diff: int) -> str:
+        return self.request(action='compare', fromrev=old, torev=diff)['compare']['*']
+
+    def request(self, post: bool = False, **params) -> dict:
+        params['format'] = 'json'
+        if post:
+            response = self.session.post(self.base_url(API_PATH), data=params, timeout=30)
+        else:
+            response = self.session.get(self.base_url(API_PATH), params=params, timeout=30)
+        response.raise_for_status()
+        result = response.json()
+        if 'error' in result:
+            raise pywikibot.exceptions.APIError(result['error']['code'], result['error']['info'])
+        return result
+
+
+class FakeApiPage:
+    def __init__(self, site: FakeApiSite, title: str) -> None:
+        self.site = site
+        self.title = title
+        self.text = ''
+
+    def get(self, force: bool = False) -> str:
+        result = self.site.request(action='query', prop='revisions', titles=self.title, rvslots='main',
+                                   rvprop='content', formatversion=2)
+        self.text = result['query']['pages'][0]['revisions'][0]['slots']['main']['content']
+        return self.text
+
+    def save(self, summary: str, bot: bool, minor: bool) -> None:
+        try:
+            self.site.request(post=True, action='edit', title=self.title, text=self.text, summary=summary,
+                              token='fake+\\')
+        except requests.RequestException as e:
+            raise pywikibot.exceptions.Error(str(e))
+
+
+class FakeApiAlertWriter(AlertWriter):
+    def _get_page(self, alert_page: str) -> FakeApiPage:
+        return FakeApiPage(self.site, alert_page)
+
+
+class LoadTestMonitor(MacronMonitor):
+    """A ``MacronMonitor`` wired to the fake server that records when it finished each change and how far behind."""
+
+    def __init__(self, server_url: str, total_events: int, deadline: float, **kwargs) -> None:
+        self.server_url = server_url
+        self.total_events = total_events
+        self.deadline = deadline
+        self.samples: List[Tuple[float, float, float]] = []
+        super().__init__(stream_backend='fast', **kwargs)
+
+    def _create_site(self) -> FakeApiSite:
+        return FakeApiSite(self.server_url)
+
+    def _create_alert_writer(self, offline: bool, flush_interval: float, batch_size: int) -> AlertWriter:
+        return FakeApiAlertWriter(self.site, offline=offline, flush_interval=flush_interval, batch_size=batch_size,
+                                  scheduler=self.scheduler)
+
+    def _create_wpnz_article_provider(self, snapshot_file: Optional[str]) -> ReplayArticleProvider:
+        return ReplayArticleProvider(SYNTHETIC_WPNZ_TITLES)
+
+    def _create_stream(self, stream_backend: str) -> Iterator:
+        stream = FastEventStream(server_name='en.wikipedia.org', url=self.server_url + STREAM_PATH)
+        for count, change in enumerate(stream, start=1):
+            yield change
+            if count >= self.total_events or time.time() > self.deadline:
+                return
+
+    def _emit_alerts(self, change, detected_issues) -> None:
+        super()._emit_alerts(change, detected_issues)
+        now = time.time()
+        self.samples.append((change['timestamp'], now, now - change['timestamp']))
+
+
+@click.command()
+@click.option('--rates', default='10,100,1000', help='Comma separated edits per second for each step')
+@click.option('--step-seconds', default=30.0, help='How long each rate is held for')
+@click.option('--latency-ms', default=20.0, help='Mean added latency of each fake API call')
+@click.option('--error-rate', default=0.0, help='Fraction of fake API calls that fail')
+@click.option('--noise', default=0, help='Unwanted events (other wikis, bots) sent for every wanted edit')
+@click.option('--corpus', type=click.Path(exists=True, dir_okay=False),
+              help='Replay edits from a bench_replay corpus instead of making them up')
+@click.option('--workers', default=1, type=click.IntRange(min=1))
+@click.option('--queue-size', default=64, type=click.IntRange(min=1))
+@click.option('--diff-backend', default='compare', type=click.Choice(DIFF_BACKENDS))
+@click.option('--batch-window-ms', default=5.0, type=click.FloatRange(min=0))
+@click.option('--api-rate', default=DEFAULT_RATES['api'][0],
+              help="Requests per second the monitor's scheduler allows to the API, which caps the rate it can sustain")
+@click.option('--drain-seconds', default=30.0, help='How long to keep going after the last edit was sent')
+@click.option('--curve', type=click.File('w'), help='Write per-second throughput and lag to this CSV file')
+@click.option('--log-level', default='CRITICAL', help="Level to log the monitor's own messages at")
+def main(rates, step_seconds, latency_ms, error_rate, noise, corpus, workers, queue_size, diff_backend,
+         batch_window_ms, api_rate, drain_seconds, curve, log_level):
+    logging.basicConfig(level=log_level)
+    module_logger.setLevel(log_level)
+    schedule = parse_rates(rates, step_seconds)
+
+    port = _free_port()
+    context = multiprocessing.get_context('spawn')
+    ready = context.Event()
+    server = context.Process(target=serve, args=(port, rates, step_seconds, latency_ms, error_rate, noise, corpus,
+                                                 ready), daemon=True)
+    server.start()
+    try:
+        if not ready.wait(30):
+            raise click.ClickException('The fake server did not start')
+
+        total_events = sum(int(rate * seconds) for rate, seconds in schedule)
+        started = time.time()
+        deadline = started + sum(seconds for _, seconds in schedule) + drain_seconds
+        monitor = LoadTestMonitor(f'http://127.0.0.1:{port}', total_events, deadline, workers=workers,
+                                  queue_size=queue_size, diff_backend=diff_backend,
+                                  batch_window=batch_window_ms / 1000, alert_flush_interval=1.0, api_rate=api_rate)
+        monitor.run()
+    finally:
+        server.terminate()
+
+    samples = monitor.samples
+    if not samples:
+        raise click.ClickException('No edits were processed')
+    stream_start = min(scheduled for scheduled, _, _ in samples)
+    click.echo(f'processed {len(samples)}/{total_events} edits with {workers} worker(s), '
+               f'{diff_backend} diffs, {latency_ms} ms API latency, {error_rate:.1%} API errors')
+    click.echo(f'{"offered/s":>10} {"sustained/s":>12} {"lag p50 s":>10} {"lag p99 s":>10} {"lag max s":>10}')
+    step_start = stream_start
+    for rate, seconds in schedule:
+        in_step = [(done, lag) for scheduled, done, lag in samples if step_start <= scheduled < step_start + seconds]
+        step_start += seconds
+        if not in_step:
+            click.echo(f'{rate:10.0f} {"-":>12}')
+            continue
+        lags = [lag for _, lag in in_step]
+        busy = max(done for done, _ in in_step) - min(done for done, _ in in_step)
+        sustained = len(in_step) / max(busy, seconds)
+        click.echo(f'{rate:10.0f} {sustained:12.1f} {percentile(lags, 50):10.2f} {percentile(lags, 99):10.2f} '
+                   f'{max(lags):10.2f}')
+
+    if curve is not None:
+        per_second = defaultdict(list)
+        for _, done, lag in samples:
+            per_second[int(done - stream_start)].append(lag)
+        writer = csv.writer(curve)
+        writer.writerow(['second', 'processed', 'lag_max_seconds'])
+        for second in sorted(per_second):
+            writer.writerow([second, len(per_second[second]), f'{max(per_second[second]):.3f}'])
+
+
+def _free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+if __name__ == '__main__':
+    main()
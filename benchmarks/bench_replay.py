@@ -0,0 +1,285 @@
+"""
+Record live edits and replay them through the detection pipeline offline, to measure the cost of each edit.
+
+Record a corpus of stream events along with their diffs (needs network access)::
+
+    python -m benchmarks.bench_replay record edits.jsonl.gz --count 500
+
+Then replay it, offline, as often as you like::
+
+    python -m benchmarks.bench_replay replay edits.jsonl.gz --wpnz-snapshot wpnz-articles.json
+
+Each recorded edit is passed to ``MacronMonitor._handle_change`` with the diff served from the recording, and the
+time spent fetching the diff, in each detector, and in the whole of ``_handle_change`` is reported as p50/p99, along
+with overall throughput. A second pass with ``tracemalloc`` running reports the memory allocated per edit; it is
+kept separate because tracing slows everything down.
+
+Pass thresholds to fail (exit status 1) on a regression, e.g. before deploying::
+
+    python -m benchmarks.bench_replay replay edits.jsonl.gz --max-p99 handle_change=5 --max-p99 MaoriWordDetector=1 \\
+        --min-throughput 500 --max-peak-kib 512
+"""
+import gzip
+import json
+import sys
+import threading
+import time
+import tracemalloc
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import click
+import pywikibot
+
+from macron_monitor import SuspiciousRev
+from macron_monitor.DiffProvider import CompareDiffProvider, DiffProvider
+from macron_monitor.FastEventStream import FastEventStream
+from macron_monitor.MacronMonitor import MacronMonitor
+from macron_monitor.RequestScheduler import RequestScheduler
+from macron_monitor.TitleIndex import TitleIndex
+
+HANDLE_CHANGE = 'handle_change'
+DIFF = 'diff'
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.argument('corpus', type=click.Path(dir_okay=False))
+@click.option('--count', default=200, help='Number of stream events to record')
+def record(corpus, count):
+    """Record events off the live recentchange stream, and the diff of each, into CORPUS."""
+    site = pywikibot.Site('en', 'wikipedia')
+    diff_provider = CompareDiffProvider(site)
+    recorded = 0
+    with gzip.open(corpus, 'wt', encoding='utf-8') as out:
+        for change in FastEventStream(server_name='en.wikipedia.org'):
+            if not change.revision['old']:
+                continue
+            try:
+                diff = diff_provider.get_diff(change)
+            except pywikibot.exceptions.Error as e:
+                click.echo(f'Skipping revision {change.revision["new"]}: {e}', err=True)
+                continue
+            out.write(json.dumps({
+                'event': {
+                    'title': change.title,
+                    'user': change.user,
+                    'revision': change.revision,
+                    'timestamp': change.timestamp,
+                    'notify_url': change.notify_url,
+                },
+                'diff': diff,
+            }) + '\n')
+            recorded += 1
+            if recorded >= count:
+                break
+    click.echo(f'Recorded {recorded} edits to {corpus}')
+
+
+@cli.command()
+@click.argument('corpus', type=click.Path(exists=True, dir_okay=False))
+@click.option('--wpnz-snapshot', type=click.Path(exists=True, dir_okay=False),
+              help='WPNZ article snapshot to check membership against, as written by the monitor')
+@click.option('--repeat', default=3, help='Number of timed passes over the corpus')
+@click.option('--max-p99', multiple=True, metavar='STAGE=MS',
+              help='Fail if the p99 of a stage or detector is above this many milliseconds')
+@click.option('--min-throughput', type=float, help='Fail if fewer than this many edits per second are handled')
+@click.option('--max-peak-kib', type=float, help='Fail if handling any one edit allocates more than this at peak')
+def replay(corpus, wpnz_snapshot, repeat, max_p99, min_throughput, max_peak_kib):
+    """Replay every edit in CORPUS through the monitor and report how long each stage took."""
+    with gzip.open(corpus, 'rt', encoding='utf-8') as records:
+        edits = [json.loads(line) for line in records]
+    if not edits:
+        raise click.ClickException(f'{corpus} contains no edits')
+
+    monitor = ReplayMonitor(edits, ReplayArticleProvider.from_snapshot(wpnz_snapshot))
+    monitor.replay()  # warm up caches and lazily built structures before timing
+
+    timings = defaultdict(list)
+    monitor.timings = timings
+    start = time.perf_counter()
+    for _ in range(repeat):
+        monitor.replay()
+    elapsed = time.perf_counter() - start
+    throughput = len(edits) * repeat / elapsed
+
+    monitor.timings = None
+    peaks = monitor.replay_traced()
+
+    click.echo(f'{len(edits)} edits, {repeat} passes, {len(monitor.alerts) // (repeat + 2)} alerts per pass')
+    click.echo(f'throughput: {throughput:10.1f} edits/s')
+    click.echo(f'{"stage":<24} {"p50 ms":>9} {"p99 ms":>9} {"max ms":>9}')
+    for stage, seconds in timings.items():
+        click.echo(f'{stage:<24} {percentile(seconds, 50) * 1000:9.3f} {percentile(seconds, 99) * 1000:9.3f} '
+                   f'{max(seconds) * 1000:9.3f}')
+    click.echo(f'allocated per edit: p50 {percentile(peaks, 50) / 1024:.1f} KiB, '
+               f'p99 {percentile(peaks, 99) / 1024:.1f} KiB, max {max(peaks) / 1024:.1f} KiB at peak')
+
+    failures = []
+    for threshold in max_p99:
+        stage, _, limit = threshold.partition('=')
+        if stage not in timings:
+            raise click.BadParameter(f"unknown stage '{stage}', expected one of {', '.join(timings)}",
+                                     param_hint='--max-p99')
+        p99 = percentile(timings[stage], 99) * 1000
+        if p99 > float(limit):
+            failures.append(f'{stage} p99 {p99:.3f} ms is over {limit} ms')
+    if min_throughput is not None and throughput < min_throughput:
+        failures.append(f'throughput {throughput:.1f} edits/s is under {min_throughput}')
+    if max_peak_kib is not None and max(peaks) / 1024 > max_peak_kib:
+        failures.append(f'peak allocation {max(peaks) / 1024:.1f} KiB is over {max_peak_kib} KiB')
+
+    for failure in failures:
+        click.echo(f'FAIL: {failure}', err=True)
+    if failures:
+        sys.exit(1)
+
+
+class ReplayArticleProvider:
+    """Stands in for ``WPNZArticleProvider`` with a fixed title set, so replays never touch the network."""
+
+    def __init__(self, titles: List[str]) -> None:
+        self._titles = list(titles)
+        self.article_titles = TitleIndex(titles)
+        self.ready = threading.Event()
+        self.ready.set()
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        return True
+
+    def titles(self) -> List[str]:
+        return self._titles
+
+    def add_listener(self, listener) -> None:
+        listener(self)
+
+    @classmethod
+    def from_snapshot(cls, path: Optional[str]) -> 'ReplayArticleProvider':
+        if path is None:
+            return cls([])
+        with open(path, 'r', encoding='utf-8') as snapshot_file:
+            snapshot = json.load(snapshot_file)
+        return cls(snapshot['titles'] + snapshot.get('redirects', []))
+
+
+class RecordedDiffProvider(DiffProvider):
+    def __init__(self, diffs: Dict[Tuple[int, int], dict]) -> None:
+        self.diffs = diffs
+
+    def get_diff(self, change: dict) -> Dict[str, List[str]]:
+        return self.diffs[(change['revision']['old'], change['revision']['new'])]
+
+
+class _TimedDiffProvider(DiffProvider):
+    def __init__(self, monitor: 'ReplayMonitor', diff_provider: DiffProvider) -> None:
+        self.monitor = monitor
+        self.diff_provider = diff_provider
+
+    def get_diff(self, change: dict) -> Dict[str, List[str]]:
+        with self.monitor.timed(DIFF):
+            return self.diff_provider.get_diff(change)
+
+
+class _TimedDetector:
+    def __init__(self, monitor: 'ReplayMonitor', detector) -> None:
+        self.monitor = monitor
+        self.detector = detector
+        self.name = type(detector).__name__
+
+    def detect(self, change, diff, analysis=None) -> Optional[SuspiciousRev]:
+        with self.monitor.timed(self.name):
+            return self.detector.detect(change, diff, analysis)
+
+
+class _Timer:
+    def __init__(self, timings: Optional[Dict[str, List[float]]], stage: str) -> None:
+        self.timings = timings
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        if self.timings is not None:
+            self.timings[self.stage].append(time.perf_counter() - self.start)
+
+
+class ReplaySite:
+    """Stands in for the site, which a replay never logs in to or writes alerts to."""
+
+    def login(self) -> None:
+        pass
+
+
+class ReplayMonitor(MacronMonitor):
+    """
+    A ``MacronMonitor`` that runs recorded edits instead of the stream.
+
+    It has no site: diffs come from the recording and alerts are collected in ``alerts`` instead of being written.
+    """
+
+    def __init__(self, edits: List[dict], wpnz_article_provider) -> None:
+        self.changes = [edit['event'] for edit in edits]
+        self._recorded_diffs = RecordedDiffProvider({
+            (edit['event']['revision']['old'], edit['event']['revision']['new']): edit['diff'] for edit in edits
+        })
+        self._replay_article_provider = wpnz_article_provider
+        self.alerts: List[SuspiciousRev] = []
+        self.timings: Optional[Dict[str, List[float]]] = None
+        super().__init__(offline=True)
+        self.wait_until_ready()
+        self.diff_provider = _TimedDiffProvider(self, self.diff_provider)
+        self.detectors = [_TimedDetector(self, detector) for detector in self.detectors]
+
+    def _create_site(self) -> ReplaySite:
+        return ReplaySite()
+
+    def _create_scheduler(self, api_rate: float, api_max_concurrency: int) -> RequestScheduler:
+        # recorded diffs cost no requests, so don't time the replay against the live rate limits
+        return RequestScheduler(rates={}, max_concurrency=api_max_concurrency)
+
+    def _create_diff_provider(self, diff_backend: str, batch_window: float) -> DiffProvider:
+        return self._recorded_diffs
+
+    def _create_wpnz_article_provider(self, snapshot_file: Optional[str]):
+        return self._replay_article_provider
+
+    def timed(self, stage: str) -> _Timer:
+        return _Timer(self.timings, stage)
+
+    def replay(self) -> None:
+        for change in self.changes:
+            with self.timed(HANDLE_CHANGE):
+                self._handle_change(change)
+
+    def replay_traced(self) -> List[int]:
+        """Replay once with tracemalloc running, returning the peak memory allocated while handling each edit."""
+        peaks = []
+        tracemalloc.start()
+        try:
+            for change in self.changes:
+                tracemalloc.reset_peak()
+                baseline, _ = tracemalloc.get_traced_memory()
+                self._handle_change(change)
+                peaks.append(tracemalloc.get_traced_memory()[1] - baseline)
+        finally:
+            tracemalloc.stop()
+        return peaks
+
+    def _update_alert_list(self, alert_data: SuspiciousRev, change=None, on_written=None) -> None:
+        self.alerts.append(alert_data)
+        if on_written is not None:
+            on_written()
+
+
+def percentile(values: List[float], percentile: float) -> float:
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+
+if __name__ == '__main__':
+    cli()
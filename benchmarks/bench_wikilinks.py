@@ -0,0 +1,75 @@
+"""
+Check that wikilink extraction stays linear on adversarial hunks.
+
+    python -m benchmarks.bench_wikilinks
+
+Each input is scanned at doubling sizes with the old ``link_regex`` and with ``find_macroned_piped_links`` as
+``UnMacronedLinkDetector`` calls it, and the growth exponent k in time ~ size^k is estimated from the smallest
+and largest sizes. A linear scanner has k close to 1; the regex has k close to 2 on inputs with many ``[[`` and
+no matching ``|...]]``. The command exits non-zero if the scanner's exponent exceeds ``--max-exponent`` on any
+input.
+"""
+import math
+import re
+import sys
+import time
+
+import click
+
+from macron_monitor.detectors.UnMacronedLinkDetector import find_macroned_piped_links
+
+link_regex = re.compile(r'\[\[([^\[\]<>{}]*?(?=[ĀĒĪŌŪāēīōū]+?)[^\[\]<>{}]*?)\|(.*?)]]')
+
+ADVERSARIAL_INPUTS = {
+    'unclosed piped links': lambda n: '[[ā|' * n,
+    'unclosed piped links with text': lambda n: '[[ā|xxxxxxxxxx' * n,
+    'unclosed link then macrons': lambda n: '[[' + 'ā' * n,
+    'long target': lambda n: '[[' + 'ā a' * n + ']]',
+    'pipes without close': lambda n: '[[ā' + '|' * n,
+    'nested templates': lambda n: '{{' * n + '[[Kākāpō|kakapo]]' + '}}' * n,
+    'unbalanced closers': lambda n: ']]}}' * n + '[[Kākāpō|kakapo]]',
+    'nested file captions': lambda n: '[[File:ā.jpg|' * n + '[[Kākāpō|kakapo]]' + ']]' * n,
+}
+
+SIZES = (1000, 2000, 4000, 8000, 16000)
+
+# what UnMacronedLinkDetector passes in as the WPNZ article titles
+WPNZ_TITLES = {'Kākāpō'}
+
+
+@click.command()
+@click.option('--max-exponent', default=1.4, help='Largest growth exponent allowed for the scanner')
+@click.option('--skip-regex', is_flag=True, help='Only time the scanner')
+def main(max_exponent, skip_regex):
+    failed = False
+    for name, make_input in ADVERSARIAL_INPUTS.items():
+        click.echo(f'{name}:')
+        scanner_times = []
+        lengths = []
+        for size in SIZES:
+            hunk = make_input(size)
+            lengths.append(len(hunk))
+            scanner_times.append(_time(lambda text: find_macroned_piped_links(text, WPNZ_TITLES), hunk))
+            regex = '' if skip_regex else f'  regex {_time(link_regex.findall, hunk, repeat=1) * 1000:9.3f} ms'
+            click.echo(f'  {len(hunk):7d} chars  scanner {scanner_times[-1] * 1000:7.3f} ms{regex}')
+
+        exponent = math.log(scanner_times[-1] / scanner_times[0]) / math.log(lengths[-1] / lengths[0])
+        click.echo(f'  scanner growth exponent: {exponent:.2f}')
+        failed |= exponent > max_exponent
+
+    if failed:
+        click.echo('Scanner time grew faster than linear', err=True)
+        sys.exit(1)
+
+
+def _time(engine, hunk, repeat=7) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        engine(hunk)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,354 @@
+"""
+A local stand-in for the recentchange EventStream and the MediaWiki API, for load testing the monitor.
+
+    python -m benchmarks.fake_wikimedia --port 8421 --rates 10,100,1000 --step-seconds 30 --latency-ms 50
+
+``/v2/stream/recentchange`` serves edits as server-sent events following a schedule of rates, each held for
+``step-seconds``. The edits are synthetic, or taken from a ``bench_replay`` corpus with ``--corpus``. Each event's
+timestamp is the time it was scheduled for, not when it was written, so a client that can't keep up sees its lag
+grow. ``/w/api.php`` answers the calls the monitor makes for those edits: ``compare``, ``prop=revisions``, login
+and tokens, and reading and editing alert pages. Every API call can be slowed down with ``--latency-ms`` and made
+to fail with ``--error-rate``.
+"""
+import gzip
+import html
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlparse
+
+import click
+
+from macron_monitor.DiffProvider import line_diff
+
+STREAM_PATH = '/v2/stream/recentchange'
+API_PATH = '/w/api.php'
+
+SYNTHETIC_WPNZ_TITLES = ['Lake Taupō', 'Ōtaki', 'Kākāpō', 'Whanganui River', 'Māori language', 'Ōtautahi']
+SYNTHETIC_SENTENCES = [
+    'The {word} is near the town of Ōtaki, on the coast.',
+    'Many Māori iwi and hapū live in the region around Lake Taupō.',
+    'The river was renamed the Whanganui River in 1991.',
+    'The kākāpō is a large flightless parrot found only in New Zealand.',
+    'The population at the 2018 census was 1,234 people.',
+    '{{{{cite web|url=http://example.org/{word}|title={word}|work=RNZ}}}}',
+    'See also [[Kākāpō|the kakapo]] and [[Lake Taupō]].',
+]
+SYNTHETIC_WORDS = ['marae', 'whānau', 'pā', 'harbour', 'station', 'valley', 'Tūrangi']
+
+Edit = Tuple[str, str, str]
+
+
+class SyntheticEdits:
+    """
+    Makes up edits to articles about New Zealand places.
+
+    Edit ``n`` is always the same, so revision text can be served for any revision id without keeping state. About
+    one edit in ``suspicious_every`` strips the macrons from a line.
+    """
+
+    def __init__(self,
+                 lines: int = 40,
+                 suspicious_every: int = 20,
+                 ) -> None:
+        self.lines = lines
+        self.suspicious_every = suspicious_every
+
+    def __getitem__(self, index: int) -> Edit:
+        rng = random.Random(index)
+        title = (rng.choice(SYNTHETIC_WPNZ_TITLES) if rng.random() < 0.2
+                 else f'Synthetic article {rng.randrange(100000)}')
+        old_lines = [rng.choice(SYNTHETIC_SENTENCES).format(word=rng.choice(SYNTHETIC_WORDS))
+                     for _ in range(self.lines)]
+        new_lines = list(old_lines)
+        changed = rng.randrange(self.lines)
+        if index % self.suspicious_every == 0:
+            new_lines[changed] = _strip_macrons(old_lines[changed])
+        else:
+            new_lines[changed] = old_lines[changed] + f' It had {rng.randrange(1000)} visitors.'
+        return title, '\n'.join(old_lines), '\n'.join(new_lines)
+
+
+class CorpusEdits:
+    """Edits recorded by ``bench_replay``, repeated as often as needed. Revisions are rebuilt from their diffs."""
+
+    def __init__(self,
+                 path: str,
+                 ) -> None:
+        with gzip.open(path, 'rt', encoding='utf-8') as records:
+            self.edits = [
+                (record['event']['title'],
+                 '\n'.join(record['diff']['deleted-context']),
+                 '\n'.join(record['diff']['added-context']))
+                for record in map(json.loads, records)
+            ]
+        if not self.edits:
+            raise ValueError(f'{path} contains no edits')
+
+    def __getitem__(self, index: int) -> Edit:
+        return self.edits[index % len(self.edits)]
+
+
+class FakeWikimedia:
+    """The state shared by every request to the fake server."""
+
+    def __init__(self,
+                 edits,
+                 schedule: List[Tuple[float, float]],
+                 latency: float = 0.0,
+                 error_rate: float = 0.0,
+                 noise: int = 0,
+                 ) -> None:
+        self.edits = edits
+        self.schedule = schedule
+        self.latency = latency
+        self.error_rate = error_rate
+        self.noise = noise
+        self.started: Optional[float] = None
+        self.pages: Dict[str, str] = {}
+        self.page_revisions = 0
+        self.lock = threading.Lock()
+
+    @property
+    def total_events(self) -> int:
+        return sum(int(rate * seconds) for rate, seconds in self.schedule)
+
+    def scheduled_events(self) -> Iterator[Tuple[float, int]]:
+        """Yield when each edit is due and its index, following the schedule from when the stream first started."""
+        with self.lock:
+            if self.started is None:
+                self.started = time.time()
+        step_start = self.started
+        index = 0
+        for rate, seconds in self.schedule:
+            for offset in range(int(rate * seconds)):
+                yield step_start + offset / rate, index
+                index += 1
+            step_start += seconds
+
+    def revision_text(self, revid: int) -> Optional[str]:
+        if revid < 1:
+            return None
+        _, old_text, new_text = self.edits[(revid - 1) // 2]
+        return new_text if revid % 2 == 0 else old_text
+
+    def event(self, index: int, timestamp: float) -> dict:
+        title, _, _ = self.edits[index]
+        old_revid, new_revid = 2 * index + 1, 2 * index + 2
+        return {
+            'meta': {'domain': 'en.wikipedia.org'},
+            'server_name': 'en.wikipedia.org',
+            'type': 'edit',
+            'namespace': 0,
+            'bot': False,
+            'title': title,
+            'user': f'Editor {index % 97}',
+            'revision': {'old': old_revid, 'new': new_revid},
+            'timestamp': timestamp,
+            'notify_url': f'https://en.wikipedia.org/w/index.php?diff={new_revid}&oldid={old_revid}',
+        }
+
+
+class FakeWikimediaHandler(BaseHTTPRequestHandler):
+    fake: FakeWikimedia
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path == STREAM_PATH:
+            self._stream()
+        elif url.path == API_PATH:
+            self._api(parse_qs(url.query))
+        else:
+            self._respond(404, 'text/plain', b'Not found\n')
+
+    def do_POST(self) -> None:
+        url = urlparse(self.path)
+        if url.path != API_PATH:
+            self._respond(404, 'text/plain', b'Not found\n')
+            return
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8')
+        params = parse_qs(url.query)
+        params.update(parse_qs(body))
+        self._api(params)
+
+    def _respond(self, status: int, content_type: str, body: bytes) -> None:
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _stream(self) -> None:
+        resume_after = -1
+        last_event_id = self.headers.get('Last-Event-ID')
+        if last_event_id:
+            try:
+                resume_after = json.loads(last_event_id)[0]['offset']
+            except (ValueError, LookupError, TypeError):
+                pass
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+
+        fake = self.fake
+        try:
+            for due, index in fake.scheduled_events():
+                if index <= resume_after:
+                    continue
+                delay = due - time.time()
+                if delay > 0:
+                    time.sleep(delay)
+                chunks = []
+                for noise in range(fake.noise):
+                    chunks.append(self._sse(None, {'server_name': 'www.wikidata.org', 'type': 'edit',
+                                                   'namespace': 0, 'bot': noise % 2 == 0, 'timestamp': due}))
+                chunks.append(self._sse(index, fake.event(index, due)))
+                self.wfile.write(b''.join(chunks))
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+
+    @staticmethod
+    def _sse(index: Optional[int], data: dict) -> bytes:
+        event_id = f'id: [{{"offset":{index}}}]\n' if index is not None else ''
+        return f'event: message\n{event_id}data: {json.dumps(data, separators=(",", ":"))}\n\n'.encode('utf-8')
+
+    def _api(self, params: Dict[str, List[str]]) -> None:
+        fake = self.fake
+        if fake.latency:
+            time.sleep(fake.latency * random.uniform(0.5, 1.5))
+        if fake.error_rate and random.random() < fake.error_rate:
+            if random.random() < 0.5:
+                self._respond(503, 'text/plain', b'Service unavailable (injected)\n')
+            else:
+                self._json({'error': {'code': 'internal_api_error_DBQueryError', 'info': 'Injected error'}})
+            return
+
+        param = {key: values[-1] for key, values in params.items()}
+        action = param.get('action')
+        if action == 'compare':
+            self._compare(int(param['fromrev']), int(param['torev']))
+        elif action == 'query' and 'tokens' in param.get('meta', ''):
+            self._json({'batchcomplete': True, 'query': {'tokens': {'csrftoken': 'fake+\\', 'logintoken': 'fake+\\'}}})
+        elif action == 'query' and 'userinfo' in param.get('meta', ''):
+            self._json({'batchcomplete': True, 'query': {'userinfo': {'id': 1, 'name': 'MacronMonitor'}}})
+        elif action == 'query' and param.get('prop') == 'revisions' and 'revids' in param:
+            self._revisions([int(revid) for revid in param['revids'].split('|')])
+        elif action == 'query' and param.get('prop') == 'revisions' and 'titles' in param:
+            self._page(param['titles'])
+        elif action == 'login':
+            self._json({'login': {'result': 'Success', 'lgusername': param.get('lgname', 'MacronMonitor')}})
+        elif action == 'edit':
+            self._edit(param['title'], param.get('text', ''))
+        else:
+            self._json({'error': {'code': 'badvalue', 'info': f'The fake API does not support {param}'}})
+
+    def _json(self, data: dict) -> None:
+        self._respond(200, 'application/json; charset=utf-8', json.dumps(data).encode('utf-8'))
+
+    def _compare(self, old_revid: int, new_revid: int) -> None:
+        old_text, new_text = self.fake.revision_text(old_revid), self.fake.revision_text(new_revid)
+        if old_text is None or new_text is None:
+            self._json({'error': {'code': 'nosuchrevid', 'info': 'There is no revision with that ID.'}})
+            return
+        self._json({'compare': {'fromrevid': old_revid, 'torevid': new_revid, '*': _render_diff(old_text, new_text)}})
+
+    def _revisions(self, revids: List[int]) -> None:
+        pages = []
+        for revid in revids:
+            text = self.fake.revision_text(revid)
+            if text is None:
+                continue
+            title, _, _ = self.fake.edits[(revid - 1) // 2]
+            pages.append({'title': title, 'revisions': [{'revid': revid, 'slots': {'main': {'content': text}}}]})
+        self._json({'batchcomplete': True, 'query': {'pages': pages}})
+
+    def _page(self, title: str) -> None:
+        with self.fake.lock:
+            text = self.fake.pages.setdefault(title, '==Alerts==\n')
+            revid = self.fake.page_revisions
+        self._json({'batchcomplete': True, 'query': {'pages': [
+            {'title': title, 'revisions': [{'revid': revid, 'slots': {'main': {'content': text}}}]}
+        ]}})
+
+    def _edit(self, title: str, text: str) -> None:
+        with self.fake.lock:
+            self.fake.pages[title] = text
+            self.fake.page_revisions += 1
+            revid = self.fake.page_revisions
+        self._json({'edit': {'result': 'Success', 'title': title, 'newrevid': revid}})
+
+
+def _render_diff(old_text: str, new_text: str) -> str:
+    changed = line_diff(old_text, new_text)
+    rows = []
+    for deleted in changed['deleted-context']:
+        rows.append(f'<tr><td class="diff-marker">−</td><td class="diff-deletedline"><div>{html.escape(deleted)}'
+                    f'</div></td><td colspan="2" class="diff-empty"></td></tr>')
+    for added in changed['added-context']:
+        rows.append(f'<tr><td colspan="2" class="diff-empty"></td><td class="diff-marker">+</td>'
+                    f'<td class="diff-addedline"><div>{html.escape(added)}</div></td></tr>')
+    return ''.join(rows)
+
+
+def _strip_macrons(text: str) -> str:
+    return text.translate(str.maketrans('āēīōūĀĒĪŌŪ', 'aeiouAEIOU'))
+
+
+def parse_rates(rates: str, step_seconds: float) -> List[Tuple[float, float]]:
+    return [(float(rate), step_seconds) for rate in rates.split(',') if rate.strip()]
+
+
+def start_fake_wikimedia(fake: FakeWikimedia, port: int = 0, addr: str = '127.0.0.1') -> ThreadingHTTPServer:
+    """Serve ``fake`` from a background thread. Use port 0 to pick a free port."""
+    handler = type('FakeWikimediaHandler', (FakeWikimediaHandler,), {'fake': fake})
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    daemon = threading.Thread(target=server.serve_forever, daemon=True, name='background_FakeWikimedia')
+    daemon.start()
+    return server
+
+
+def serve(port: int, rates: str, step_seconds: float, latency_ms: float, error_rate: float, noise: int,
+          corpus: Optional[str], ready=None) -> None:
+    """Run the fake server until killed, setting ``ready`` once it is listening."""
+    edits = CorpusEdits(corpus) if corpus else SyntheticEdits()
+    fake = FakeWikimedia(edits, parse_rates(rates, step_seconds), latency=latency_ms / 1000, error_rate=error_rate,
+                         noise=noise)
+    server = start_fake_wikimedia(fake, port)
+    if ready is not None:
+        ready.set()
+    try:
+        while True:
+            time.sleep(3600)
+    finally:
+        server.shutdown()
+
+
+@click.command()
+@click.option('--port', default=8421, help='Port to listen on')
+@click.option('--rates', default='10,100,1000', help='Comma separated edits per second for each step')
+@click.option('--step-seconds', default=30.0, help='How long each rate is held for')
+@click.option('--latency-ms', default=0.0, help='Mean added latency of each API call')
+@click.option('--error-rate', default=0.0, help='Fraction of API calls that fail')
+@click.option('--noise', default=0, help='Unwanted events (other wikis, bots) sent for every wanted edit')
+@click.option('--corpus', type=click.Path(exists=True, dir_okay=False),
+              help='Replay edits from a bench_replay corpus instead of making them up')
+def main(port, rates, step_seconds, latency_ms, error_rate, noise, corpus):
+    click.echo(f'Serving the fake stream at http://127.0.0.1:{port}{STREAM_PATH} '
+               f'and the API at http://127.0.0.1:{port}{API_PATH}')
+    serve(port, rates, step_seconds, latency_ms, error_rate, noise, corpus)
+
+
+if __name__ == '__main__':
+    main()
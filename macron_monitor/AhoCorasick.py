@@ -0,0 +1,61 @@
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+
+class AhoCorasick:
+    """
+    Finds every occurrence of a set of words in a single left-to-right pass over the text.
+
+    The cost of a scan is linear in the length of the text plus the number of matches, however many words there are.
+    """
+
+    def __init__(self,
+                 words: Iterable[str],
+                 ) -> None:
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._lengths: List[Tuple[int, ...]] = [()]
+        self.size = 0
+
+        for word in words:
+            if not word:
+                continue
+            state = 0
+            for char in word:
+                next_state = self._goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self._goto)
+                    self._goto[state][char] = next_state
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._lengths.append(())
+                state = next_state
+            if len(word) not in self._lengths[state]:
+                self._lengths[state] += (len(word),)
+                self.size += 1
+
+        # breadth first, so a state's failure link is always resolved before its children's. The root's children
+        # fail back to the root, which they already do.
+        pending = deque(self._goto[0].values())
+        while pending:
+            state = pending.popleft()
+            for char, child in self._goto[state].items():
+                pending.append(child)
+                fallback = self._fail[state]
+                while fallback and char not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                self._fail[child] = self._goto[fallback].get(char, 0)
+                self._lengths[child] += self._lengths[self._fail[child]]
+
+    def iter_matches(self, text: str) -> Iterator[Tuple[int, int]]:
+        """Yield ``(start, end)`` for each occurrence of a word, ordered by where it ends."""
+        goto, fail, lengths = self._goto, self._fail, self._lengths
+        state = 0
+        for index, char in enumerate(text):
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if lengths[state]:
+                end = index + 1
+                for length in lengths[state]:
+                    yield end - length, end
@@ -0,0 +1,186 @@
+import sqlite3
+import threading
+import time
+from typing import List, Optional, Set, Tuple
+
+from prometheus_client import Counter, Histogram
+
+from macron_monitor import module_logger, SuspiciousRev
+
+ALERT_JOURNAL_WRITES = Counter('alert_journal_writes', 'Alerts written to the local alert journal')
+ALERT_JOURNAL_FLUSH_SECONDS = Histogram('alert_journal_flush_seconds', 'Time taken to write a batch of alerts '
+                                                                       'to the local alert journal')
+ALERTS_ALREADY_SENT = Counter('alerts_already_sent', 'Alerts skipped because the journal says they were already made')
+
+MAX_QUERY_LIMIT = 1000
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS alerts (
+    id INTEGER PRIMARY KEY,
+    server_name TEXT NOT NULL,
+    revid INTEGER NOT NULL,
+    old_revid INTEGER,
+    title TEXT NOT NULL,
+    user TEXT NOT NULL,
+    alert_page TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    detected_at REAL NOT NULL,
+    UNIQUE (server_name, revid, reason)
+);
+CREATE INDEX IF NOT EXISTS alerts_by_revid ON alerts (revid);
+CREATE INDEX IF NOT EXISTS alerts_by_user ON alerts (user, detected_at);
+CREATE INDEX IF NOT EXISTS alerts_by_title ON alerts (title, detected_at);
+CREATE INDEX IF NOT EXISTS alerts_by_time ON alerts (detected_at);
+"""
+
+_COLUMNS = ('server_name', 'revid', 'old_revid', 'title', 'user', 'alert_page', 'reason', 'detected_at')
+
+
+class AlertJournal:
+    """
+    Keeps every alert in a local SQLite database, so alerts can be looked up without reading the alert pages.
+
+    ``claim`` is called before an alert is sent, and fails if the same alert for the same revision has been recorded
+    or claimed before, including by an earlier run, so an edit that is processed again after a restart isn't alerted
+    twice. ``record`` is called once the alert is on its page, so an alert that was never saved is sent again by the
+    next run. A background thread writes recorded alerts in one transaction every ``flush_interval`` seconds, or
+    sooner once ``batch_size`` are waiting. Queries only see alerts that have been written.
+
+    The database is in WAL mode, so queries from other threads, each with a connection of their own, don't wait for
+    writes.
+    """
+    _class_logger = module_logger.getChild(__qualname__)
+
+    def __init__(self,
+                 path: str,
+                 flush_interval: float = 1.0,
+                 batch_size: int = 100,
+                 ) -> None:
+        self._instance_logger = self._class_logger.getChild(str(id(self)))
+        self.path = path
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+
+        self._connection = self._connect()
+        self._connection.execute('PRAGMA journal_mode=WAL')
+        self._connection.executescript(_SCHEMA)
+        self._readers = threading.local()
+
+        self._pending: List[Tuple] = []
+        # claimed alerts that aren't in the database yet
+        self._claimed: Set[Tuple[str, int, str]] = set()
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+
+        daemon = threading.Thread(target=self._periodic_flush, daemon=True, name='background_AlertJournal')
+        daemon.start()
+
+    def claim(self, alert: SuspiciousRev, server_name: str) -> bool:
+        """Claim ``alert`` to be sent, returning False instead if it was already recorded or claimed."""
+        key = _key(alert, server_name)
+        with self._lock:
+            if key in self._claimed or self._is_written(key):
+                ALERTS_ALREADY_SENT.inc()
+                return False
+            self._claimed.add(key)
+        return True
+
+    def record(self, alert: SuspiciousRev, server_name: str) -> None:
+        """Queue ``alert`` to be written, once it has been sent."""
+        with self._lock:
+            self._pending.append((server_name, alert.revision['new'], alert.revision.get('old'), alert.title,
+                                  alert.user, alert.alert_page, alert.reason, time.time()))
+            self._claimed.add(_key(alert, server_name))
+            if len(self._pending) >= self.batch_size:
+                self._wake.set()
+
+    def alerts(self,
+               user: Optional[str] = None,
+               title: Optional[str] = None,
+               since: Optional[float] = None,
+               limit: int = 100,
+               ) -> List[dict]:
+        """The latest alerts, newest first, for ``user`` or ``title`` if given, and since the ``since`` timestamp."""
+        conditions, params = [], []
+        for column, value in (('user', user), ('title', title)):
+            if value is not None:
+                conditions.append(f'{column} = ?')
+                params.append(value)
+        if since is not None:
+            conditions.append('detected_at >= ?')
+            params.append(since)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        rows = self._reader().execute(
+            f"SELECT {', '.join(_COLUMNS)} FROM alerts {where} ORDER BY detected_at DESC LIMIT ?",
+            params + [_clamp(limit)]).fetchall()
+        return [dict(zip(_COLUMNS, row)) for row in rows]
+
+    def top_users(self, since: Optional[float] = None, limit: int = 20) -> List[dict]:
+        """The users with the most alerts since the ``since`` timestamp, most first."""
+        rows = self._reader().execute(
+            "SELECT user, COUNT(*), COUNT(DISTINCT title), MAX(detected_at) FROM alerts WHERE detected_at >= ? "
+            "GROUP BY user ORDER BY COUNT(*) DESC, MAX(detected_at) DESC LIMIT ?",
+            (since or 0, _clamp(limit))).fetchall()
+        return [{'user': user, 'alerts': alerts, 'titles': titles, 'last_alert': last_alert}
+                for user, alerts, titles, last_alert in rows]
+
+    def close(self) -> None:
+        """Stop the background thread and write anything still queued."""
+        self._closed = True
+        self._wake.set()
+        self.flush()
+
+    def flush(self) -> None:
+        with self._write_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return
+            try:
+                with ALERT_JOURNAL_FLUSH_SECONDS.time(), self._connection:
+                    self._connection.executemany(
+                        f"INSERT OR IGNORE INTO alerts ({', '.join(_COLUMNS)}) "
+                        f"VALUES ({', '.join('?' * len(_COLUMNS))})", pending)
+            except sqlite3.Error:
+                # keep them for the next flush
+                with self._lock:
+                    self._pending[:0] = pending
+                raise
+            with self._lock:
+                self._claimed.difference_update((row[0], row[1], row[6]) for row in pending)
+            ALERT_JOURNAL_WRITES.inc(len(pending))
+
+    def _is_written(self, key: Tuple[str, int, str]) -> bool:
+        return self._reader().execute('SELECT 1 FROM alerts WHERE server_name = ? AND revid = ? AND reason = ?',
+                                      key).fetchone() is not None
+
+    def _connect(self) -> sqlite3.Connection:
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute('PRAGMA synchronous=NORMAL')
+        return connection
+
+    def _reader(self) -> sqlite3.Connection:
+        connection = getattr(self._readers, 'connection', None)
+        if connection is None:
+            connection = self._readers.connection = self._connect()
+        return connection
+
+    def _periodic_flush(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except sqlite3.Error as e:
+                self._instance_logger.error("Failed to write alerts to the journal", exc_info=e)
+
+
+def _key(alert: SuspiciousRev, server_name: str) -> Tuple[str, int, str]:
+    return server_name, alert.revision['new'], alert.reason
+
+
+def _clamp(limit: int) -> int:
+    # SQLite reads a negative LIMIT as no limit at all
+    return max(1, min(limit, MAX_QUERY_LIMIT))
@@ -0,0 +1,163 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+import pywikibot
+from prometheus_client import Counter, Gauge, Histogram
+
+from macron_monitor import module_logger, SuspiciousRev
+from macron_monitor.RequestScheduler import Priority, RequestScheduler
+
+SUCCESSFUL_ALERT_PAGE_UPDATE_COUNT = Counter('alert_page_edit_successful', 'Successful edits to the alert page')
+ALERT_PAGE_EDIT_CONFLICTS = Counter('alert_page_edit_conflicts', 'Edit conflicts when saving an alert page')
+ALERT_QUEUE_DEPTH = Gauge('alert_queue_depth', 'Alerts waiting to be written to an alert page')
+ALERT_FLUSH_SECONDS = Histogram('alert_flush_seconds', 'Time taken to write all pending alerts to their pages')
+ALERT_PAGE_WRITE_SECONDS = Histogram('alert_page_write_seconds', 'Time taken to add a batch of alerts to one page')
+ALERT_PAGE_WRITE_ERRORS = Counter('alert_page_write_errors', 'Errors saving an alert page, other than edit conflicts',
+                                  ['type'])
+ALERT_LATENCY_SECONDS = Histogram('alert_latency_seconds', 'Time between an alert being queued and saved to its page',
+                                  buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, float('inf')))
+
+
+class AlertWriter:
+    """
+    Writes alerts to their alert pages from a background thread.
+
+    Alerts are queued by ``add`` and written every ``flush_interval`` seconds, or sooner once ``batch_size`` are
+    waiting. All the alerts for one page go in a single edit. Edit conflicts are retried against the latest page
+    text, and alerts that still can't be saved are put back on the queue for the next flush. Page reads and saves go
+    through ``scheduler`` ahead of other requests.
+
+    An alert's ``on_written`` callback is called from the writing thread once its page is saved, or straight away in
+    offline mode.
+    """
+    _class_logger = module_logger.getChild(__qualname__)
+
+    def __init__(self,
+                 site: pywikibot.site.BaseSite,
+                 offline: bool = False,
+                 flush_interval: float = 30.0,
+                 batch_size: int = 20,
+                 conflict_retries: int = 3,
+                 scheduler: Optional[RequestScheduler] = None,
+                 ) -> None:
+        self._instance_logger = self._class_logger.getChild(str(id(self)))
+        self.site = site
+        self.offline = offline
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.conflict_retries = conflict_retries
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler()
+
+        self._pending: List[Tuple[float, SuspiciousRev, Optional[Callable[[], None]]]] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+
+        daemon = threading.Thread(target=self._periodic_flush, daemon=True, name='background_AlertWriter')
+        daemon.start()
+
+    def add(self, alert: SuspiciousRev, on_written: Optional[Callable[[], None]] = None) -> None:
+        print(alert.to_string())
+        if self.offline:
+            if on_written is not None:
+                on_written()
+            return
+        with self._lock:
+            self._pending.append((time.monotonic(), alert, on_written))
+            ALERT_QUEUE_DEPTH.set(len(self._pending))
+            if len(self._pending) >= self.batch_size:
+                self._wake.set()
+
+    def close(self) -> None:
+        """Stop the background thread and write anything still queued."""
+        self._closed = True
+        self._wake.set()
+        self.flush()
+
+    def _periodic_flush(self) -> None:
+        while not self._closed:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self._instance_logger.error("Failed to flush alerts", exc_info=e)
+
+    def flush(self) -> None:
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, []
+            if not pending:
+                return
+
+            with ALERT_FLUSH_SECONDS.time():
+                by_page: Dict[str, List[Tuple[float, SuspiciousRev, Optional[Callable[[], None]]]]] = OrderedDict()
+                for queued in pending:
+                    by_page.setdefault(queued[1].alert_page, []).append(queued)
+
+                failed = []
+                for alert_page, queued_alerts in by_page.items():
+                    try:
+                        saved = self._write_page(alert_page, [alert for _, alert, _ in queued_alerts])
+                    except Exception as e:
+                        # e.g. the scheduler giving up on a request, keep the alerts for the next flush
+                        ALERT_PAGE_WRITE_ERRORS.labels(type(e).__name__).inc()
+                        self._instance_logger.error("Failed to save %s, will try again on the next flush",
+                                                    alert_page, exc_info=e)
+                        saved = False
+                    if saved:
+                        saved_at = time.monotonic()
+                        for queued_at, _, on_written in queued_alerts:
+                            ALERT_LATENCY_SECONDS.observe(saved_at - queued_at)
+                            if on_written is not None:
+                                on_written()
+                    else:
+                        failed.extend(queued_alerts)
+
+            with self._lock:
+                self._pending[:0] = failed
+                ALERT_QUEUE_DEPTH.set(len(self._pending))
+
+    def _get_page(self, alert_page: str) -> pywikibot.Page:
+        return pywikibot.Page(self.site, alert_page)
+
+    @ALERT_PAGE_WRITE_SECONDS.time()
+    def _write_page(self, alert_page: str, alerts: List[SuspiciousRev]) -> bool:
+        # newest alerts go at the top of the list
+        new_lines = ''.join(f'{alert.to_string()}\n' for alert in reversed(alerts))
+        if len(alerts) == 1:
+            summary = f"add alert for edit on page [[{alerts[0].title}]]"
+        else:
+            titles = ', '.join(f'[[{title}]]' for title in OrderedDict.fromkeys(alert.title for alert in alerts))
+            summary = f"add {len(alerts)} alerts for edits on pages {titles}"
+
+        page = self._get_page(alert_page)
+        for attempt in range(self.conflict_retries + 1):
+            try:
+                current_list = self.scheduler.call(page.get, force=True, priority=Priority.HIGH)
+                page.text = current_list.replace('==Alerts==\n', f'==Alerts==\n{new_lines}')
+                self.scheduler.call(
+                    page.save,
+                    summary=summary,
+                    bot=False,  # mark as not a bot edit so it appears in user watchlists
+                    minor=False,
+                    priority=Priority.HIGH,
+                )
+                SUCCESSFUL_ALERT_PAGE_UPDATE_COUNT.inc()
+                self._instance_logger.info("Added %d alert(s) to %s", len(alerts), alert_page)
+                return True
+            except pywikibot.exceptions.EditConflictError:
+                ALERT_PAGE_EDIT_CONFLICTS.inc()
+                self._instance_logger.warning("Edit conflict saving %s, retrying", alert_page)
+                time.sleep(attempt)
+            except pywikibot.exceptions.Error as e:
+                ALERT_PAGE_WRITE_ERRORS.labels(type(e).__name__).inc()
+                self._instance_logger.error("Failed to save %s, will try again on the next flush", alert_page,
+                                            exc_info=e)
+                return False
+        self._instance_logger.error("Gave up on %s after %d edit conflicts, will try again on the next flush",
+                                    alert_page, self.conflict_retries + 1)
+        return False
@@ -0,0 +1,97 @@
+import dataclasses
+import json
+import time
+from typing import IO, Iterator, List, Optional
+
+import pywikibot
+from prometheus_client import Counter
+
+from macron_monitor import module_logger, SuspiciousRev
+from macron_monitor.ChangePipeline import ChangePipeline
+from macron_monitor.FastEventStream import ChangeEvent
+
+BACKFILL_EDITS_PROCESSED = Counter('backfill_edits_processed', 'Historical edits run through the detectors')
+
+
+class Backfill:
+    """
+    Runs the detectors over past edits listed by ``list=recentchanges``.
+
+    Changes are listed oldest first with the same filters the live stream uses, and run through the monitor's own
+    diff fetching and detectors in a ``ChangePipeline``. Alerts are written as JSON lines to ``output`` if it is
+    given, otherwise to the alert pages, skipping those the monitor's alert journal says were already sent.
+    ``max_rate`` caps how many edits per second are read, to keep the load on the API polite.
+    """
+    _class_logger = module_logger.getChild(__qualname__)
+
+    def __init__(self,
+                 monitor,
+                 output: Optional[IO[str]] = None,
+                 max_rate: float = 20.0,
+                 report_interval: float = 30.0,
+                 ) -> None:
+        self._instance_logger = self._class_logger.getChild(str(id(self)))
+        self.monitor = monitor
+        self.output = output
+        self.max_rate = max_rate
+        self.report_interval = report_interval
+        self.processed = 0
+        self.detected = 0
+        self.failed = 0
+
+    def run(self, start: pywikibot.Timestamp, end: pywikibot.Timestamp) -> None:
+        self._instance_logger.info("Backfilling edits from %s to %s", start.isoformat(), end.isoformat())
+        self._started = time.monotonic()
+        self._last_report = self._started
+        pipeline = ChangePipeline(self.monitor._process_change, self._emit,
+                                  workers=self.monitor.workers, queue_size=self.monitor.queue_size)
+        pipeline.run(self._recent_changes(start, end))
+        self._report()
+        self._instance_logger.info("Backfill finished")
+
+    def _recent_changes(self, start: pywikibot.Timestamp, end: pywikibot.Timestamp) -> Iterator[ChangeEvent]:
+        site = self.monitor.site
+        index_url = site.base_url(f'{site.scriptpath()}/index.php')
+        interval = 1 / self.max_rate if self.max_rate else 0
+        next_at = time.monotonic()
+        for rc in site.recentchanges(start=start, end=end, reverse=True, namespaces=[0], changetype='edit',
+                                     bot=False):
+            if 'userhidden' in rc or 'sha1hidden' in rc or not rc.get('old_revid'):
+                continue
+            if interval:
+                delay = next_at - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+                next_at = max(next_at, time.monotonic()) + interval
+            yield ChangeEvent(
+                title=rc['title'],
+                user=rc['user'],
+                revision={'old': rc['old_revid'], 'new': rc['revid']},
+                timestamp=int(pywikibot.Timestamp.fromISOformat(rc['timestamp']).posix_timestamp()),
+                notify_url=f"{index_url}?diff={rc['revid']}&oldid={rc['old_revid']}",
+            )
+
+    def _emit(self, change: ChangeEvent, detected_issues: Optional[List[SuspiciousRev]]) -> None:
+        self.processed += 1
+        BACKFILL_EDITS_PROCESSED.inc()
+        if detected_issues is None:
+            # the diff couldn't be fetched, there is no spill file to retry it from here
+            self.failed += 1
+            detected_issues = []
+        self.detected += len(detected_issues)
+        if self.output is None:
+            for suspicious_rev in self.monitor._unsent_alerts(change, detected_issues):
+                self.monitor._send_alert(suspicious_rev, change)
+        else:
+            for suspicious_rev in detected_issues:
+                self.output.write(json.dumps(dataclasses.asdict(suspicious_rev), ensure_ascii=False) + '\n')
+            self.output.flush()
+
+        if time.monotonic() - self._last_report >= self.report_interval:
+            self._report()
+
+    def _report(self) -> None:
+        self._last_report = time.monotonic()
+        elapsed = self._last_report - self._started
+        self._instance_logger.info("Backfilled %d edits (%.1f edits/sec), %d suspicious, %d failed", self.processed,
+                                   self.processed / elapsed if elapsed else 0, self.detected, self.failed)
@@ -0,0 +1,113 @@
+import queue
+import threading
+from concurrent.futures import Executor, ThreadPoolExecutor
+from contextlib import nullcontext
+from typing import Callable, Generic, Iterable, Optional, TypeVar
+
+from prometheus_client import Gauge, Counter
+
+from macron_monitor import module_logger
+
+T = TypeVar('T')
+
+PIPELINE_QUEUE_DEPTH = Gauge('pipeline_queue_depth', 'Changes read from the stream that have not yet been emitted')
+PIPELINE_WORKER_ERRORS = Counter('pipeline_worker_errors', 'Changes whose processing raised an unexpected exception')
+
+_END_OF_STREAM = object()
+
+
+class ChangePipeline(Generic[T]):
+    """
+    Runs changes through a reader -> workers -> emitter pipeline.
+
+    The reader pulls changes off the source iterable and submits them to a pool of worker threads. Submitted changes
+    are placed on a bounded queue in the order they were read, so the reader blocks once ``queue_size`` changes are
+    in flight. The emitter takes changes off that queue in order and waits on each result, which means results are
+    always emitted in the order the changes arrived even though workers finish out of order.
+
+    Pass ``executor`` to run ``process`` somewhere other than a pool of ``workers`` threads, such as a
+    ``ShardedProcessPool``. The caller is responsible for shutting it down.
+    """
+    _class_logger = module_logger.getChild(__qualname__)
+
+    def __init__(self,
+                 process: Callable[[dict], T],
+                 emit: Callable[[dict, T], None],
+                 workers: int = 4,
+                 queue_size: int = 64,
+                 executor: Optional[Executor] = None,
+                 ) -> None:
+        self._instance_logger = self._class_logger.getChild(str(id(self)))
+        self.process = process
+        self.emit = emit
+        self.workers = workers
+        self.executor = executor
+        self._in_flight = queue.Queue(maxsize=queue_size)
+        self._stopping = threading.Event()
+        self._awaiting_source = threading.Event()
+
+    def stop(self) -> None:
+        """Stop reading new changes. Changes that have already been read are still processed and emitted."""
+        self._instance_logger.info("Stopping the pipeline, draining in-flight changes")
+        self._stopping.set()
+
+    def run(self, changes: Iterable[dict]) -> None:
+        if self.executor is not None:
+            executor_context = nullcontext(self.executor)
+        else:
+            executor_context = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='pipeline_worker')
+        with executor_context as executor:
+            reader = threading.Thread(target=self._read, args=(changes, executor), daemon=True,
+                                      name='pipeline_reader')
+            reader.start()
+            try:
+                self._emit_in_order(reader)
+            except KeyboardInterrupt:
+                self.stop()
+                self._emit_in_order(reader)
+                raise
+        self._instance_logger.info("Pipeline has shut down")
+
+    def _read(self, changes: Iterable[dict], executor: Executor) -> None:
+        source = iter(changes)
+        try:
+            while not self._stopping.is_set():
+                self._awaiting_source.set()
+                try:
+                    change = next(source)
+                except StopIteration:
+                    break
+                finally:
+                    self._awaiting_source.clear()
+                if self._stopping.is_set():
+                    break
+                future = executor.submit(self.process, change)
+                self._in_flight.put((change, future))  # blocks when the queue is full
+                PIPELINE_QUEUE_DEPTH.set(self._in_flight.qsize())
+        except Exception as e:
+            self._instance_logger.error("The change stream failed", exc_info=e)
+        finally:
+            self._in_flight.put(_END_OF_STREAM)
+
+    def _emit_in_order(self, reader: threading.Thread) -> None:
+        while True:
+            try:
+                item = self._in_flight.get(timeout=0.5)
+            except queue.Empty:
+                if self._stopping.is_set() and (self._awaiting_source.is_set() or not reader.is_alive()):
+                    # the reader is parked waiting for the stream, so nothing else is going to arrive
+                    return
+                continue
+
+            if item is _END_OF_STREAM:
+                return
+
+            change, future = item
+            PIPELINE_QUEUE_DEPTH.set(self._in_flight.qsize())
+            try:
+                result = future.result()
+            except Exception as e:
+                PIPELINE_WORKER_ERRORS.inc()
+                self._instance_logger.error("Failed to process a change", exc_info=e)
+                continue
+            self.emit(change, result)
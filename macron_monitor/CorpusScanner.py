@@ -0,0 +1,242 @@
+import collections
+import dataclasses
+import heapq
+import json
+import multiprocessing
+import os
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from pathlib import Path
+from typing import Deque, Dict, IO, Iterable, Iterator, List, Optional, Tuple
+
+import requests
+from prometheus_client import Counter
+
+from macron_monitor import atomic_write_json, count_macrons, module_logger
+from macron_monitor.AhoCorasick import AhoCorasick
+from macron_monitor.RequestScheduler import Priority, RateLimitedError, RequestScheduler, retry_after
+from macron_monitor.RevisionFetcher import USER_AGENT
+from macron_monitor.TitleIndex import TitleIndex
+from macron_monitor.detectors.MaoriWordDetector import SUSPICIOUS_WORDS, find_suspicious_words, title_words
+from macron_monitor.detectors.UnMacronedLinkDetector import find_macroned_piped_links
+
+CORPUS_PAGES_SCANNED = Counter('corpus_pages_scanned', 'WPNZ articles whose current wikitext has been scanned')
+
+# the findings kept for each page in the report, beyond which they are only counted
+MAX_EXAMPLES = 10
+
+# set up in each worker process by _init_worker
+_worker_titles: Optional[TitleIndex] = None
+_worker_matcher: Optional[AhoCorasick] = None
+
+
+@dataclasses.dataclass()
+class PageFindings:
+    title: str
+    revid: int
+    words: Dict[str, int]
+    links: Dict[str, int]
+
+    @property
+    def score(self) -> int:
+        return sum(self.words.values()) + sum(self.links.values())
+
+
+class CorpusScanner:
+    """
+    Scans the current wikitext of every WPNZ article for unmacroned links and words, for a cleanup report.
+
+    Titles are scanned in sorted order, ``batch_size`` at a time with one ``prop=revisions`` request per batch, and
+    each batch is matched in a process pool while the next ones are fetched. At most ``processes * 2`` batches are
+    held at once, so memory doesn't grow with the corpus.
+
+    Pages with findings are appended to ``findings_file`` as JSON lines, and after each batch the last title done and
+    the length of ``findings_file`` are saved to ``state_file``. A scan that is stopped carries on after the last
+    title it finished, dropping anything written to ``findings_file`` after the state was saved.
+    """
+    _class_logger = module_logger.getChild(__qualname__)
+
+    def __init__(self,
+                 titles: Iterable[str],
+                 findings_file: str,
+                 state_file: str,
+                 api_url: str = 'https://en.wikipedia.org/w/api.php',
+                 processes: int = 2,
+                 batch_size: int = 50,
+                 scheduler: Optional[RequestScheduler] = None,
+                 session: Optional[requests.Session] = None,
+                 report_interval: float = 30.0,
+                 ) -> None:
+        self._instance_logger = self._class_logger.getChild(str(id(self)))
+        self.titles = sorted(set(titles))
+        self.findings_file = findings_file
+        self.state_file = state_file
+        self.api_url = api_url
+        self.processes = processes
+        self.batch_size = batch_size
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler()
+        if session is None:
+            session = requests.Session()
+            session.headers['User-Agent'] = USER_AGENT
+        self.session = session
+        self.report_interval = report_interval
+        self.scanned = 0
+        self.with_findings = 0
+
+    def run(self) -> None:
+        state = self._load_state()
+        if state['findings_bytes'] and not Path(self.findings_file).exists():
+            self._instance_logger.warning("%s is missing, starting the scan over", self.findings_file)
+            state = {'after': None, 'findings_bytes': 0}
+        remaining = [title for title in self.titles if state['after'] is None or title > state['after']]
+        if state['after'] is not None:
+            self._instance_logger.info("Resuming the scan after [[%s]], %d of %d articles left", state['after'],
+                                       len(remaining), len(self.titles))
+        self._started = time.monotonic()
+        self._last_report = self._started
+
+        if Path(self.findings_file).exists():
+            # drop findings from batches that finished after the state was last saved, they are scanned again
+            os.truncate(self.findings_file, state['findings_bytes'])
+        with open(self.findings_file, 'a', encoding='utf-8') as findings:
+            in_flight: Deque[Tuple[str, Future]] = collections.deque()
+            with ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_init_worker, initargs=(self.titles,)) as executor:
+                for batch in self._batches(remaining):
+                    pages = list(self._fetch(batch))
+                    in_flight.append((batch[-1], executor.submit(scan_pages, pages)))
+                    if len(in_flight) >= self.processes * 2:
+                        self._finish(*in_flight.popleft(), findings)
+                while in_flight:
+                    self._finish(*in_flight.popleft(), findings)
+        self._report()
+
+    @property
+    def pages_per_second(self) -> float:
+        elapsed = time.monotonic() - self._started
+        return self.scanned / elapsed if elapsed else 0.0
+
+    def _batches(self, titles: List[str]) -> Iterator[List[str]]:
+        for start in range(0, len(titles), self.batch_size):
+            yield titles[start:start + self.batch_size]
+
+    def _fetch(self, titles: List[str]) -> Iterator[Tuple[str, int, str]]:
+        """Yield the ``(title, revid, wikitext)`` of the current revision of each of ``titles`` that exists."""
+        params = {
+            'action': 'query',
+            'format': 'json',
+            'formatversion': '2',
+            'prop': 'revisions',
+            'rvprop': 'ids|content',
+            'rvslots': 'main',
+            'titles': '|'.join(titles),
+            'maxlag': '5',
+        }
+        while True:
+            result = self.scheduler.call(self._query_api, params, priority=Priority.BACKGROUND)
+            if 'error' in result:
+                raise ValueError(f"API error fetching article text: {result['error']}")
+            for page in result.get('query', {}).get('pages', []):
+                for revision in page.get('revisions', []):
+                    content = revision.get('slots', {}).get('main', {}).get('content')
+                    if content is not None:
+                        yield page['title'], revision['revid'], content
+            if 'continue' not in result:
+                return
+            # the batch was too big to return every page's text at once
+            params.update(result['continue'])
+
+    def _query_api(self, params: dict) -> dict:
+        response = self.session.get(self.api_url, params=params, timeout=60)
+        response.raise_for_status()
+        result = response.json()
+        if result.get('error', {}).get('code') == 'maxlag':
+            raise RateLimitedError(retry_after(response), result['error'].get('info', ''))
+        return result
+
+    def _finish(self, last_title: str, future: Future, findings: IO[str]) -> None:
+        scanned, found = future.result()
+        for page in found:
+            findings.write(json.dumps(dataclasses.asdict(page), ensure_ascii=False) + '\n')
+        findings.flush()
+        self.scanned += scanned
+        self.with_findings += len(found)
+        CORPUS_PAGES_SCANNED.inc(scanned)
+        atomic_write_json(self.state_file, {'after': last_title, 'findings_bytes': findings.tell()})
+        if time.monotonic() - self._last_report >= self.report_interval:
+            self._report()
+
+    def _load_state(self) -> dict:
+        state = {'after': None, 'findings_bytes': 0}
+        if not Path(self.state_file).exists():
+            return state
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as state_file:
+                state.update(json.load(state_file))
+        except ValueError as e:
+            self._instance_logger.warning("Ignoring unreadable scan state %s, starting over", self.state_file,
+                                          exc_info=e)
+        return state
+
+    def _report(self) -> None:
+        self._last_report = time.monotonic()
+        self._instance_logger.info("Scanned %d articles (%.1f pages/sec), %d with findings", self.scanned,
+                                   self.pages_per_second, self.with_findings)
+
+
+def scan_text(text: str, titles, matcher: AhoCorasick) -> Tuple[Dict[str, int], Dict[str, int]]:
+    """Count the unmacroned words, and the links to WPNZ articles piped over their macrons, in ``text``."""
+    words = collections.Counter(find_suspicious_words(text.lower(), matcher))
+    links = collections.Counter(f'[[{target}|{label}]]' for target, label in find_macroned_piped_links(text, titles)
+                  if count_macrons(target) > count_macrons(label))
+    return dict(words), dict(links)
+
+
+def scan_pages(pages: List[Tuple[str, int, str]]) -> Tuple[int, List[PageFindings]]:
+    """Scan ``(title, revid, wikitext)`` pages in a worker, returning how many were scanned and those with findings."""
+    found = []
+    for title, revid, text in pages:
+        words, links = scan_text(text, _worker_titles, _worker_matcher)
+        if words or links:
+            found.append(PageFindings(title, revid, words, links))
+    return len(pages), found
+
+
+def _init_worker(titles: List[str]) -> None:
+    global _worker_titles, _worker_matcher
+    _worker_titles = TitleIndex(titles)
+    _worker_matcher = AhoCorasick(SUSPICIOUS_WORDS | title_words(titles))
+
+
+def read_findings(findings_file: str) -> Iterator[PageFindings]:
+    with open(findings_file, 'r', encoding='utf-8') as findings:
+        for line in findings:
+            if line.strip():
+                yield PageFindings(**json.loads(line))
+
+
+def write_report(findings: Iterable[PageFindings], output: IO[str], top: int = 500) -> int:
+    """
+    Write the ``top`` pages with the most findings to ``output`` as a wikitext list, most first.
+
+    Only the ``top`` pages are held in memory at once. Returns how many pages were written.
+    """
+    ranked = heapq.nlargest(top, findings, key=lambda page: page.score)
+    for page in ranked:
+        problems = []
+        if page.words:
+            problems.append('unmacroned words: ' + _examples(page.words, "''{}''"))
+        if page.links:
+            problems.append('links piped over macrons: ' + _examples(page.links, '<nowiki>{}</nowiki>'))
+        output.write(f"# '''[[{page.title}]]''' ({{{{oldid|{page.title}|{page.revid}|revision}}}}) — "
+                     f"{page.score} — {'; '.join(problems)}\n")
+    return len(ranked)
+
+
+def _examples(counts: Dict[str, int], template: str) -> str:
+    ordered = sorted(counts.items(), key=lambda item: (-item[1], item[0]))
+    shown = ', '.join(template.format(text) + (f' ×{count}' if count > 1 else '')
+                      for text, count in ordered[:MAX_EXAMPLES])
+    if len(ordered) > MAX_EXAMPLES:
+        shown += f' and {len(ordered) - MAX_EXAMPLES} more'
+    return shown
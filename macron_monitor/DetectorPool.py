@@ -0,0 +1,222 @@
+import multiprocessing
+import pickle
+import queue
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from prometheus_client import Counter
+
+from macron_monitor import SuspiciousRev, module_logger
+from macron_monitor.DiffAnalysis import DiffAnalysis
+from macron_monitor.detectors import Detector
+
+DETECTOR_OVERRUNS = Counter('detector_overruns', 'Detector calls killed for running over their time budget',
+                            ['detector'])
+DETECTOR_WORKER_RESTARTS = Counter('detector_worker_restarts', 'Detector worker processes started again',
+                                   ['reason'])
+DETECTOR_CALLS_SKIPPED = Counter('detector_calls_skipped', 'Changes not run through the detectors because no worker '
+                                                           'was ready, or the detectors were killed', ['reason'])
+
+_STOP = None
+
+
+class DetectorPool:
+    """
+    Runs detectors in worker processes, each detector with a wall-clock budget per change.
+
+    Each worker runs ``create_detectors(*args)`` once when it starts, so compiled patterns and the WPNZ titles are
+    built in the worker rather than sent with every call. A change and its diff are sent to a worker once, and every
+    detector there runs on it with one shared ``DiffAnalysis``.
+
+    A detector still running when its budget is up is counted and logged, and its worker is killed and started again,
+    so one pathological edit costs at most a budget rather than stalling the stream. Changes go to a free worker that
+    has finished starting if there is one. Otherwise a change waits up to ``startup_timeout`` for its worker to start
+    for the first time, but not for one being started again. A change the detectors didn't finish is counted in
+    ``detector_calls_skipped`` and ``detect`` returns None for it, for the caller to try again later.
+    """
+    _class_logger = module_logger.getChild(__qualname__)
+
+    def __init__(self,
+                 create_detectors: Callable[..., List[Detector]],
+                 args: tuple = (),
+                 processes: int = 2,
+                 budget: float = 2.0,
+                 budgets: Optional[Dict[str, float]] = None,
+                 startup_timeout: float = 30.0,
+                 ) -> None:
+        self._instance_logger = self._class_logger.getChild(str(id(self)))
+        self.budget = budget
+        self.budgets = budgets or {}
+        self.startup_timeout = startup_timeout
+        # spawn rather than fork, the parent has threads that may be holding locks
+        context = multiprocessing.get_context('spawn')
+        self._workers = [_DetectorWorker(context, create_detectors, args, index) for index in range(processes)]
+        self._idle: queue.Queue = queue.Queue()
+        for worker in self._workers:
+            self._idle.put(worker)
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        deadline = None if timeout is None else time.monotonic() + timeout
+        for worker in self._workers:
+            remaining = None if deadline is None else max(0.0, deadline - time.monotonic())
+            if not worker.wait_until_ready(remaining):
+                return False
+        return True
+
+    def detect(self, change, diff: dict) -> Optional[List[SuspiciousRev]]:
+        """Run every detector on ``change`` in the next free worker, returning None if they didn't all finish."""
+        worker = self._take_worker()
+        try:
+            return worker.detect(change, diff, self.budget, self.budgets, self.startup_timeout)
+        finally:
+            self._idle.put(worker)
+
+    def _take_worker(self) -> '_DetectorWorker':
+        """The next free worker, passing over any that are still starting while another free one is ready."""
+        worker = self._idle.get()
+        for _ in range(self._idle.qsize()):
+            if worker.wait_until_ready(0):
+                break
+            try:
+                other = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            self._idle.put(worker)
+            worker = other
+        return worker
+
+    def close(self) -> None:
+        for worker in self._workers:
+            worker.stop()
+
+
+class _DetectorWorker:
+    """One worker process of a ``DetectorPool``, used by one thread at a time."""
+    _class_logger = module_logger.getChild(__qualname__)
+
+    def __init__(self, context, create_detectors: Callable[..., List[Detector]], args: tuple, index: int) -> None:
+        self._instance_logger = self._class_logger.getChild(str(index))
+        self._context = context
+        self._create_detectors = create_detectors
+        self._args = args
+        self.index = index
+        # the names of the worker's detectors, in the order it runs them, sent once it has started
+        self.names: List[str] = []
+        self.restarting = False
+        # held for a whole call, so waiting for startup elsewhere can't take the call's reply
+        self._lock = threading.RLock()
+        self._start()
+
+    def _start(self) -> None:
+        self.connection, worker_connection = self._context.Pipe()
+        self.process = self._context.Process(
+            target=_worker_main,
+            args=(worker_connection, self._create_detectors, self._args),
+            daemon=True,
+            name=f'detector_worker_{self.index}',
+        )
+        self.process.start()
+        worker_connection.close()
+        self.ready = False
+
+    def _restart(self, reason: str) -> None:
+        DETECTOR_WORKER_RESTARTS.labels(reason).inc()
+        self.process.kill()
+        self.process.join()
+        self.connection.close()
+        self._start()
+        self.restarting = True
+
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        with self._lock:
+            if self.ready:
+                return True
+            if not self.connection.poll(timeout):
+                return False
+            try:
+                self.names = self.connection.recv()
+            except EOFError:
+                raise RuntimeError(f'detector worker {self.index} exited with code {self.process.exitcode} '
+                                   f'while starting')
+            self.ready = True
+            self.restarting = False
+            return True
+
+    def detect(self, change, diff: dict, budget: float, budgets: Dict[str, float],
+               startup_timeout: Optional[float] = None) -> Optional[List[SuspiciousRev]]:
+        with self._lock:
+            return self._detect(change, diff, budget, budgets, startup_timeout)
+
+    def _detect(self, change, diff: dict, budget: float, budgets: Dict[str, float],
+                startup_timeout: Optional[float]) -> Optional[List[SuspiciousRev]]:
+        # changes don't queue up behind a worker being started again, they are put off instead
+        if not self.wait_until_ready(0 if self.restarting else startup_timeout):
+            reason = 'restarting' if self.restarting else 'starting'
+            DETECTOR_CALLS_SKIPPED.labels(reason).inc()
+            self._instance_logger.error("Skipping revision %s of [[%s]], the worker is %s", change['revision']['new'],
+                                        change['title'], reason)
+            return None
+        detected_issues = []
+        name = None
+        try:
+            self.connection.send((change, diff))
+            for name in self.names:
+                detector_budget = budgets.get(name, budget)
+                if not self.connection.poll(detector_budget):
+                    DETECTOR_OVERRUNS.labels(name).inc()
+                    DETECTOR_CALLS_SKIPPED.labels('overrun').inc()
+                    self._instance_logger.error("%s ran over its %.1fs budget on revision %s of [[%s]], killing it",
+                                                name, detector_budget, change['revision']['new'], change['title'])
+                    self._restart('overrun')
+                    return None
+                succeeded, value = self.connection.recv()
+                if not succeeded:
+                    raise value
+                if value is not None:
+                    detected_issues.append(value)
+        except (EOFError, OSError) as e:
+            DETECTOR_CALLS_SKIPPED.labels('died').inc()
+            self._instance_logger.error("Detector worker exited with code %s running %s on revision %s, "
+                                        "starting it again", self.process.exitcode, name, change['revision']['new'],
+                                        exc_info=e)
+            self._restart('died')
+            return None
+        return detected_issues
+
+    def stop(self) -> None:
+        try:
+            self.connection.send(_STOP)
+        except OSError:
+            pass
+        self.process.join(5)
+        if self.process.is_alive():
+            self.process.kill()
+        self.connection.close()
+
+
+def _worker_main(connection, create_detectors: Callable[..., List[Detector]], args: tuple) -> None:
+    detectors = create_detectors(*args)
+    wpnz_article_provider = next((detector.wpnz_article_provider for detector in detectors
+                                  if getattr(detector, 'wpnz_article_provider', None) is not None), None)
+    connection.send([detector.name for detector in detectors])
+    while True:
+        try:
+            request = connection.recv()
+        except EOFError:
+            return
+        if request is _STOP:
+            return
+        change, diff = request
+        analysis = DiffAnalysis(change, diff, wpnz_article_provider)
+        # one reply per detector as it finishes, so the caller can hold each to its own budget
+        for detector in detectors:
+            try:
+                connection.send((True, detector.detect(change, diff, analysis)))
+            except Exception as e:
+                try:
+                    pickle.dumps(e)
+                except Exception:
+                    e = RuntimeError(repr(e))
+                connection.send((False, e))
+                break
@@ -0,0 +1,55 @@
+from functools import cached_property
+from typing import Dict, List, Optional, Tuple
+
+from macron_monitor import count_macrons
+from macron_monitor.MacronAlignment import stripped_macron_words
+from macron_monitor.WPNZArticleProvider import WPNZArticleProvider
+from macron_monitor.WikilinkScanner import Wikilink, scan_wikilinks
+
+
+class DiffAnalysis:
+    """
+    Things the detectors want to know about a change, each worked out the first time a detector asks for it.
+
+    One is built per change and handed to every detector, so work shared between detectors is only done once and
+    work no enabled detector needs is never done.
+    """
+
+    def __init__(self,
+                 change: dict,
+                 diff: Dict[str, List[str]],
+                 wpnz_article_provider: Optional[WPNZArticleProvider] = None,
+                 ) -> None:
+        self.change = change
+        self.diff = diff
+        self.wpnz_article_provider = wpnz_article_provider
+
+    @cached_property
+    def added_macrons(self) -> int:
+        return count_macrons(*self.diff['added-context'])
+
+    @cached_property
+    def deleted_macrons(self) -> int:
+        return count_macrons(*self.diff['deleted-context'])
+
+    @cached_property
+    def stripped_macron_words(self) -> List[Tuple[str, str]]:
+        """Each ``(old word, new word)`` where the change took macrons out of a word, e.g. ``('Māori', 'Maori')``."""
+        if not self.deleted_macrons:
+            return []
+        return stripped_macron_words(self.diff['deleted-context'], self.diff['added-context'])
+
+    @cached_property
+    def added_lowered(self) -> List[str]:
+        """Each added line, lowercased."""
+        return [hunk.lower() for hunk in self.diff['added-context']]
+
+    @cached_property
+    def added_wikilinks(self) -> List[Wikilink]:
+        return [link for hunk in self.diff['added-context'] for link in scan_wikilinks(hunk)]
+
+    @cached_property
+    def is_wpnz_article(self) -> bool:
+        if self.wpnz_article_provider is None:
+            return False
+        return self.change['title'] in self.wpnz_article_provider.article_titles
@@ -0,0 +1,164 @@
+from abc import abstractmethod
+from difflib import SequenceMatcher
+from typing import Callable, Dict, Iterable, List, Optional
+
+import pywikibot
+from prometheus_client import Counter, Histogram
+from pywikibot import diff
+
+from macron_monitor import module_logger
+from macron_monitor.LRUCache import LRUCache
+from macron_monitor.RequestScheduler import Priority, RequestScheduler
+
+DIFF_CACHE_HITS = Counter('diff_cache_hits', 'Diffs served from the diff cache')
+DIFF_CACHE_MISSES = Counter('diff_cache_misses', 'Diffs that had to be fetched because they were not cached')
+DIFF_FETCH_TIME = Histogram('diff_fetch_seconds', 'Time spent fetching what a diff is computed from', ['backend'])
+DIFF_PARSE_TIME = Histogram('diff_parse_seconds', 'Time spent turning what was fetched into changed lines',
+                            ['backend'])
+
+
+class DiffProvider:
+    """Produces the ``added-context``/``deleted-context`` structure that the detectors consume for a change."""
+
+    @abstractmethod
+    def get_diff(self, change: dict) -> Dict[str, List[str]]:
+        raise NotImplementedError()
+
+
+class CompareDiffProvider(DiffProvider):
+    """Asks the wiki to render an HTML diff with ``action=compare`` and scrapes the changed lines out of it."""
+
+    def __init__(self,
+                 site: pywikibot.site.BaseSite,
+                 ):
+        self.site = site
+
+    def get_diff(self, change: dict) -> Dict[str, List[str]]:
+        with DIFF_FETCH_TIME.labels('compare').time():
+            html_diff = self.site.compare(old=change['revision']['old'], diff=change['revision']['new'])
+        with DIFF_PARSE_TIME.labels('compare').time():
+            return diff.html_comparator(html_diff)
+
+
+class LocalDiffProvider(DiffProvider):
+    """
+    Fetches the wikitext of both revisions and diffs them locally, skipping the HTML render and parse.
+
+    ``fetch_wikitext`` can be supplied to fetch revisions some other way than one ``site`` request per change, such
+    as ``BatchingRevisionFetcher.fetch``.
+    """
+
+    _class_logger = module_logger.getChild(__qualname__)
+
+    def __init__(self,
+                 site: pywikibot.site.BaseSite,
+                 fetch_wikitext: Optional[Callable[[Iterable[int]], Dict[int, str]]] = None,
+                 ):
+        self._instance_logger = self._class_logger.getChild(str(id(self)))
+        self.site = site
+        if fetch_wikitext is not None:
+            self._fetch_wikitext = fetch_wikitext
+
+    def get_diff(self, change: dict) -> Dict[str, List[str]]:
+        old_revid, new_revid = change['revision']['old'], change['revision']['new']
+        with DIFF_FETCH_TIME.labels('local').time():
+            texts = self._fetch_wikitext([revid for revid in (old_revid, new_revid) if revid])
+        if new_revid not in texts or (old_revid and old_revid not in texts):
+            self._instance_logger.warning("Content of revision %s or %s is unavailable, skipping it",
+                                          old_revid, new_revid)
+            return {'deleted-context': [], 'added-context': []}
+        with DIFF_PARSE_TIME.labels('local').time():
+            return line_diff(texts.get(old_revid, ''), texts[new_revid])
+
+    def _fetch_wikitext(self, revids: Iterable[int]) -> Dict[int, str]:
+        request = self.site.simple_request(action='query', prop='revisions', revids=list(revids),
+                                           rvprop='ids|content', rvslots='main', formatversion=2)
+        return parse_revision_content(request.submit())
+
+
+class CachingDiffProvider(DiffProvider):
+    """Remembers the most recently computed diffs so a change that is retried or seen twice is not fetched again."""
+
+    def __init__(self,
+                 diff_provider: DiffProvider,
+                 max_size: int = 1024,
+                 ):
+        self.diff_provider = diff_provider
+        self._cache: LRUCache[tuple, Dict[str, List[str]]] = LRUCache(max_size)
+
+    def get_diff(self, change: dict) -> Dict[str, List[str]]:
+        key = (change['revision']['old'], change['revision']['new'])
+        cached = self._cache.get(key)
+        if cached is not None:
+            DIFF_CACHE_HITS.inc()
+            return cached
+        DIFF_CACHE_MISSES.inc()
+        computed = self.diff_provider.get_diff(change)
+        self._cache.put(key, computed)
+        return computed
+
+
+class ScheduledDiffProvider(DiffProvider):
+    """
+    Fetches each diff through a ``RequestScheduler``, at the priority ``priority`` gives the change.
+
+    Retries stop after ``retry_deadline`` seconds, if given, and the error is raised for the caller to deal with.
+    """
+
+    def __init__(self,
+                 diff_provider: DiffProvider,
+                 scheduler: RequestScheduler,
+                 priority: Callable[[dict], Priority] = lambda change: Priority.NORMAL,
+                 retry_deadline: Optional[float] = None,
+                 ):
+        self.diff_provider = diff_provider
+        self.scheduler = scheduler
+        self.priority = priority
+        self.retry_deadline = retry_deadline
+
+    def get_diff(self, change: dict) -> Dict[str, List[str]]:
+        return self.scheduler.call(self.diff_provider.get_diff, change, priority=self.priority(change),
+                                   retry_deadline=self.retry_deadline)
+
+
+def parse_revision_content(response: dict) -> Dict[int, str]:
+    """Map revision ids to wikitext from a ``prop=revisions`` response, leaving out hidden or missing revisions."""
+    contents = {}
+    for page in response.get('query', {}).get('pages', []):
+        for revision in page.get('revisions', []):
+            main_slot = revision.get('slots', {}).get('main', {})
+            if 'content' in main_slot:
+                contents[revision['revid']] = main_slot['content']
+    return contents
+
+
+def line_diff(old_text: str, new_text: str) -> Dict[str, List[str]]:
+    """
+    Compute which lines were deleted from ``old_text`` and added in ``new_text``.
+
+    The result has the same shape as ``pywikibot.diff.html_comparator``: a changed line appears in full on both
+    sides, and unchanged lines are left out. Edits are usually confined to a small part of the page, so the
+    common leading and trailing lines are stripped before handing the rest to difflib.
+    """
+    old_lines = old_text.split('\n')
+    new_lines = new_text.split('\n')
+
+    prefix = 0
+    shortest = min(len(old_lines), len(new_lines))
+    while prefix < shortest and old_lines[prefix] == new_lines[prefix]:
+        prefix += 1
+    suffix = 0
+    while suffix < shortest - prefix and old_lines[-1 - suffix] == new_lines[-1 - suffix]:
+        suffix += 1
+
+    old_lines = old_lines[prefix:len(old_lines) - suffix]
+    new_lines = new_lines[prefix:len(new_lines) - suffix]
+
+    comparands: Dict[str, List[str]] = {'deleted-context': [], 'added-context': []}
+    matcher = SequenceMatcher(None, old_lines, new_lines, autojunk=False)
+    for tag, old_start, old_end, new_start, new_end in matcher.get_opcodes():
+        if tag == 'equal':
+            continue
+        comparands['deleted-context'].extend(old_lines[old_start:old_end])
+        comparands['added-context'].extend(new_lines[new_start:new_end])
+    return comparands
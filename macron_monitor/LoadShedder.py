@@ -0,0 +1,232 @@
+import ipaddress
+import json
+import random
+import re
+import threading
+from enum import IntEnum
+from pathlib import Path
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from prometheus_client import Counter, Gauge
+
+from macron_monitor import module_logger
+
+SHED_LEVEL = Gauge('load_shedding_level', 'How hard the monitor is shedding load: 0 none, 1 deferring, 2 sampling')
+EDITS_DEFERRED = Counter('load_shedding_edits_deferred',
+                         'Unlikely edits written to the spill file to be processed once the lag falls')
+EDITS_SAMPLED = Counter('load_shedding_edits_sampled',
+                        'Unlikely edits kept in the spill file while sampling, rather than dropped')
+EDITS_DROPPED = Counter('load_shedding_edits_dropped', 'Unlikely edits dropped while sampling, never to be processed')
+EDITS_CAUGHT_UP = Counter('load_shedding_edits_caught_up', 'Edits read back from the spill file and processed')
+EDITS_RETRIED = Counter('load_shedding_edits_retried',
+                        'Edits written to the spill file because fetching their diff failed, to be tried again')
+SPILL_BACKLOG = Gauge('load_shedding_spill_backlog', 'Edits in the spill file waiting to be caught up')
+
+# the parts of a change needed to process it later
+SPILLED_FIELDS = ('title', 'user', 'revision', 'timestamp', 'notify_url', 'server_name', 'length')
+
+# temporary accounts, given to logged out editors in place of showing their IP address
+_temporary_account_regex = re.compile(r'~\d{4}-[\d-]+$')
+
+
+class ShedLevel(IntEnum):
+    NONE = 0
+    DEFER = 1  # unlikely edits go to the spill file
+    SAMPLE = 2  # a sample of unlikely edits go to the spill file, the rest are dropped
+
+
+def is_anonymous(user: str) -> bool:
+    """Whether ``user`` is a logged out editor: an IP address or a temporary account."""
+    if _temporary_account_regex.match(user):
+        return True
+    try:
+        ipaddress.ip_address(user)
+    except ValueError:
+        return False
+    return True
+
+
+def size_change(change) -> Optional[int]:
+    """How many bytes ``change`` added to the page, or None if the stream didn't say."""
+    try:
+        length = change['length']
+    except KeyError:
+        return None
+    if not length or length.get('old') is None or length.get('new') is None:
+        return None
+    return length['new'] - length['old']
+
+
+class SpillFile:
+    """
+    Changes put off for later, as JSON lines appended to ``path``.
+
+    Changes are read back oldest first. Once all of them have been read the file is emptied, so it doesn't grow while
+    the monitor keeps up. Changes already in the file when it is opened are read back too, which means a restart in
+    the middle of catching up may process some of them twice. Changes can be appended and read from different
+    threads.
+    """
+    _class_logger = module_logger.getChild(__qualname__)
+
+    def __init__(self,
+                 path: str,
+                 ) -> None:
+        self._instance_logger = self._class_logger.getChild(str(id(self)))
+        self.path = path
+        self.pending = 0
+        if Path(path).exists():
+            with open(path, 'r', encoding='utf-8') as existing:
+                self.pending = sum(1 for line in existing if line.strip())
+        # line buffered, so a crash loses at most the change being written
+        self._writer = open(path, 'a', encoding='utf-8', buffering=1)
+        self._read_offset = 0
+        self._lock = threading.Lock()
+        SPILL_BACKLOG.set(self.pending)
+
+    def append(self, change) -> None:
+        record = {}
+        for field in SPILLED_FIELDS:
+            try:
+                record[field] = change[field]
+            except KeyError:
+                continue
+        with self._lock:
+            self._writer.write(json.dumps(record) + '\n')
+            self.pending += 1
+            SPILL_BACKLOG.set(self.pending)
+
+    def read(self, limit: int) -> List[dict]:
+        """Up to ``limit`` of the oldest changes not read yet."""
+        with self._lock:
+            return self._read(limit)
+
+    def _read(self, limit: int) -> List[dict]:
+        if self.pending <= 0:
+            return []
+        changes = []
+        with open(self.path, 'r', encoding='utf-8') as spilled:
+            spilled.seek(self._read_offset)
+            while len(changes) < limit:
+                line = spilled.readline()
+                if not line:
+                    break
+                if not line.strip():
+                    continue
+                try:
+                    changes.append(json.loads(line))
+                except ValueError as e:
+                    self._instance_logger.warning("Skipping an unreadable line in %s", self.path, exc_info=e)
+                    self.pending -= 1
+            self._read_offset = spilled.tell()
+        self.pending = max(0, self.pending - len(changes))
+        if self.pending == 0:
+            self._writer.truncate(0)
+            self._read_offset = 0
+        SPILL_BACKLOG.set(self.pending)
+        return changes
+
+    def close(self) -> None:
+        self._writer.close()
+
+
+class LoadShedder:
+    """
+    Puts off edits that are unlikely to have removed macrons while the monitor is falling behind the stream.
+
+    The ``lag`` callable gives the current stream lag in seconds. Below ``defer_lag`` every edit is processed. Above
+    it, only likely edits are processed straight away: edits to WPNZ articles, edits by logged out editors, and edits
+    that made the page at most ``likely_shrink_bytes`` smaller, since taking a macron off a letter saves a byte. The
+    rest are written to a spill file. Above ``sample_lag`` only ``sample_rate`` of the rest are written to the spill
+    file and the others are dropped, so the spill file can't outgrow what the monitor could ever catch up on.
+
+    Once the lag falls below half of ``defer_lag``, ``catch_up_batch`` spilled edits are processed after each live
+    one until the spill file is empty. Edits that couldn't be processed, e.g. because the API kept failing, are put
+    in the spill file by ``retry_later`` to be tried again the same way.
+    """
+    _class_logger = module_logger.getChild(__qualname__)
+
+    def __init__(self,
+                 spill_file: str,
+                 lag: Callable[[], float],
+                 wpnz_article_provider=None,
+                 defer_lag: float = 300.0,
+                 sample_lag: float = 1800.0,
+                 sample_rate: float = 0.1,
+                 likely_shrink_bytes: int = 100,
+                 catch_up_batch: int = 2,
+                 ) -> None:
+        self._instance_logger = self._class_logger.getChild(str(id(self)))
+        self.spill = SpillFile(spill_file)
+        self.lag = lag
+        self.wpnz_article_provider = wpnz_article_provider
+        self.defer_lag = defer_lag
+        self.sample_lag = sample_lag
+        self.sample_rate = sample_rate
+        self.likely_shrink_bytes = likely_shrink_bytes
+        self.catch_up_batch = catch_up_batch
+        self.level = ShedLevel.NONE
+        SHED_LEVEL.set(self.level)
+        if self.spill.pending:
+            self._instance_logger.info("%d deferred edits in %s will be caught up", self.spill.pending, spill_file)
+
+    def filter(self, changes: Iterable) -> Iterator:
+        """Yield the changes to process now from ``changes``, with spilled changes mixed in while catching up."""
+        for change in changes:
+            lag = self.lag()
+            self._set_level(lag)
+            if self.level == ShedLevel.NONE or self.is_likely(change):
+                yield change
+            elif self.level == ShedLevel.DEFER:
+                self.spill.append(change)
+                EDITS_DEFERRED.inc()
+            elif random.random() < self.sample_rate:
+                self.spill.append(change)
+                EDITS_SAMPLED.inc()
+            else:
+                EDITS_DROPPED.inc()
+
+            if lag < self.defer_lag / 2:
+                for spilled in self.spill.read(self.catch_up_batch):
+                    spilled['catch_up'] = True
+                    yield spilled
+
+    def is_likely(self, change) -> bool:
+        """Whether the stream metadata of ``change`` makes it likely to have removed macrons."""
+        if self.wpnz_article_provider is not None and change['title'] in self.wpnz_article_provider.article_titles:
+            return True
+        if is_anonymous(change['user']):
+            return True
+        size = size_change(change)
+        return size is not None and -self.likely_shrink_bytes <= size < 0
+
+    @staticmethod
+    def is_catch_up(change) -> bool:
+        """Whether ``change`` was read back from the spill file rather than the stream."""
+        return isinstance(change, dict) and change.get('catch_up', False)
+
+    def caught_up(self, change) -> bool:
+        """Count ``change`` as caught up if it came from the spill file, and say whether it did."""
+        if not self.is_catch_up(change):
+            return False
+        EDITS_CAUGHT_UP.inc()
+        return True
+
+    def retry_later(self, change) -> None:
+        """Put ``change`` in the spill file, to be processed again once the monitor is catching up."""
+        self.spill.append(change)
+        EDITS_RETRIED.inc()
+
+    def close(self) -> None:
+        self.spill.close()
+
+    def _set_level(self, lag: float) -> None:
+        if lag >= self.sample_lag:
+            level = ShedLevel.SAMPLE
+        elif lag >= self.defer_lag:
+            level = ShedLevel.DEFER
+        else:
+            level = ShedLevel.NONE
+        if level != self.level:
+            self._instance_logger.info("Stream lag is %.0fs, load shedding is now %s", lag, level.name.lower())
+            self.level = level
+            SHED_LEVEL.set(level)
@@ -0,0 +1,87 @@
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Tuple
+
+from unidecode import unidecode
+
+from macron_monitor import contains_macron, count_macrons
+
+_word_regex = re.compile(r'\w+')
+
+
+def changed_span(old: str, new: str) -> Tuple[str, str]:
+    """
+    Cut the common prefix and suffix off ``old`` and ``new``, leaving the part of each that changed.
+
+    The cut is moved back to the nearest word boundary so a word that only partly changed, like ``Māori`` becoming
+    ``Maori``, is kept whole on both sides.
+    """
+    limit = min(len(old), len(new))
+    prefix = _common_length(lambda n: old[:n] == new[:n], limit)
+    suffix = _common_length(lambda n: old[len(old) - n:] == new[len(new) - n:], limit - prefix)
+    if prefix > 0 and (_is_word_char(old, prefix) or _is_word_char(new, prefix)):
+        while prefix > 0 and _is_word_char(old, prefix - 1):
+            prefix -= 1
+    if suffix > 0 and (_is_word_char(old, len(old) - suffix - 1) or _is_word_char(new, len(new) - suffix - 1)):
+        while suffix > 0 and _is_word_char(old, len(old) - suffix):
+            suffix -= 1
+    return old[prefix:len(old) - suffix], new[prefix:len(new) - suffix]
+
+
+def stripped_macron_words(deleted: List[str], added: List[str]) -> List[Tuple[str, str]]:
+    """
+    Find the words that lost macrons between ``deleted`` and ``added`` lines, as ``(old word, new word)`` pairs.
+
+    Only the changed span of the text is tokenized. Words that appear in both spans are cancelled out, since they
+    were moved or left alone. What is left is aligned on the word's folded form, so ``Māori`` in the deleted span
+    pairs with ``Maori`` in the added span, and each pair where the new word has fewer macrons is reported once for
+    every time it happened. Each step is a single pass over the tokens, so this is linear in the size of the change.
+    """
+    old, new = changed_span('\n'.join(deleted), '\n'.join(added))
+    if not contains_macron(old):
+        return []
+
+    old_words = Counter(_word_regex.findall(old))
+    new_words = Counter(_word_regex.findall(new))
+    removed = old_words - new_words
+    inserted = new_words - old_words
+
+    inserted_by_fold: Dict[str, List[str]] = defaultdict(list)
+    for word in inserted:
+        inserted_by_fold[_fold(word)].append(word)
+
+    stripped = []
+    for word, count in removed.items():
+        if not contains_macron(word):
+            continue
+        macrons = count_macrons(word)
+        for replacement in inserted_by_fold.get(_fold(word), ()):
+            if count <= 0:
+                break
+            if count_macrons(replacement) >= macrons:
+                continue
+            pairs = min(count, inserted[replacement])
+            stripped.extend([(word, replacement)] * pairs)
+            inserted[replacement] -= pairs
+            count -= pairs
+    return stripped
+
+
+def _fold(word: str) -> str:
+    return unidecode(word).lower()
+
+
+def _is_word_char(text: str, index: int) -> bool:
+    return 0 <= index < len(text) and (text[index].isalnum() or text[index] == '_')
+
+
+def _common_length(matches, limit: int) -> int:
+    """The largest n <= limit for which matches(n), by binary search, so the slices are compared in C."""
+    low, high = 0, limit
+    while low < high:
+        middle = (low + high + 1) // 2
+        if matches(middle):
+            low = middle
+        else:
+            high = middle - 1
+    return low
@@ -1,156 +1,751 @@
+import time
+
+# taken before anything heavy is imported, so --measure-startup can report how long the imports took
+IMPORTS_STARTED = time.monotonic()
+
+import functools
+import importlib
+import itertools
 import json
 import logging
-import time
+import os
+import queue
+import tempfile
+import threading
+from concurrent.futures import Future
 from pathlib import Path
-from typing import List
+from typing import Callable, Dict, Iterable, Iterator, List, Optional
 
 import click
 import pywikibot
-from prometheus_client import start_http_server, Summary, Counter, Gauge
-from pywikibot import diff
+import requests
+from prometheus_client import Counter, Gauge, Histogram
 from pywikibot.bot import SingleSiteBot
-from pywikibot.comms.eventstreams import EventStreams
 
-from macron_monitor import module_logger, SuspiciousRev
+from macron_monitor import module_logger, SuspiciousRev, log_worker_to_console
+from macron_monitor.AlertJournal import AlertJournal
+from macron_monitor.AlertWriter import AlertWriter
+from macron_monitor.Backfill import Backfill
+from macron_monitor.ChangePipeline import ChangePipeline
+from macron_monitor.DiffAnalysis import DiffAnalysis
+from macron_monitor.DiffProvider import DiffProvider, CompareDiffProvider, LocalDiffProvider, CachingDiffProvider, \
+    ScheduledDiffProvider
+from macron_monitor.FastEventStream import FastEventStream
+from macron_monitor.LoadShedder import LoadShedder
+from macron_monitor.LRUCache import LRUCache
+from macron_monitor.MetricsServer import start_metrics_server
+from macron_monitor.StreamCheckpoint import StreamCheckpoint
+from macron_monitor.RequestScheduler import DEFAULT_RATES, Priority, RateLimitedError, RequestScheduler
+from macron_monitor.RevisionFetcher import BatchingRevisionFetcher
+from macron_monitor.SiteConfig import SiteConfig, load_site_configs
+from macron_monitor.StartupTimer import StartupTimer
 from macron_monitor.WPNZArticleProvider import WPNZArticleProvider
 from macron_monitor.detectors import Detector
-from macron_monitor.detectors.MaoriWordDetector import MaoriWordDetector
-from macron_monitor.detectors.RemovedMacronDetector import RemovedMacronDetector
-from macron_monitor.detectors.UnMacronedLinkDetector import UnMacronedLinkDetector
 
-HANDLE_TIME = Summary('change_processing_seconds', 'Time spent processing a change')
+HANDLE_TIME = Histogram('change_processing_seconds',
+                        'Time spent fetching the diff of a change and running the detectors')
+STREAM_WAIT_TIME = Histogram('stream_wait_seconds', 'Time spent waiting for the next change from the stream')
+DETECTOR_TIME = Histogram('detector_seconds', 'Time spent in each detector', ['detector'],
+                          buckets=(.0001, .00025, .0005, .001, .0025, .005, .01, .025, .05, .1, .25, float('inf')))
+API_ERRORS = Counter('api_errors', 'Errors talking to the Wikimedia API while processing a change', ['type'])
+EVENTS_FILTERED = Counter('stream_events_filtered', 'Events from the stream that are not mainspace, non-bot edits')
+CHANGES_PROCESSED = Counter('changes_processed', 'Changes that had their diff run through the detectors')
 DETECTIONS_COUNT = Counter('suspicious_edits_detected', 'Suspicious edits detected')
-SUCCESSFUL_ALERT_PAGE_UPDATE_COUNT = Counter('alert_page_edit_successful', 'Successful edits to the alert page')
+DUPLICATE_EVENTS_DROPPED = Counter('duplicate_events_dropped',
+                                   'Events dropped because their revision had already been seen')
+CAUGHT_UP_LAG_SECONDS = 60
 STREAM_LAG = Gauge('change_stream_lag_seconds',
                    'Difference in seconds between wallclock and most recently processed record timestamp')
 
+DIFF_BACKENDS = ['compare', 'local']
+STREAM_BACKENDS = ['pywikibot', 'fast']
+
+# how long fetching a diff may spend retrying before the change is left to be retried from the spill file
+DIFF_RETRY_DEADLINE = 30
+
+# how long to hold events back at startup waiting for the WPNZ titles before running the detectors without them
+STARTUP_TIMEOUT = 120
+
+# detectors are only imported when they are enabled
+DETECTORS = {
+    'RemovedMacronDetector': 'macron_monitor.detectors.RemovedMacronDetector',
+    'UnMacronedLinkDetector': 'macron_monitor.detectors.UnMacronedLinkDetector',
+    'MaoriWordDetector': 'macron_monitor.detectors.MaoriWordDetector',
+}
+# detectors that take a WPNZArticleProvider
+WPNZ_DETECTORS = {'RemovedMacronDetector', 'UnMacronedLinkDetector', 'MaoriWordDetector'}
+
 
 class MacronMonitor(SingleSiteBot):
     _class_logger = module_logger.getChild(__qualname__)
 
     def __init__(self,
                  offline: bool = False,
+                 workers: int = 1,
+                 queue_size: int = 64,
+                 diff_backend: str = 'compare',
+                 batch_window: float = 0.005,
+                 stream_backend: str = 'pywikibot',
+                 alert_flush_interval: float = 30.0,
+                 alert_batch_size: int = 20,
+                 checkpoint_file: Optional[str] = None,
+                 wpnz_snapshot_file: Optional[str] = None,
+                 wpnz_follow_snapshot: bool = False,
+                 site_config: Optional[SiteConfig] = None,
+                 api_rate: float = DEFAULT_RATES['api'][0],
+                 api_max_concurrency: int = 16,
+                 spill_file: Optional[str] = None,
+                 shed_lag: float = 300.0,
+                 sample_lag: float = 1800.0,
+                 sample_rate: float = 0.1,
+                 detector_processes: int = 0,
+                 detector_budget: float = 2.0,
+                 detector_budgets: Optional[Dict[str, float]] = None,
+                 alert_journal_file: Optional[str] = None,
                  **kwargs) -> None:
         self._instance_logger = self._class_logger.getChild(str(id(self)))
+        self.site_config = site_config if site_config is not None else SiteConfig()
+        self.startup = StartupTimer(IMPORTS_STARTED)
+        self.startup.end('imports')
+
+        # the site is created below, so don't let SingleSiteBot create a default one first
+        super().__init__(site=None, **kwargs)
 
-        super().__init__(**kwargs)
+        with self.startup.phase('create_site'):
+            self.site = self._create_site()
+        # logging in waits on the network, so it carries on while everything else starts up
+        self._logged_in: Future = Future()
+        login = threading.Thread(target=self._login, daemon=True, name='background_Login')
+        login.start()
 
-        self.site = pywikibot.Site('en', 'wikipedia', user='MacronMonitor')
-        self.site.login()
-        self._instance_logger.info("Logged in to wikipedia")
+        # every request to the wiki and PetScan goes through this, so they all back off together
+        self.scheduler = self._create_scheduler(api_rate, api_max_concurrency)
 
         self.offline = offline
         if self.offline:
             self._instance_logger.info("Running in offline mode")
+        self.alert_writer = self._create_alert_writer(offline, alert_flush_interval, alert_batch_size)
+        self.alert_journal = AlertJournal(alert_journal_file) if alert_journal_file else None
+
+        self.wpnz_article_provider = None
+        # a monitor without detectors, like one that only writes alerts for others, never fetches a diff
+        self.diff_provider: Optional[DiffProvider] = None
+        if self.site_config.detectors:
+            self.diff_provider = CachingDiffProvider(self._create_diff_provider(diff_backend, batch_window))
+            self._instance_logger.info("Using the '%s' diff backend", diff_backend)
+        self._seen_revisions: LRUCache[tuple, bool] = LRUCache(10000)
+
+        self.workers = workers
+        self.queue_size = queue_size
+
+        self._wpnz_follow_snapshot = wpnz_follow_snapshot
+        self._snapshot_directory = None
+        if detector_processes and not wpnz_snapshot_file and self._needs_wpnz_articles():
+            # the detector processes follow the snapshot this process saves, rather than each querying PetScan
+            self._snapshot_directory = tempfile.TemporaryDirectory(prefix='macron-monitor-')
+            wpnz_snapshot_file = os.path.join(self._snapshot_directory.name, 'wpnz-articles.json')
+        if self._needs_wpnz_articles():
+            self.startup.start('wpnz_titles')
+            self.wpnz_article_provider = self._create_wpnz_article_provider(wpnz_snapshot_file)
+            self.startup.end_when_set('wpnz_titles', self.wpnz_article_provider.ready)
+            self._instance_logger.info("Created the WPNZArticleProvider")
+
+        self.detector_pool = None
+        with self.startup.phase('create_detectors'):
+            if detector_processes:
+                from macron_monitor.DetectorPool import DetectorPool
+                self._instance_logger.info("Running the detectors in %d processes", detector_processes)
+                self.detector_pool = DetectorPool(
+                    _create_pooled_detectors,
+                    (self.site_config, wpnz_snapshot_file, module_logger.getEffectiveLevel()),
+                    processes=detector_processes, budget=detector_budget, budgets=detector_budgets)
+                # the detectors themselves live in the pool's processes
+                self.detectors = []
+            else:
+                self.detectors = self._create_detectors(self.wpnz_article_provider, self.site_config)
+        for detector in self.detectors:
+            if hasattr(detector, 'vocabulary_ready'):
+                self.startup.start(f'{detector.name}_vocabulary')
+                self.startup.end_when_set(f'{detector.name}_vocabulary', detector.vocabulary_ready)
+
+        self.checkpoint = StreamCheckpoint(checkpoint_file) if checkpoint_file else None
+        self._catching_up = False
+        self._stream_lag = 0.0
+        self.load_shedder = LoadShedder(spill_file, lambda: self._stream_lag, self.wpnz_article_provider,
+                                        defer_lag=shed_lag, sample_lag=sample_lag,
+                                        sample_rate=sample_rate) if spill_file else None
+        self.stream_backend = stream_backend
+        self.measure_startup = False
+        self._stopping = threading.Event()
+
+    def _login(self) -> None:
+        try:
+            with self.startup.phase('login'):
+                self.site.login()
+        except Exception as e:
+            self._logged_in.set_exception(e)
+            return
+        self._instance_logger.info("Logged in to %s", self.site_config.server_name)
+        self._logged_in.set_result(None)
+
+    def wait_until_ready(self, timeout: float = STARTUP_TIMEOUT) -> None:
+        """
+        Wait for the background parts of startup: logging in, and the WPNZ titles and anything built from them.
+
+        A failed login is raised here. If the titles aren't ready within ``timeout`` seconds the detectors run
+        without them, and WPNZ article checks match nothing until they arrive.
+        """
+        self._logged_in.result()
+        deadline = time.monotonic() + timeout
+        if self.detector_pool is not None:
+            with self.startup.phase('detector_processes'):
+                if not self.detector_pool.wait_until_ready(timeout):
+                    self._instance_logger.warning("Detector processes are still starting, changes will wait for them")
+        if self.wpnz_article_provider is not None and not self.wpnz_article_provider.wait_until_ready(timeout):
+            self._instance_logger.warning("WPNZ article checks will match nothing until the first refresh finishes")
+            return
+        for detector in self.detectors:
+            if hasattr(detector, 'vocabulary_ready'):
+                detector.vocabulary_ready.wait(max(0.0, deadline - time.monotonic()))
+
+    def stop(self) -> None:
+        """Stop reading the stream. Changes that have already been read are still processed."""
+        self._stopping.set()
+
+    def _create_site(self) -> pywikibot.site.BaseSite:
+        return pywikibot.Site(self.site_config.code, self.site_config.family, user='MacronMonitor')
+
+    def _create_scheduler(self, api_rate: float, api_max_concurrency: int) -> RequestScheduler:
+        return RequestScheduler(rates=dict(DEFAULT_RATES, api=(api_rate, api_rate)),
+                                max_concurrency=api_max_concurrency)
+
+    def _create_alert_writer(self, offline: bool, flush_interval: float, batch_size: int) -> AlertWriter:
+        return AlertWriter(self.site, offline=offline, flush_interval=flush_interval, batch_size=batch_size,
+                           scheduler=self.scheduler)
 
-        self.wpnz_article_provider = WPNZArticleProvider()
-        self._instance_logger.info("Created the WPNZArticleProvider")
+    def _create_wpnz_article_provider(self, snapshot_file: Optional[str]) -> WPNZArticleProvider:
+        return WPNZArticleProvider(snapshot_file=snapshot_file, follow_snapshot=self._wpnz_follow_snapshot,
+                                   scheduler=self.scheduler)
 
-        self.detectors: List[Detector] = [
-            RemovedMacronDetector(self.wpnz_article_provider),
-            UnMacronedLinkDetector(self.wpnz_article_provider),
-            # MaoriWordDetector(),
-        ]
+    def _diff_priority(self, change) -> Priority:
+        if self.wpnz_article_provider is not None and change['title'] in self.wpnz_article_provider.article_titles:
+            return Priority.HIGH
+        return Priority.NORMAL
 
-        self.stream = EventStreams(
+    @staticmethod
+    def _create_detectors(wpnz_article_provider: Optional[WPNZArticleProvider],
+                          site_config: Optional[SiteConfig] = None) -> List[Detector]:
+        site_config = site_config if site_config is not None else SiteConfig()
+        detectors = []
+        for name in site_config.detectors:
+            if name not in DETECTORS:
+                raise ValueError(f"Unknown detector '{name}' for {site_config.server_name}")
+            detector_class = getattr(importlib.import_module(DETECTORS[name]), name)
+            detector = detector_class(wpnz_article_provider) if name in WPNZ_DETECTORS else detector_class()
+            if site_config.alert_page:
+                detector.alert_page = site_config.alert_page
+            detectors.append(detector)
+        return detectors
+
+    def _needs_wpnz_articles(self) -> bool:
+        return bool(WPNZ_DETECTORS.intersection(self.site_config.detectors))
+
+    def _server_names(self) -> List[str]:
+        return [self.site_config.server_name]
+
+    def _server_name(self, change) -> str:
+        try:
+            return change['server_name'] or self.site_config.server_name
+        except KeyError:
+            return self.site_config.server_name
+
+    def _create_stream(self, stream_backend: str) -> Iterable:
+        # the local clock rather than the wiki's, so opening the stream doesn't wait on an API call
+        since = pywikibot.Timestamp.utcnow()
+        last_event_id = None
+        saved = self.checkpoint.load() if self.checkpoint else None
+        if saved:
+            since = pywikibot.Timestamp.utcfromtimestamp(saved['timestamp'])
+            last_event_id = saved.get('event_id')
+            self._catching_up = True
+            self._instance_logger.info("Resuming the stream from the checkpoint at %s", since.isoformat())
+
+        if stream_backend == 'fast':
+            return FastEventStream(server_name=self._server_names(), since=since.isoformat(),
+                                   last_event_id=last_event_id)
+        from pywikibot.comms.eventstreams import EventStreams
+        stream = EventStreams(
             streams=['recentchange', 'revision-create'],
-            since=self.site.getcurrenttimestamp(),
+            since=since,
         )
+        stream.register_filter(self._is_wanted_event)
+        return stream
 
-    def run(self) -> None:
-        self.stream.register_filter(server_name='en.wikipedia.org', type='edit', namespace=0, bot=False)
-        self._instance_logger.info("Beginning to listen for edits")
+    def _is_wanted_event(self, event: dict) -> bool:
+        wanted = (event.get('server_name') in self._server_names() and event.get('type') == 'edit'
+                  and event.get('namespace') == 0 and event.get('bot') is False)
+        if not wanted:
+            EVENTS_FILTERED.inc()
+        return wanted
+
+    @staticmethod
+    def _timed_stream(stream: Iterable) -> Iterable:
+        events = iter(stream)
         while True:
-            change = next(iter(self.stream))
-            self._handle_change(change)
+            with STREAM_WAIT_TIME.time():
+                try:
+                    change = next(events)
+                except StopIteration:
+                    return
+            yield change
+
+    def _create_diff_provider(self, diff_backend: str, batch_window: float) -> DiffProvider:
+        if diff_backend == 'local':
+            # the fetcher schedules each batched request itself, rather than each change taking a token
+            fetcher = BatchingRevisionFetcher(self.site.base_url(self.site.apipath()), window=batch_window,
+                                              scheduler=self.scheduler, retry_deadline=DIFF_RETRY_DEADLINE)
+            return LocalDiffProvider(self.site, fetch_wikitext=fetcher.fetch)
+        return ScheduledDiffProvider(CompareDiffProvider(self.site), self.scheduler, self._diff_priority,
+                                     retry_deadline=DIFF_RETRY_DEADLINE)
+
+    def _start_stream(self) -> Iterator:
+        """
+        Open the stream and start reading it straight away, holding events back until ``wait_until_ready`` returns.
+
+        Returns the changes to process, with duplicates dropped and load shed while lagging, ending early if ``stop``
+        is called.
+        """
+        self.startup.start('stream_first_event')
+        self.stream = self._create_stream(self.stream_backend)
+        self._instance_logger.info("Using the '%s' stream backend", self.stream_backend)
+        self._instance_logger.info("Beginning to listen for edits")
+        changes = self._buffer_until_ready(self._timed_stream(self.stream))
+        with self.startup.phase('wait_until_ready'):
+            self.wait_until_ready()
+        changes = (change for change in changes if not self._is_duplicate(change))
+        if self.load_shedder:
+            changes = self.load_shedder.filter(changes)
+        return itertools.takewhile(lambda _: not self._stopping.is_set(), changes)
+
+    def _buffer_until_ready(self, stream: Iterable) -> Iterator:
+        """
+        Read ``stream`` on a background thread until the caller is ready, then carry on reading it on the caller's.
+
+        The returned iterator yields the events read in the background first. Once it is first read from, the
+        background reader stops after the next event, and the stream is only read from the caller's thread after that.
+        """
+        events = iter(stream)
+        buffered: queue.Queue = queue.Queue()
+        ready = threading.Event()
+        handed_over = object()
+        ended = object()
+        failures = []
+
+        def read() -> None:
+            try:
+                for event in events:
+                    self.startup.end('stream_first_event')
+                    buffered.put(event)
+                    if ready.is_set():
+                        buffered.put(handed_over)
+                        return
+            except Exception as e:
+                failures.append(e)
+            buffered.put(ended)
+
+        reader = threading.Thread(target=read, daemon=True, name='background_StartupBuffer')
+        reader.start()
+
+        def replay() -> Iterator:
+            ready.set()
+            while True:
+                event = buffered.get()
+                if event is ended:
+                    if failures:
+                        raise failures[0]
+                    return
+                if event is handed_over:
+                    break
+                yield event
+            yield from events
+
+        return replay()
+
+    def run(self) -> None:
+        changes = self._start_stream()
+        try:
+            if self.workers > 1:
+                self._instance_logger.info("Processing changes with %d concurrent workers", self.workers)
+                pipeline = ChangePipeline(self._process_change, self._emit_alerts,
+                                          workers=self.workers, queue_size=self.queue_size)
+                pipeline.run(changes)
+                return
+
+            for change in changes:
+                self._handle_change(change)
+        finally:
+            self.alert_writer.close()
+            if self.checkpoint:
+                self.checkpoint.close()
+            if self.load_shedder:
+                self.load_shedder.close()
+            self.close_detectors()
+            if self.alert_journal:
+                self.alert_journal.close()
+
+    def close_detectors(self) -> None:
+        """Stop the detector processes, if the detectors run in them."""
+        if self.detector_pool:
+            self.detector_pool.close()
+        if self._snapshot_directory:
+            self._snapshot_directory.cleanup()
+
+    def _is_duplicate(self, change) -> bool:
+        # we subscribe to more than one stream, so the same revision can turn up more than once
+        if self._seen_revisions.put_if_absent((self._server_name(change), change['revision']['new']), True):
+            return False
+        DUPLICATE_EVENTS_DROPPED.inc()
+        self._instance_logger.debug("Dropping duplicate event for revision %s", change['revision']['new'])
+        return True
 
-    @HANDLE_TIME.time()
     def _handle_change(self, change):
+        self._emit_alerts(change, self._process_change(change))
+
+    @HANDLE_TIME.time()
+    def _process_change(self, change) -> Optional[List[SuspiciousRev]]:
+        """Run the detectors on ``change``, returning None if its diff couldn't be fetched or they didn't finish."""
+        if self.diff_provider is None:
+            CHANGES_PROCESSED.inc()
+            return []
         try:
-            STREAM_LAG.set(time.time() - change['timestamp'])
             self._instance_logger.debug('Detected a change to [[%s]] (%s) by %s', change['title'], change['notify_url'],
                                         change['user'])
-            html_diff = self.site.compare(old=change['revision']['old'], diff=change['revision']['new'])
-            parsed_diff = diff.html_comparator(html_diff)
+            parsed_diff = self.diff_provider.get_diff(change)
             self._instance_logger.debug('Collected a diff: %s', parsed_diff)
 
-            detected_issues = [detector.detect(change, parsed_diff) for detector in self.detectors]
+            if self.detector_pool is not None:
+                detected_issues = self.detector_pool.detect(change, parsed_diff)
+                if detected_issues is not None:
+                    CHANGES_PROCESSED.inc()
+                return detected_issues
 
-            if any(detected_issues):
-                DETECTIONS_COUNT.inc()
-                for suspicious_rev in detected_issues:
-                    if suspicious_rev is None:
-                        continue
-                    self._update_alert_list(suspicious_rev)
+            analysis = DiffAnalysis(change, parsed_diff, self.wpnz_article_provider)
+            detected_issues: List[SuspiciousRev] = []
+            for detector in self.detectors:
+                with DETECTOR_TIME.labels(detector.name).time():
+                    suspicious_rev = detector.detect(change, parsed_diff, analysis)
+                if suspicious_rev is not None:
+                    detected_issues.append(suspicious_rev)
+            CHANGES_PROCESSED.inc()
+            return detected_issues
 
-        except pywikibot.exceptions.APIError as apierror:
+        except (pywikibot.exceptions.Error, requests.RequestException, RateLimitedError) as apierror:
+            API_ERRORS.labels(type(apierror).__name__).inc()
             self._instance_logger.error("Received an exception connecting to the Wikimedia API", exc_info=apierror)
+            return None
 
-    def _update_alert_list(self, alert_data: SuspiciousRev) -> None:
-        print(alert_data.to_string())
-        if self.offline:
+    def _emit_alerts(self, change, detected_issues: Optional[List[SuspiciousRev]]) -> None:
+        self.startup.end('first_event_processed')
+        if self.measure_startup:
+            self.stop()
+        if detected_issues is None:
+            self._retry_later(change)
+            detected_issues = []
+        alerts = []
+        if any(detected_issues):
+            DETECTIONS_COUNT.inc()
+            alerts = self._unsent_alerts(change, detected_issues)
+
+        # edits caught up from the spill file are older than the stream position, so leave the lag and checkpoint be
+        caught_up = self.load_shedder is not None and self.load_shedder.caught_up(change)
+        position = None
+        if self.checkpoint and not caught_up:
+            # the checkpoint only moves past this change once its alerts are on their pages
+            position = self.checkpoint.record(change, holds=len(alerts))
+        for suspicious_rev in alerts:
+            self._send_alert(suspicious_rev, change, position)
+        if caught_up:
             return
-        page = pywikibot.Page(self.site,
-                              alert_data.alert_page,
-                              # 'User:MacronMonitor/Alerts'
-                              )
-        current_list = page.get()
-
-        new_content = current_list.replace('==Alerts==\n', f'==Alerts==\n{alert_data.to_string()}\n')
-        page.text = new_content
-        page.save(
-            summary=f"add alert for edit on page [[{alert_data.title}]]",
-            bot=False,  # mark as not a bot edit so it appears in user watchlists
-            minor=False,
-        )
-        self._instance_logger.info("Added the alert to the alert page")
+        lag = time.time() - change['timestamp']
+        self._stream_lag = lag
+        STREAM_LAG.set(lag)
+        if self._catching_up and lag < CAUGHT_UP_LAG_SECONDS:
+            self._catching_up = False
+            self._instance_logger.info("Caught up with the stream after resuming from the checkpoint")
 
+    def _retry_later(self, change) -> None:
+        if self.load_shedder is None:
+            self._instance_logger.error("Giving up on revision %s of [[%s]], there is no spill file to retry it from",
+                                        change['revision']['new'], change['title'])
+            return
+        self._instance_logger.warning("Will try revision %s of [[%s]] again once the monitor is catching up",
+                                      change['revision']['new'], change['title'])
+        self.load_shedder.retry_later(change)
 
-@click.command()
-@click.option('--log-level', default='INFO', help='Level to use for logging to console')
-@click.option('--oauth-consumer-token', help='Consumer token for login')
-@click.option('--oauth-consumer-secret', help='Consumer secret for login')
-@click.option('--oauth-access-token', help='Access token for login')
-@click.option('--oauth-access-secret', help='Access secret for login')
-@click.option('--oauth-creds-file', help='file in present working directory that contains oauth creds',
-              default="oauth-creds.json")
-@click.option('--offline', help='Disable writing to alert pages', is_flag=True)
-def run(log_level, oauth_consumer_token, oauth_consumer_secret, oauth_access_token, oauth_access_secret,
-        oauth_creds_file, offline):
-    """Simple program that greets NAME for a total of COUNT times."""
-    try:
-        log_handler = logging.StreamHandler()
-        log_handler.setLevel(log_level)
-        formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s',
-                                      datefmt="%Y-%m-%dT%H:%M:%S%z")
-        log_handler.setFormatter(formatter)
-        module_logger.addHandler(log_handler)
-        module_logger.setLevel(log_level)
-
-        if Path(oauth_creds_file).exists():
-            with open(oauth_creds_file, 'r') as creds_file:
-                creds = json.load(creds_file)
-        else:
-            creds = dict()
+    def _unsent_alerts(self, change, detected_issues: List[SuspiciousRev]) -> List[SuspiciousRev]:
+        """The alerts in ``detected_issues`` that the journal hasn't seen sent, e.g. before a restart."""
+        if not self.alert_journal:
+            return detected_issues
+        return [suspicious_rev for suspicious_rev in detected_issues
+                if self.alert_journal.claim(suspicious_rev, self._server_name(change))]
+
+    def _send_alert(self, alert_data: SuspiciousRev, change, position: Optional[int] = None) -> None:
+        """Queue an alert for its page, then journal it and release its checkpoint ``position`` once it is saved."""
+        self._update_alert_list(alert_data, change, functools.partial(self._alert_written, alert_data, change,
+                                                                      position))
+
+    def _alert_written(self, alert_data: SuspiciousRev, change, position: Optional[int]) -> None:
+        if self.alert_journal:
+            self.alert_journal.record(alert_data, self._server_name(change))
+        if position is not None:
+            self.checkpoint.release(position)
+
+    def _update_alert_list(self, alert_data: SuspiciousRev, change=None,
+                           on_written: Optional[Callable[[], None]] = None) -> None:
+        self.alert_writer.add(alert_data, on_written)
+
+
+def _create_pooled_detectors(site_config: SiteConfig, wpnz_snapshot_file: Optional[str],
+                             log_level) -> List[Detector]:
+    """Create the detectors in a ``DetectorPool`` worker, with a WPNZ article list of its own."""
+    log_worker_to_console(log_level)
+    wpnz_article_provider = None
+    if WPNZ_DETECTORS.intersection(site_config.detectors):
+        # reloaded whenever the monitor saves a new snapshot
+        wpnz_article_provider = WPNZArticleProvider(snapshot_file=wpnz_snapshot_file, follow_snapshot=True)
+    detectors = MacronMonitor._create_detectors(wpnz_article_provider, site_config)
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    if wpnz_article_provider is not None:
+        wpnz_article_provider.wait_until_ready(STARTUP_TIMEOUT)
+    for detector in detectors:
+        if hasattr(detector, 'vocabulary_ready'):
+            detector.vocabulary_ready.wait(max(0.0, deadline - time.monotonic()))
+    return detectors
+
+
+def monitor_options(command):
+    """Options shared by every command that runs the detectors."""
+    options = [
+        click.option('--log-level', default='INFO', help='Level to use for logging to console'),
+        click.option('--oauth-consumer-token', help='Consumer token for login'),
+        click.option('--oauth-consumer-secret', help='Consumer secret for login'),
+        click.option('--oauth-access-token', help='Access token for login'),
+        click.option('--oauth-access-secret', help='Access secret for login'),
+        click.option('--oauth-creds-file', help='file in present working directory that contains oauth creds',
+                     default="oauth-creds.json"),
+        click.option('--offline', help='Disable writing to alert pages', is_flag=True),
+        click.option('--workers', default=1, type=click.IntRange(min=1),
+                     help='Number of changes to fetch diffs for and run detectors on concurrently'),
+        click.option('--queue-size', default=64, type=click.IntRange(min=1),
+                     help='Maximum number of changes read but not yet emitted, when using multiple workers'),
+        click.option('--diff-backend', default='compare', type=click.Choice(DIFF_BACKENDS),
+                     help="'compare' to use diffs rendered by the wiki, "
+                          "'local' to diff the revisions' wikitext locally"),
+        click.option('--batch-window-ms', default=5.0, type=click.FloatRange(min=0),
+                     help='How long the local diff backend waits to batch revision fetches from concurrent workers'),
+        click.option('--alert-flush-interval', default=30.0, type=click.FloatRange(min=0),
+                     help='Seconds between writes of queued alerts to the alert pages'),
+        click.option('--alert-batch-size', default=20, type=click.IntRange(min=1),
+                     help='Write queued alerts early once this many are waiting'),
+        click.option('--api-rate', default=DEFAULT_RATES['api'][0], type=click.FloatRange(min=0, min_open=True),
+                     help='Maximum requests per second to the wiki API, shared by diff fetches and alert writes'),
+        click.option('--api-max-concurrency', default=16, type=click.IntRange(min=1),
+                     help='Most API requests to have in flight at once; fewer while the API is slow or erroring'),
+        click.option('--detector-processes', default=0, type=click.IntRange(min=0),
+                     help='Run the detectors in this many worker processes, with a time budget for each call, '
+                          'instead of inline'),
+        click.option('--detector-budget-ms', default=2000.0, type=click.FloatRange(min=0, min_open=True),
+                     help='With --detector-processes, kill a detector call that runs longer than this'),
+        click.option('--detector-budget', multiple=True, metavar='DETECTOR=MS',
+                     help='With --detector-processes, the budget for one detector, overriding --detector-budget-ms'),
+        click.option('--wpnz-snapshot-file', default='wpnz-articles.json',
+                     help="File to keep the WikiProject New Zealand article list in between restarts, "
+                          "or '' to always fetch it"),
+        click.option('--alert-journal', 'alert_journal_file', default='alerts.sqlite3',
+                     help="SQLite database to keep every sent alert in, so an edit is only alerted on once, "
+                          "and to serve them from at /alerts on the metrics port, or '' for none"),
+    ]
+    for option in reversed(options):
+        command = option(command)
+    return command
+
+
+def _configure(log_level, oauth_consumer_token, oauth_consumer_secret, oauth_access_token, oauth_access_secret,
+               oauth_creds_file, **monitor_kwargs) -> dict:
+    """Set up logging and login from the shared options, and return the ones that are for ``MacronMonitor``."""
+    _configure_logging(log_level)
+
+    if Path(oauth_creds_file).exists():
+        with open(oauth_creds_file, 'r') as creds_file:
+            creds = json.load(creds_file)
+    else:
+        creds = dict()
+
+    creds['consumer_token'] = oauth_consumer_token if oauth_consumer_token else creds['consumer_token']
+    creds['consumer_secret'] = oauth_consumer_secret if oauth_consumer_secret else creds['consumer_secret']
+    creds['access_token'] = oauth_access_token if oauth_access_token else creds['access_token']
+    creds['access_secret'] = oauth_access_secret if oauth_access_secret else creds['access_secret']
 
-        creds['consumer_token'] = oauth_consumer_token if oauth_consumer_token else creds['consumer_token']
-        creds['consumer_secret'] = oauth_consumer_secret if oauth_consumer_secret else creds['consumer_secret']
-        creds['access_token'] = oauth_access_token if oauth_access_token else creds['access_token']
-        creds['access_secret'] = oauth_access_secret if oauth_access_secret else creds['access_secret']
+    authentication = (
+    creds['consumer_token'], creds['consumer_secret'], creds['access_token'], creds['access_secret'])
 
-        authentication = (
-        creds['consumer_token'], creds['consumer_secret'], creds['access_token'], creds['access_secret'])
+    pywikibot.config.usernames['wikipedia']['en'] = 'MacronMonitor'
+    pywikibot.config.authenticate['en.wikipedia.org'] = authentication
 
-        pywikibot.config.usernames['wikipedia']['en'] = 'MacronMonitor'
-        pywikibot.config.authenticate['en.wikipedia.org'] = authentication
+    monitor_kwargs['batch_window'] = monitor_kwargs.pop('batch_window_ms') / 1000
+    monitor_kwargs['detector_budget'] = monitor_kwargs.pop('detector_budget_ms') / 1000
+    monitor_kwargs['detector_budgets'] = _parse_budgets(monitor_kwargs.pop('detector_budget'))
+    return monitor_kwargs
 
-        start_http_server(8420)
 
-        bot = MacronMonitor(offline=offline)
+def _configure_logging(log_level) -> None:
+    log_handler = logging.StreamHandler()
+    log_handler.setLevel(log_level)
+    formatter = logging.Formatter('%(asctime)s - %(levelname)s - %(name)s - %(message)s',
+                                  datefmt="%Y-%m-%dT%H:%M:%S%z")
+    log_handler.setFormatter(formatter)
+    module_logger.addHandler(log_handler)
+    module_logger.setLevel(log_level)
+
+
+def _parse_budgets(budgets: Iterable[str]) -> Dict[str, float]:
+    parsed = {}
+    for budget in budgets:
+        name, _, milliseconds = budget.partition('=')
+        if name not in DETECTORS:
+            raise click.BadParameter(f"unknown detector '{name}', expected one of {', '.join(DETECTORS)}",
+                                     param_hint='--detector-budget')
+        try:
+            parsed[name] = float(milliseconds) / 1000
+        except ValueError:
+            raise click.BadParameter(f"expected DETECTOR=MS, got '{budget}'", param_hint='--detector-budget')
+    return parsed
+
+
+@click.group()
+def cli():
+    """Watch Wikipedia edits for macrons being removed from te reo Māori words."""
+
+
+@cli.command()
+@monitor_options
+@click.option('--stream-backend', default='pywikibot', type=click.Choice(STREAM_BACKENDS),
+              help="'pywikibot' to use pywikibot's EventStreams, 'fast' to filter the raw stream before decoding it")
+@click.option('--checkpoint-file', default='stream-checkpoint.json',
+              help="File to record stream progress in and resume from on startup, or '' to always start from now")
+@click.option('--enable-profiler', is_flag=True,
+              help='Serve a sampling profile of the running bot at /debug/profile?seconds=N on the metrics port')
+@click.option('--processes', default=1, type=click.IntRange(min=1),
+              help='Number of processes to fetch diffs and run detectors in, each with --workers threads')
+@click.option('--sites-config', type=click.Path(exists=True, dir_okay=False),
+              help='JSON file listing the wikis to monitor and the detectors to run on each')
+@click.option('--measure-startup', is_flag=True,
+              help='Stop after the first change is processed and report how long each part of startup took')
+@click.option('--spill-file', default='deferred-edits.jsonl',
+              help="File to put off unlikely edits to while the stream lag is high, or '' to process every edit")
+@click.option('--shed-lag', default=300.0, type=click.FloatRange(min=0),
+              help='Stream lag in seconds above which only likely edits are processed and the rest are deferred')
+@click.option('--sample-lag', default=1800.0, type=click.FloatRange(min=0),
+              help='Stream lag in seconds above which only a sample of the unlikely edits are deferred')
+@click.option('--sample-rate', default=0.1, type=click.FloatRange(min=0, max=1),
+              help='Share of unlikely edits to defer rather than drop above --sample-lag')
+def run(stream_backend, checkpoint_file, enable_profiler, processes, sites_config, measure_startup, spill_file,
+        shed_lag, sample_lag, sample_rate, **options):
+    """Monitor the live recent changes stream."""
+    try:
+        log_level = options['log_level']
+        monitor_kwargs = _configure(**options)
+
+        if processes > 1 or sites_config:
+            if monitor_kwargs['detector_processes']:
+                raise click.UsageError('--detector-processes runs the detectors in worker processes of its own, '
+                                       'so it cannot be combined with --processes or --sites-config')
+            from macron_monitor.MonitorCoordinator import MonitorCoordinator
+            site_configs = load_site_configs(sites_config) if sites_config else [SiteConfig()]
+            bot = MonitorCoordinator(site_configs, processes=processes, log_level=log_level,
+                                     stream_backend=stream_backend, checkpoint_file=checkpoint_file,
+                                     spill_file=spill_file, shed_lag=shed_lag, sample_lag=sample_lag,
+                                     sample_rate=sample_rate, **monitor_kwargs)
+        else:
+            bot = MacronMonitor(stream_backend=stream_backend, checkpoint_file=checkpoint_file, spill_file=spill_file,
+                                shed_lag=shed_lag, sample_lag=sample_lag, sample_rate=sample_rate, **monitor_kwargs)
+        start_metrics_server(8420, enable_profiler=enable_profiler, alert_journal=bot.alert_journal)
+        bot.measure_startup = measure_startup
         bot.run()
+        if measure_startup:
+            click.echo(bot.startup.report())
     except KeyboardInterrupt as e:
         module_logger.error("Got asked to exit! I am now dying X_X")
 
 
+@cli.command()
+@monitor_options
+@click.option('--start', required=True, type=click.DateTime(), help='Oldest edit to scan (UTC)')
+@click.option('--end', default=None, type=click.DateTime(), help='Newest edit to scan (UTC), defaults to now')
+@click.option('--output', type=click.File('w', encoding='utf-8'),
+              help='Write alerts to this file as JSON lines instead of to the alert pages')
+@click.option('--max-rate', default=20.0, type=click.FloatRange(min=0),
+              help='Maximum edits per second to read from the API, or 0 for no limit')
+def backfill(start, end, output, max_rate, **options):
+    """Run the detectors over past edits from list=recentchanges."""
+    try:
+        monitor_kwargs = _configure(**options)
+
+        bot = MacronMonitor(**monitor_kwargs)
+        bot.wait_until_ready()
+        end = pywikibot.Timestamp.set_timestamp(end) if end else pywikibot.Timestamp.utcnow()
+        try:
+            Backfill(bot, output=output, max_rate=max_rate).run(pywikibot.Timestamp.set_timestamp(start), end)
+        finally:
+            bot.alert_writer.close()
+            bot.close_detectors()
+            if bot.alert_journal:
+                bot.alert_journal.close()
+    except KeyboardInterrupt as e:
+        module_logger.error("Got asked to exit! I am now dying X_X")
+
+
+@cli.command('scan-corpus')
+@click.option('--log-level', default='INFO', help='Level to use for logging to console')
+@click.option('--report', type=click.Path(dir_okay=False), default='wpnz-cleanup-report.txt',
+              help='File to write the ranked cleanup report to, as a wikitext list, once the scan has finished')
+@click.option('--top', default=500, type=click.IntRange(min=1), help='Number of pages to list in the report')
+@click.option('--findings-file', default='wpnz-scan-findings.jsonl',
+              help='File to collect the findings for every page in as the scan goes')
+@click.option('--state-file', default='wpnz-scan-state.json',
+              help='File to record scan progress in, so a stopped scan carries on where it left off')
+@click.option('--restart', is_flag=True, help='Scan every article again, rather than carrying on from the state file')
+@click.option('--processes', default=2, type=click.IntRange(min=1),
+              help='Number of processes to match the article text in')
+@click.option('--api-rate', default=DEFAULT_RATES['api'][0], type=click.FloatRange(min=0, min_open=True),
+              help='Maximum requests per second to the wiki API')
+@click.option('--wpnz-snapshot-file', default='wpnz-articles.json',
+              help="File to load the WikiProject New Zealand article list from, or '' to fetch it")
+def scan_corpus(log_level, report, top, findings_file, state_file, restart, processes, api_rate,
+                wpnz_snapshot_file):
+    """Scan the current text of every WPNZ article for unmacroned links and words, and rank them for cleanup."""
+    from macron_monitor.CorpusScanner import CorpusScanner, read_findings, write_report
+    try:
+        _configure_logging(log_level)
+        scheduler = RequestScheduler(rates=dict(DEFAULT_RATES, api=(api_rate, api_rate)))
+        wpnz_article_provider = WPNZArticleProvider(snapshot_file=wpnz_snapshot_file or None, scheduler=scheduler)
+        if not wpnz_article_provider.wait_until_ready(STARTUP_TIMEOUT):
+            raise click.ClickException('Timed out waiting for the WPNZ article list')
+        if restart:
+            Path(state_file).unlink(missing_ok=True)
+            Path(findings_file).unlink(missing_ok=True)
+
+        scanner = CorpusScanner(wpnz_article_provider.titles(), findings_file, state_file, processes=processes,
+                                scheduler=scheduler)
+        scanner.run()
+        # only opened now, so a stopped scan leaves the previous report alone
+        with open(report, 'w', encoding='utf-8') as report_file:
+            listed = write_report(read_findings(findings_file), report_file, top=top)
+        click.echo(f'Scanned {scanner.scanned} articles at {scanner.pages_per_second:.1f} pages/sec, '
+                   f'{scanner.with_findings} with findings; listed the top {listed} in {report}')
+    except KeyboardInterrupt as e:
+        module_logger.error("Got asked to exit! Run scan-corpus again to carry on from here")
+
+
 if __name__ == '__main__':
-    run()
+    cli()
@@ -0,0 +1,147 @@
+import json
+import sys
+import threading
+import time
+import traceback
+from collections import Counter as StackCounter
+from http.server import ThreadingHTTPServer
+from typing import Optional
+from urllib.parse import parse_qs, urlparse
+
+from prometheus_client.exposition import MetricsHandler
+
+from macron_monitor import module_logger
+
+PROFILE_PATH = '/debug/profile'
+MAX_PROFILE_SECONDS = 60
+ALERTS_PATH = '/alerts'
+TOP_USERS_PATH = '/alerts/top-users'
+
+
+class SamplingProfiler:
+    """
+    Finds where the monitor's threads are spending their time by sampling their stacks.
+
+    Every ``interval`` seconds the current stack of each other thread is recorded. The result is in the collapsed
+    format flame graph tools read: one line per distinct stack, outermost frame first, followed by how many samples
+    it was seen in. Only one profile runs at a time.
+    """
+    _class_logger = module_logger.getChild(__qualname__)
+
+    def __init__(self,
+                 interval: float = 0.005,
+                 ) -> None:
+        self._instance_logger = self._class_logger.getChild(str(id(self)))
+        self.interval = interval
+        self._lock = threading.Lock()
+
+    def profile(self, seconds: float) -> Optional[str]:
+        """Sample for ``seconds`` and return the collapsed stacks, or None if a profile is already running."""
+        if not self._lock.acquire(blocking=False):
+            return None
+        try:
+            self._instance_logger.info("Profiling for %.1f seconds", seconds)
+            return self._collapse(self._sample(seconds))
+        finally:
+            self._lock.release()
+
+    def _sample(self, seconds: float) -> StackCounter:
+        me = threading.get_ident()
+        names = {}
+        stacks = StackCounter()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                if thread_id not in names:
+                    names = {thread.ident: thread.name for thread in threading.enumerate()}
+                frames = tuple(f'{summary.name} ({summary.filename}:{summary.lineno})'
+                               for summary in traceback.extract_stack(frame))
+                stacks[(names.get(thread_id, str(thread_id)),) + frames] += 1
+            time.sleep(self.interval)
+        return stacks
+
+    @staticmethod
+    def _collapse(stacks: StackCounter) -> str:
+        return ''.join(f'{";".join(stack)} {count}\n' for stack, count in stacks.most_common())
+
+
+class MetricsRequestHandler(MetricsHandler):
+    """
+    Serves Prometheus metrics, and the sampling profiler at ``/debug/profile?seconds=N`` if it is enabled.
+
+    With an alert journal it also serves the latest alerts as JSON at ``/alerts``, filtered by ``user``, ``title``
+    and ``since`` (a Unix timestamp), and the users with the most alerts at ``/alerts/top-users?since=...``. Both take
+    a ``limit``.
+    """
+    profiler: Optional[SamplingProfiler] = None
+    alert_journal = None
+
+    def do_GET(self) -> None:
+        url = urlparse(self.path)
+        if url.path == PROFILE_PATH:
+            self._profile(parse_qs(url.query))
+            return
+        if url.path in (ALERTS_PATH, TOP_USERS_PATH):
+            self._alerts(url.path, parse_qs(url.query))
+            return
+        super().do_GET()
+
+    def _alerts(self, path: str, params: dict) -> None:
+        if self.alert_journal is None:
+            self._respond(404, 'The alert journal is not enabled\n')
+            return
+        try:
+            since = float(params['since'][0]) if 'since' in params else None
+            limit = int(params.get('limit', ['100'])[0])
+        except ValueError:
+            self._respond(400, 'since and limit must be numbers\n')
+            return
+        if limit < 1:
+            self._respond(400, 'limit must be at least 1\n')
+            return
+        if path == TOP_USERS_PATH:
+            result = self.alert_journal.top_users(since=since, limit=limit)
+        else:
+            user = params['user'][0] if 'user' in params else None
+            title = params['title'][0].replace('_', ' ') if 'title' in params else None
+            result = self.alert_journal.alerts(user=user, title=title, since=since, limit=limit)
+        self._respond(200, json.dumps(result, ensure_ascii=False), content_type='application/json')
+
+    def _profile(self, params: dict) -> None:
+        if self.profiler is None:
+            self._respond(404, 'Profiling is not enabled\n')
+            return
+        try:
+            seconds = min(float(params.get('seconds', ['10'])[0]), MAX_PROFILE_SECONDS)
+        except ValueError:
+            self._respond(400, 'seconds must be a number\n')
+            return
+        stacks = self.profiler.profile(seconds)
+        if stacks is None:
+            self._respond(409, 'A profile is already running\n')
+            return
+        self._respond(200, stacks)
+
+    def _respond(self, status: int, body: str, content_type: str = 'text/plain; charset=utf-8') -> None:
+        encoded = body.encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(encoded)))
+        self.end_headers()
+        self.wfile.write(encoded)
+
+
+def start_metrics_server(port: int = 8420, addr: str = '0.0.0.0', enable_profiler: bool = False,
+                         alert_journal=None) -> ThreadingHTTPServer:
+    """Start serving metrics from a background thread, like ``prometheus_client.start_http_server``."""
+    handler = type('MetricsRequestHandler', (MetricsRequestHandler,), {
+        'profiler': SamplingProfiler() if enable_profiler else None,
+        'alert_journal': alert_journal,
+    })
+    server = ThreadingHTTPServer((addr, port), handler)
+    server.daemon_threads = True
+    daemon = threading.Thread(target=server.serve_forever, daemon=True, name='background_MetricsServer')
+    daemon.start()
+    return server
@@ -0,0 +1,169 @@
+import dataclasses
+from typing import Callable, Dict, List, Optional
+
+import pywikibot
+
+from macron_monitor import module_logger, SuspiciousRev, log_worker_to_console
+from macron_monitor.ChangePipeline import ChangePipeline
+from macron_monitor.MacronMonitor import MacronMonitor, STARTUP_TIMEOUT, WPNZ_DETECTORS
+from macron_monitor.RequestScheduler import DEFAULT_RATES
+from macron_monitor.ShardedProcessPool import ShardedProcessPool
+from macron_monitor.SiteConfig import SiteConfig
+from macron_monitor.WPNZArticleProvider import WPNZArticleProvider
+
+# the monitors in a worker process, by server name, set up by _init_worker
+_worker_monitors: Dict[str, MacronMonitor] = {}
+
+
+class MonitorCoordinator(MacronMonitor):
+    """
+    Monitors one or more wikis from a single stream, fetching diffs and running detectors in worker processes.
+
+    The coordinator reads the stream, drops duplicates, and hands each change to a ``ShardedProcessPool``; edits to
+    the same page on the same wiki always go to the same worker. Alerts come back to the coordinator, which writes
+    them to the alert pages of the wiki they came from and keeps the checkpoint, so only one process ever edits an
+    alert page or writes the checkpoint.
+
+    The coordinator refreshes the WPNZ article snapshot and workers reload it whenever it changes, so the article
+    list is only fetched once. Without a snapshot file every worker has to fetch the list itself.
+    """
+    _class_logger = module_logger.getChild(__qualname__)
+
+    def __init__(self,
+                 site_configs: List[SiteConfig],
+                 processes: int = 2,
+                 log_level: str = 'INFO',
+                 **kwargs) -> None:
+        self.site_configs = site_configs
+        self.processes = processes
+        self.log_level = log_level
+        for site_config in site_configs:
+            share_login(site_config)
+
+        # the coordinator only writes alerts, so the other sites don't need detectors of their own
+        self.site_monitors: Dict[str, MacronMonitor] = {
+            site_config.server_name: MacronMonitor(site_config=dataclasses.replace(site_config, detectors=()),
+                                                   **dict(kwargs, checkpoint_file=None, spill_file=None,
+                                                          alert_journal_file=None))
+            for site_config in site_configs[1:]
+        }
+        # the detectors run in the workers, so the coordinator has no detectors or diff provider of its own
+        super().__init__(site_config=dataclasses.replace(site_configs[0], detectors=()), **kwargs)
+        self.site_monitors[self.site_config.server_name] = self
+
+        self._worker_kwargs = _worker_kwargs(processes, kwargs)
+
+    def _needs_wpnz_articles(self) -> bool:
+        return any(WPNZ_DETECTORS.intersection(site_config.detectors) for site_config in self.site_configs)
+
+    def _server_names(self) -> List[str]:
+        return [site_config.server_name for site_config in self.site_configs]
+
+    def wait_until_ready(self, timeout: float = STARTUP_TIMEOUT) -> None:
+        for monitor in self.site_monitors.values():
+            if monitor is not self:
+                monitor.wait_until_ready(timeout)
+        super().wait_until_ready(timeout)
+
+    def run(self) -> None:
+        self._instance_logger.info("Processing changes to %s in %d processes with %d workers each",
+                                   ', '.join(self._server_names()), self.processes, self.workers)
+        # the workers start up alongside the stream rather than after it
+        pool = ShardedProcessPool(
+            self.processes,
+            key=_shard_key,
+            initializer=_init_worker,
+            initargs=(self.site_configs, self._worker_kwargs, dict(pywikibot.config.authenticate), self.log_level),
+            threads=self.workers,
+            queue_size=self.queue_size,
+        )
+        try:
+            changes = self._start_stream()
+            pipeline = ChangePipeline(_process_change_in_worker, self._emit_alerts, queue_size=self.queue_size,
+                                      executor=pool)
+            pipeline.run(changes)
+        finally:
+            pool.shutdown()
+            for monitor in self.site_monitors.values():
+                monitor.alert_writer.close()
+            if self.checkpoint:
+                self.checkpoint.close()
+            if self.load_shedder:
+                self.load_shedder.close()
+            if self.alert_journal:
+                self.alert_journal.close()
+
+    def _update_alert_list(self, alert_data: SuspiciousRev, change=None,
+                           on_written: Optional[Callable[[], None]] = None) -> None:
+        server_name = self._server_name(change) if change is not None else self.site_config.server_name
+        self.site_monitors[server_name].alert_writer.add(alert_data, on_written)
+
+
+def share_login(site_config: SiteConfig) -> None:
+    """Log in to ``site_config``'s wiki with the same account and credentials as English Wikipedia."""
+    pywikibot.config.usernames[site_config.family][site_config.code] = 'MacronMonitor'
+    authentication = pywikibot.config.authenticate.get('en.wikipedia.org')
+    if authentication is not None:
+        pywikibot.config.authenticate.setdefault(site_config.server_name, authentication)
+
+
+def _worker_kwargs(processes: int, kwargs: dict) -> dict:
+    """The ``MacronMonitor`` arguments for each worker, which share the API rate and concurrency between them."""
+    return {
+        'diff_backend': kwargs.get('diff_backend', 'compare'),
+        'batch_window': kwargs.get('batch_window', 0.005),
+        'wpnz_snapshot_file': kwargs.get('wpnz_snapshot_file'),
+        'api_rate': kwargs.get('api_rate', DEFAULT_RATES['api'][0]) / processes,
+        'api_max_concurrency': max(1, kwargs.get('api_max_concurrency', 16) // processes),
+    }
+
+
+def _shard_key(change) -> str:
+    # recentchange events carry no page id, the title is the closest stable key
+    return f"{change['server_name']}|{change['title']}"
+
+
+def _init_worker(site_configs: List[SiteConfig], worker_kwargs: dict, authenticate: dict,
+                 log_level: str) -> None:
+    log_worker_to_console(log_level)
+
+    pywikibot.config.authenticate.update(authenticate)
+    for site_config in site_configs:
+        share_login(site_config)
+
+    wpnz_snapshot_file = worker_kwargs.get('wpnz_snapshot_file')
+    wpnz_article_provider: Optional[WPNZArticleProvider] = None
+    if any(WPNZ_DETECTORS.intersection(site_config.detectors) for site_config in site_configs):
+        # one article list shared by every site in this process, reloaded when the coordinator saves a new one
+        wpnz_article_provider = WPNZArticleProvider(snapshot_file=wpnz_snapshot_file,
+                                                    follow_snapshot=bool(wpnz_snapshot_file))
+    for site_config in site_configs:
+        _worker_monitors[site_config.server_name] = _WorkerMonitor(wpnz_article_provider, offline=True,
+                                                                   site_config=site_config, **worker_kwargs)
+    for monitor in _worker_monitors.values():
+        monitor.wait_until_ready()
+
+
+def _process_change_in_worker(change) -> Optional[List[SuspiciousRev]]:
+    return _worker_monitors[change['server_name']]._process_change(change)
+
+
+class _WorkerMonitor(MacronMonitor):
+    """
+    A ``MacronMonitor`` in a worker process, which shares its process's WPNZ article list with the other sites.
+
+    Workers only read diffs and hand their alerts back to the coordinator, so they don't log in or write alerts.
+    """
+
+    def __init__(self, wpnz_article_provider: Optional[WPNZArticleProvider], **kwargs) -> None:
+        self._shared_wpnz_article_provider = wpnz_article_provider
+        super().__init__(**kwargs)
+
+    def _login(self) -> None:
+        self._logged_in.set_result(None)
+
+    def _create_alert_writer(self, offline: bool, flush_interval: float, batch_size: int) -> None:
+        return None
+
+    def _create_wpnz_article_provider(self, snapshot_file: Optional[str]) -> Optional[WPNZArticleProvider]:
+        return self._shared_wpnz_article_provider
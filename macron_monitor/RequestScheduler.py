@@ -0,0 +1,237 @@
+import itertools
+import random
+import threading
+import time
+from enum import IntEnum
+from typing import Callable, Dict, List, Optional, Tuple, TypeVar
+
+import pywikibot
+import requests
+from prometheus_client import Counter, Gauge, Histogram
+
+from macron_monitor import module_logger
+
+T = TypeVar('T')
+
+SCHEDULER_CONCURRENCY_LIMIT = Gauge('api_scheduler_concurrency_limit',
+                                    'Requests the scheduler currently lets run at once')
+SCHEDULER_IN_FLIGHT = Gauge('api_scheduler_in_flight', 'Requests currently running through the scheduler')
+SCHEDULER_WAIT_SECONDS = Histogram('api_scheduler_wait_seconds', 'Time requests waited for their turn', ['priority'])
+SCHEDULER_RETRIES = Counter('api_scheduler_retries', 'Failed requests queued again after a backoff',
+                            ['endpoint', 'reason'])
+SCHEDULER_GIVE_UPS = Counter('api_scheduler_give_ups', 'Requests that failed every retry', ['endpoint'])
+
+# requests per second and burst size for each endpoint, unless the caller says otherwise
+DEFAULT_RATES = {
+    'api': (50.0, 50.0),
+    'petscan': (0.2, 1.0),
+}
+
+_RATE_LIMITED = 'rate_limited'
+_SERVER_ERROR = 'server_error'
+_CONNECTION = 'connection'
+
+
+class Priority(IntEnum):
+    HIGH = 0  # alert page writes, and diffs of WPNZ articles
+    NORMAL = 1
+    BACKGROUND = 2  # refreshing the WPNZ article set
+
+
+class RateLimitedError(Exception):
+    """The server asked us to slow down, e.g. with a ``maxlag`` error, and to wait ``retry_after`` seconds."""
+
+    def __init__(self, retry_after: float, message: str = '') -> None:
+        super().__init__(message or f'rate limited, retry after {retry_after}s')
+        self.retry_after = retry_after
+
+
+def retry_after(response: requests.Response, default: float = 5.0) -> float:
+    """The ``Retry-After`` of ``response`` in seconds, or ``default`` if it has none we understand."""
+    try:
+        return max(0.0, float(response.headers['Retry-After']))
+    except (KeyError, ValueError):
+        return default
+
+
+class TokenBucket:
+    """Allows ``rate`` requests per second on average, and up to ``burst`` at once after a quiet spell."""
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate: float, burst: float) -> None:
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+
+    def wait_time(self, now: float) -> float:
+        """Seconds until a token is available, topping the bucket up for the time since it was last checked."""
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        return 0.0 if self.tokens >= 1 else (1 - self.tokens) / self.rate
+
+    def take(self) -> None:
+        self.tokens -= 1
+
+
+class RequestScheduler:
+    """
+    Decides when each request to a Wikimedia service may go, so every caller shares one view of how loaded it is.
+
+    Callers wrap each request in ``call``. A request waits until:
+
+    - fewer than the concurrency limit are running. The limit grows by one for every limit's worth of requests that
+      finish within ``target_latency``. It is halved, at most once per ``target_latency``, when one is slower or fails
+      because the server is struggling.
+    - its endpoint's token bucket has a token, and the endpoint isn't paused by a ``Retry-After`` or ``maxlag``.
+    - no request of a higher ``Priority`` is waiting for an endpoint that is ready. Otherwise they go in arrival order.
+
+    A request that fails in a way that may pass is queued again after an exponential backoff, or after the wait
+    the server asked for, up to ``max_retries`` times before the error is raised to the caller. A caller that can't
+    wait that long, like one holding up the stream, passes a ``retry_deadline`` in seconds and gets the error once the
+    next retry would start after it, so it can try again later instead.
+    """
+    _class_logger = module_logger.getChild(__qualname__)
+
+    def __init__(self,
+                 rates: Optional[Dict[str, Tuple[float, float]]] = None,
+                 max_concurrency: int = 16,
+                 min_concurrency: int = 1,
+                 target_latency: float = 2.0,
+                 max_retries: int = 5,
+                 backoff: float = 1.0,
+                 max_backoff: float = 60.0,
+                 retry_deadline: Optional[float] = None,
+                 ) -> None:
+        self._instance_logger = self._class_logger.getChild(str(id(self)))
+        self.max_concurrency = max_concurrency
+        self.min_concurrency = min_concurrency
+        self.target_latency = target_latency
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.retry_deadline = retry_deadline
+
+        self._buckets = {endpoint: TokenBucket(rate, burst)
+                         for endpoint, (rate, burst) in (DEFAULT_RATES if rates is None else rates).items()}
+        self._paused_until: Dict[str, float] = {}
+        self.limit = float(max_concurrency)
+        self._in_flight = 0
+        self._last_decrease = 0.0
+        self._waiting: List[Tuple[int, int, str]] = []
+        self._tickets = itertools.count()
+        self._condition = threading.Condition()
+        SCHEDULER_CONCURRENCY_LIMIT.set(self.limit)
+
+    def call(self, fn: Callable[..., T], *args, endpoint: str = 'api', priority: Priority = Priority.NORMAL,
+             retry_deadline: Optional[float] = None, **kwargs) -> T:
+        """Run ``fn(*args, **kwargs)`` on this thread when the scheduler allows it, retrying it if it fails."""
+        if retry_deadline is None:
+            retry_deadline = self.retry_deadline
+        give_up_at = None if retry_deadline is None else time.monotonic() + retry_deadline
+        for attempt in itertools.count():
+            self._acquire(endpoint, priority)
+            started = time.monotonic()
+            try:
+                result = fn(*args, **kwargs)
+            except Exception as e:
+                reason, delay = self._classify(e, attempt)
+                self._release(endpoint, time.monotonic() - started, reason, delay)
+                if reason is None:
+                    raise
+                if attempt >= self.max_retries or (give_up_at is not None and time.monotonic() + delay > give_up_at):
+                    SCHEDULER_GIVE_UPS.labels(endpoint).inc()
+                    raise
+                SCHEDULER_RETRIES.labels(endpoint, reason).inc()
+                self._instance_logger.warning("Request to %s failed (%s), retrying in %.1fs", endpoint,
+                                              type(e).__name__, delay)
+                time.sleep(delay)
+                continue
+            self._release(endpoint, time.monotonic() - started, None, 0.0)
+            return result
+
+    def _acquire(self, endpoint: str, priority: Priority) -> None:
+        queued = time.monotonic()
+        with self._condition:
+            ticket = (int(priority), next(self._tickets), endpoint)
+            self._waiting.append(ticket)
+            while True:
+                now = time.monotonic()
+                wait = self._time_until_turn(ticket, now)
+                if wait is not None and wait <= 0:
+                    break
+                self._condition.wait(wait)
+            self._waiting.remove(ticket)
+            bucket = self._buckets.get(endpoint)
+            if bucket is not None:
+                bucket.take()
+            self._in_flight += 1
+            SCHEDULER_IN_FLIGHT.set(self._in_flight)
+            # the next request in line may be able to go too
+            self._condition.notify_all()
+        SCHEDULER_WAIT_SECONDS.labels(priority.name.lower()).observe(now - queued)
+
+    def _time_until_turn(self, ticket: Tuple[int, int, str], now: float) -> Optional[float]:
+        """
+        0 when ``ticket`` may go now, otherwise how long to wait before checking again.
+
+        None means wait to be notified, when a request finishes or another one goes.
+        """
+        if self._in_flight >= int(self.limit):
+            return None
+        ready_in = {}
+        for waiting in sorted(self._waiting):
+            endpoint = waiting[2]
+            if endpoint not in ready_in:
+                ready_in[endpoint] = self._endpoint_ready_in(endpoint, now)
+            if ready_in[endpoint] <= 0:
+                # the first request in line whose endpoint is ready goes next
+                return 0.0 if waiting is ticket else None
+        return ready_in[ticket[2]]
+
+    def _endpoint_ready_in(self, endpoint: str, now: float) -> float:
+        wait = self._paused_until.get(endpoint, 0.0) - now
+        bucket = self._buckets.get(endpoint)
+        if bucket is not None:
+            wait = max(wait, bucket.wait_time(now))
+        return wait
+
+    def _release(self, endpoint: str, latency: float, reason: Optional[str], delay: float) -> None:
+        with self._condition:
+            self._in_flight -= 1
+            SCHEDULER_IN_FLIGHT.set(self._in_flight)
+            now = time.monotonic()
+            if reason == _RATE_LIMITED:
+                self._paused_until[endpoint] = max(self._paused_until.get(endpoint, 0.0), now + delay)
+            if reason in (_RATE_LIMITED, _SERVER_ERROR) or latency > self.target_latency:
+                if now - self._last_decrease >= self.target_latency:
+                    self.limit = max(float(self.min_concurrency), self.limit / 2)
+                    self._last_decrease = now
+            elif reason is None:
+                self.limit = min(float(self.max_concurrency), self.limit + 1 / self.limit)
+            SCHEDULER_CONCURRENCY_LIMIT.set(self.limit)
+            self._condition.notify_all()
+
+    def _classify(self, error: Exception, attempt: int) -> Tuple[Optional[str], float]:
+        """Why ``error`` is worth retrying and how long to wait first, or ``(None, 0)`` if it isn't."""
+        backoff = min(self.max_backoff, self.backoff * 2 ** attempt) * random.uniform(0.5, 1.0)
+        if isinstance(error, RateLimitedError):
+            return _RATE_LIMITED, error.retry_after
+        if isinstance(error, requests.HTTPError) and error.response is not None:
+            status = error.response.status_code
+            if status in (429, 503):
+                return _RATE_LIMITED, retry_after(error.response, backoff)
+            if status >= 500:
+                return _SERVER_ERROR, backoff
+            return None, 0.0
+        if isinstance(error, (requests.ConnectionError, requests.Timeout)):
+            return _CONNECTION, backoff
+        if isinstance(error, pywikibot.exceptions.MaxlagTimeoutError):
+            return _RATE_LIMITED, backoff
+        if isinstance(error, pywikibot.exceptions.APIError) and error.code in ('maxlag', 'ratelimited'):
+            return _RATE_LIMITED, backoff
+        if isinstance(error, (pywikibot.exceptions.ServerError, pywikibot.exceptions.ApiTimeoutError)):
+            if isinstance(error, pywikibot.exceptions.FatalServerError):
+                return None, 0.0
+            return _SERVER_ERROR, backoff
+        return None, 0.0
@@ -0,0 +1,147 @@
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import pywikibot
+import requests
+from prometheus_client import Counter, Histogram
+from requests.adapters import HTTPAdapter
+
+from macron_monitor import module_logger
+from macron_monitor.DiffProvider import parse_revision_content
+from macron_monitor.RequestScheduler import RequestScheduler
+
+USER_AGENT = 'MacronMonitor/0.1 (https://en.wikipedia.org/wiki/User:MacronMonitor)'
+
+API_REQUESTS_COUNT = Counter('revision_fetch_api_requests', 'Batched prop=revisions requests sent to the API')
+REVISIONS_REQUESTED_COUNT = Counter('revision_fetch_revisions_requested', 'Revisions asked for by callers')
+BATCH_SIZE = Histogram('revision_fetch_batch_size', 'Number of distinct revisions fetched per API request',
+                       buckets=(1, 2, 4, 8, 16, 32, 50, float('inf')))
+
+
+class BatchingRevisionFetcher:
+    """
+    Fetches revision wikitext, coalescing requests from concurrent callers into batched API queries.
+
+    Callers block in ``fetch`` while a dispatcher thread collects every revision id asked for within ``window``
+    seconds of the first one (or until ``max_batch`` distinct ids are waiting) and sends them as one
+    ``prop=revisions&revids=...`` request over a pooled session. Batches are sent from a small thread pool so the
+    next batch can be collected while the previous one is in flight.
+
+    If a ``scheduler`` is given, every HTTP request goes through it, so a batch of revisions costs one request's worth
+    of the API rate however many callers it serves. Its retries stop after ``retry_deadline`` seconds, if given.
+    """
+    _class_logger = module_logger.getChild(__qualname__)
+
+    def __init__(self,
+                 api_url: str,
+                 window: float = 0.005,
+                 max_batch: int = 50,
+                 max_in_flight: int = 4,
+                 session: Optional[requests.Session] = None,
+                 scheduler: Optional[RequestScheduler] = None,
+                 retry_deadline: Optional[float] = None,
+                 ) -> None:
+        self._instance_logger = self._class_logger.getChild(str(id(self)))
+        self.api_url = api_url
+        self.window = window
+        self.max_batch = max_batch
+        self.scheduler = scheduler
+        self.retry_deadline = retry_deadline
+
+        if session is None:
+            session = requests.Session()
+            session.headers['User-Agent'] = USER_AGENT
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_in_flight)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+        self.session = session
+
+        self._waiting: queue.Queue[Tuple[int, Future]] = queue.Queue()
+        self._senders = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix='revision_fetch')
+        dispatcher = threading.Thread(target=self._dispatch, daemon=True, name='background_RevisionFetchDispatch')
+        dispatcher.start()
+
+    def fetch(self, revids: Iterable[int]) -> Dict[int, str]:
+        """Return the wikitext of each revision, leaving out revisions that are deleted or hidden."""
+        futures = []
+        for revid in revids:
+            future = Future()
+            self._waiting.put((revid, future))
+            futures.append((revid, future))
+        REVISIONS_REQUESTED_COUNT.inc(len(futures))
+
+        contents = {}
+        for revid, future in futures:
+            content = future.result()
+            if content is not None:
+                contents[revid] = content
+        return contents
+
+    def _dispatch(self) -> None:
+        while True:
+            batch: Dict[int, List[Future]] = {}
+            revid, future = self._waiting.get()
+            batch[revid] = [future]
+
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    revid, future = self._waiting.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                batch.setdefault(revid, []).append(future)
+
+            self._senders.submit(self._send, batch)
+
+    def _send(self, batch: Dict[int, List[Future]]) -> None:
+        try:
+            contents = self._query(list(batch))
+        except Exception as e:
+            self._instance_logger.error("Failed to fetch a batch of %d revisions", len(batch), exc_info=e)
+            for futures in batch.values():
+                for future in futures:
+                    future.set_exception(e)
+            return
+
+        for revid, futures in batch.items():
+            for future in futures:
+                future.set_result(contents.get(revid))
+
+    def _query(self, revids: List[int]) -> Dict[int, str]:
+        params = {
+            'action': 'query',
+            'prop': 'revisions',
+            'revids': '|'.join(str(revid) for revid in revids),
+            'rvprop': 'ids|content',
+            'rvslots': 'main',
+            'format': 'json',
+            'formatversion': 2,
+            'maxlag': 5,
+        }
+        BATCH_SIZE.observe(len(revids))
+        contents = {}
+        while True:
+            if self.scheduler is None:
+                data = self._request(params)
+            else:
+                data = self.scheduler.call(self._request, params, retry_deadline=self.retry_deadline)
+            contents.update(parse_revision_content(data))
+            if 'continue' not in data:
+                return contents
+            # the response was too big to return every revision at once
+            params.update(data['continue'])
+
+    def _request(self, params: dict) -> dict:
+        API_REQUESTS_COUNT.inc()
+        response = self.session.get(self.api_url, params=params, timeout=30)
+        response.raise_for_status()
+        data = response.json()
+        if 'error' in data:
+            raise pywikibot.exceptions.APIError(data['error'].get('code'), data['error'].get('info'))
+        return data
@@ -0,0 +1,185 @@
+import itertools
+import multiprocessing
+import pickle
+import queue
+import threading
+import time
+import zlib
+from concurrent.futures import Executor, Future, ThreadPoolExecutor
+from typing import Callable, Dict, Optional, Tuple
+
+from prometheus_client import Counter
+
+from macron_monitor import module_logger
+
+WORKER_RESTARTS = Counter('shard_worker_restarts', 'Shard worker processes that died and were started again')
+TASKS_ABANDONED = Counter('shard_tasks_abandoned', 'Calls given up on after their worker died running them too often')
+
+_STOP = None
+
+
+class WorkerDiedError(RuntimeError):
+    """A call's worker process died every time the call was sent to it."""
+
+
+def shard_for(key: str, shards: int) -> int:
+    """Pick a shard for ``key`` that is the same in every process and on every run."""
+    return zlib.crc32(key.encode('utf-8')) % shards
+
+
+class ShardedProcessPool(Executor):
+    """
+    Runs calls in worker processes, always sending calls with the same key to the same process.
+
+    ``key`` is given the arguments of each call and returns a string, which is hashed to pick the worker. Each
+    worker runs ``initializer(*initargs)`` once when it starts, then works through its own queue of calls with up to
+    ``threads`` of them at a time. Each worker's queue holds at most ``queue_size`` calls, so ``submit`` blocks when
+    the worker is behind.
+
+    If a worker process dies, it is started again and every call it had not finished is sent to it again. Only the
+    first result for a call is kept, so a call that was resent after it had already finished doesn't complete its
+    future twice. A call that was unfinished when its worker died more than ``max_resends`` times, like one that runs
+    the worker out of memory, fails with ``WorkerDiedError`` rather than killing every new worker in turn.
+    """
+    _class_logger = module_logger.getChild(__qualname__)
+
+    def __init__(self,
+                 processes: int,
+                 key: Callable[..., str],
+                 initializer: Optional[Callable] = None,
+                 initargs: tuple = (),
+                 threads: int = 1,
+                 queue_size: int = 64,
+                 max_resends: int = 2,
+                 ) -> None:
+        self._instance_logger = self._class_logger.getChild(str(id(self)))
+        self.processes = processes
+        self.key = key
+        self.initializer = initializer
+        self.initargs = initargs
+        self.threads = threads
+        self.max_resends = max_resends
+
+        # spawn rather than fork, the parent has threads that may be holding locks
+        self._context = multiprocessing.get_context('spawn')
+        self._task_queues = [self._context.Queue(maxsize=queue_size) for _ in range(processes)]
+        self._results = self._context.Queue()
+        self._workers = [self._start_worker(shard) for shard in range(processes)]
+
+        self._task_ids = itertools.count()
+        # each call's shard, future, function and arguments, and how many times it has been resent
+        self._pending: Dict[int, Tuple[int, Future, Callable, tuple, dict, int]] = {}
+        self._lock = threading.Lock()
+        self._shutdown = False
+        collector = threading.Thread(target=self._collect_results, daemon=True, name='background_ShardResults')
+        collector.start()
+
+    def submit(self, fn: Callable, *args, **kwargs) -> Future:
+        if self._shutdown:
+            raise RuntimeError('cannot submit to a pool that has been shut down')
+        shard = shard_for(self.key(*args, **kwargs), self.processes)
+        future = Future()
+        task_id = next(self._task_ids)
+        with self._lock:
+            self._pending[task_id] = (shard, future, fn, args, kwargs, 0)
+        self._task_queues[shard].put((task_id, fn, args, kwargs))  # blocks when the worker is behind
+        return future
+
+    def shutdown(self, wait: bool = True, *, cancel_futures: bool = False) -> None:
+        self._shutdown = True
+        for task_queue in self._task_queues:
+            task_queue.put(_STOP)
+        if wait:
+            for worker in self._workers:
+                worker.join()
+        self._results.put(_STOP)
+
+    def _start_worker(self, shard: int) -> multiprocessing.Process:
+        worker = self._context.Process(
+            target=_worker_main,
+            args=(self._task_queues[shard], self._results, self.initializer, self.initargs, self.threads),
+            daemon=True,
+            name=f'shard_worker_{shard}',
+        )
+        worker.start()
+        return worker
+
+    def _collect_results(self) -> None:
+        next_check = time.monotonic() + 1
+        while True:
+            if time.monotonic() >= next_check:
+                self._restart_dead_workers()
+                next_check = time.monotonic() + 1
+            try:
+                result = self._results.get(timeout=1)
+            except queue.Empty:
+                continue
+            if result is _STOP:
+                return
+
+            task_id, succeeded, value = result
+            with self._lock:
+                pending = self._pending.pop(task_id, None)
+            if pending is None:
+                continue  # a resent call that had already finished
+            future = pending[1]
+            if succeeded:
+                future.set_result(value)
+            else:
+                future.set_exception(value)
+
+    def _restart_dead_workers(self) -> None:
+        if self._shutdown:
+            return
+        for shard, worker in enumerate(self._workers):
+            if worker.is_alive():
+                continue
+            WORKER_RESTARTS.inc()
+            self._instance_logger.error("Shard worker %d died with exit code %s, starting it again", shard,
+                                        worker.exitcode)
+            self._workers[shard] = self._start_worker(shard)
+            unfinished, abandoned = [], []
+            with self._lock:
+                for task_id in sorted(self._pending):
+                    task_shard, future, fn, args, kwargs, resends = self._pending[task_id]
+                    if task_shard != shard:
+                        continue
+                    if resends >= self.max_resends:
+                        del self._pending[task_id]
+                        abandoned.append(future)
+                        continue
+                    self._pending[task_id] = (task_shard, future, fn, args, kwargs, resends + 1)
+                    unfinished.append((task_id, fn, args, kwargs))
+            for future in abandoned:
+                TASKS_ABANDONED.inc()
+                future.set_exception(WorkerDiedError(f'shard worker {shard} died every time it ran this call'))
+            for task in unfinished:
+                self._task_queues[shard].put(task)
+
+
+def _worker_main(tasks, results, initializer, initargs, threads) -> None:
+    if initializer is not None:
+        initializer(*initargs)
+
+    # only take a call off the queue when a thread is free for it, so a full queue still pushes back on submit
+    free_threads = threading.BoundedSemaphore(threads)
+
+    def run(task_id, fn, args, kwargs):
+        try:
+            results.put((task_id, True, fn(*args, **kwargs)))
+        except Exception as e:
+            try:
+                pickle.dumps(e)
+            except Exception:
+                e = RuntimeError(repr(e))
+            results.put((task_id, False, e))
+        finally:
+            free_threads.release()
+
+    with ThreadPoolExecutor(max_workers=threads, thread_name_prefix='shard_worker') as executor:
+        while True:
+            free_threads.acquire()
+            task = tasks.get()
+            if task is _STOP:
+                break
+            executor.submit(run, *task)
@@ -0,0 +1,45 @@
+import json
+from dataclasses import dataclass, field
+from typing import List, Optional, Tuple
+
+DEFAULT_DETECTORS = ('RemovedMacronDetector', 'UnMacronedLinkDetector', 'MaoriWordDetector')
+
+
+@dataclass(frozen=True)
+class SiteConfig:
+    """
+    Which wiki to monitor, which detectors to run on it, and where to put their alerts.
+
+    ``alert_page`` overrides the page every detector writes to on this site; leave it out to use each detector's
+    own page.
+    """
+    code: str = 'en'
+    family: str = 'wikipedia'
+    server_name: str = 'en.wikipedia.org'
+    alert_page: Optional[str] = None
+    detectors: Tuple[str, ...] = field(default=DEFAULT_DETECTORS)
+
+
+def load_site_configs(path: str) -> List[SiteConfig]:
+    """
+    Read site configs from a JSON file like ``{"sites": [{"code": "en", "family": "wiktionary"}, ...]}``.
+
+    ``server_name`` defaults to ``<code>.<family>.org``.
+    """
+    with open(path, 'r', encoding='utf-8') as config_file:
+        config = json.load(config_file)
+
+    site_configs = []
+    for site in config['sites']:
+        code, family = site.get('code', 'en'), site.get('family', 'wikipedia')
+        site_configs.append(SiteConfig(
+            code=code,
+            family=family,
+            server_name=site.get('server_name', f'{code}.{family}.org'),
+            alert_page=site.get('alert_page'),
+            detectors=tuple(site.get('detectors', DEFAULT_DETECTORS)),
+        ))
+    server_names = [site_config.server_name for site_config in site_configs]
+    if not site_configs or len(set(server_names)) != len(server_names):
+        raise ValueError(f'{path} must list at least one site, and each site only once')
+    return site_configs
@@ -0,0 +1,58 @@
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+
+
+class StartupTimer:
+    """
+    Records when each part of startup began and finished, relative to ``started``, for ``--measure-startup``.
+
+    Parts run concurrently, so each is recorded as its own span rather than as a share of the total. Only the first
+    start and end of each part are kept.
+    """
+
+    def __init__(self,
+                 started: Optional[float] = None,
+                 ) -> None:
+        self.started = time.monotonic() if started is None else started
+        self._spans: Dict[str, List[Optional[float]]] = {}
+
+    def start(self, name: str) -> None:
+        self._spans.setdefault(name, [time.monotonic(), None])
+
+    def end(self, name: str) -> None:
+        span = self._spans.setdefault(name, [self.started, None])
+        if span[1] is None:
+            span[1] = time.monotonic()
+
+    @contextmanager
+    def phase(self, name: str):
+        self.start(name)
+        try:
+            yield
+        finally:
+            self.end(name)
+
+    def end_when_set(self, name: str, event: threading.Event) -> None:
+        """End ``name`` as soon as ``event`` is set, without waiting for it here."""
+        if event.is_set():
+            self.end(name)
+            return
+
+        def wait():
+            event.wait()
+            self.end(name)
+
+        waiter = threading.Thread(target=wait, daemon=True, name=f'background_StartupTimer_{name}')
+        waiter.start()
+
+    def report(self) -> str:
+        lines = [f'{"phase":<24} {"start s":>8} {"end s":>8} {"took s":>8}']
+        finished = [(name, start, end) for name, (start, end) in self._spans.items() if end is not None]
+        for name, start, end in sorted(finished, key=lambda span: span[2]):
+            lines.append(f'{name:<24} {start - self.started:8.3f} {end - self.started:8.3f} {end - start:8.3f}')
+        unfinished = sorted(name for name, (_, end) in self._spans.items() if end is None)
+        if unfinished:
+            lines.append(f'not finished: {", ".join(unfinished)}')
+        return '\n'.join(lines)
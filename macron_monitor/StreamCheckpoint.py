@@ -0,0 +1,108 @@
+import json
+import threading
+from collections import OrderedDict
+from pathlib import Path
+from typing import Dict, List, Optional
+
+from prometheus_client import Counter
+
+from macron_monitor import module_logger, atomic_write_json
+
+CHECKPOINT_WRITES = Counter('stream_checkpoint_writes', 'Times the stream checkpoint was written to disk')
+
+
+class StreamCheckpoint:
+    """
+    Remembers the last fully processed stream event so the monitor can resume from it after a restart.
+
+    ``record`` only updates memory. A background thread writes the latest position to ``path`` every
+    ``flush_interval`` seconds if it has changed, so the per-event cost is an assignment.
+
+    An event recorded with ``holds`` isn't fully processed until ``release`` has been called that many times for it,
+    e.g. once each of its alerts is saved. The saved position stops before the oldest event still held, so the events
+    from there on are processed again after a restart rather than their alerts being lost.
+    """
+    _class_logger = module_logger.getChild(__qualname__)
+
+    def __init__(self,
+                 path: str,
+                 flush_interval: float = 5.0,
+                 ) -> None:
+        self._instance_logger = self._class_logger.getChild(str(id(self)))
+        self.path = path
+        self.flush_interval = flush_interval
+        self._latest: Optional[dict] = None
+        self._written: Optional[dict] = None
+        # positions recorded since the oldest one still held, each with how many holds it has left
+        self._held: Dict[int, List] = OrderedDict()
+        self._sequence = 0
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+
+        daemon = threading.Thread(target=self._periodic_flush, daemon=True, name='background_StreamCheckpoint')
+        daemon.start()
+
+    def load(self) -> Optional[dict]:
+        """Return the saved position as ``{'event_id': ..., 'timestamp': ...}``, or None if there isn't one."""
+        if not Path(self.path).exists():
+            return None
+        try:
+            with open(self.path, 'r') as checkpoint_file:
+                checkpoint = json.load(checkpoint_file)
+        except ValueError as e:
+            self._instance_logger.warning("Ignoring unreadable checkpoint %s", self.path, exc_info=e)
+            return None
+        self._written = checkpoint
+        return checkpoint
+
+    def record(self, change, holds: int = 0) -> int:
+        """Record ``change`` as processed once it has been released ``holds`` times, returning its number."""
+        position = {
+            'event_id': getattr(change, 'event_id', None),
+            'timestamp': change['timestamp'],
+        }
+        with self._lock:
+            self._sequence += 1
+            if not self._held and not holds:
+                self._latest = position
+                return self._sequence
+            last = next(reversed(self._held), None)
+            if not holds and last is not None and not self._held[last][1]:
+                # nothing is waiting on the previous position either, so only the newer one needs keeping
+                del self._held[last]
+            self._held[self._sequence] = [position, holds]
+            self._advance()
+            return self._sequence
+
+    def release(self, sequence: int) -> None:
+        """Release one of the holds on the change ``record`` numbered ``sequence``."""
+        with self._lock:
+            self._held[sequence][1] -= 1
+            self._advance()
+
+    def _advance(self) -> None:
+        while self._held:
+            sequence, (position, holds) = next(iter(self._held.items()))
+            if holds:
+                return
+            self._latest = position
+            del self._held[sequence]
+
+    def close(self) -> None:
+        self._stopped.set()
+        self.flush()
+
+    def flush(self) -> None:
+        latest = self._latest
+        if latest is None or latest == self._written:
+            return
+        atomic_write_json(self.path, latest)
+        self._written = latest
+        CHECKPOINT_WRITES.inc()
+
+    def _periodic_flush(self) -> None:
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except OSError as e:
+                self._instance_logger.error("Failed to write the stream checkpoint", exc_info=e)
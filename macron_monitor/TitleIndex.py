@@ -0,0 +1,75 @@
+import re
+import sys
+import unicodedata
+from array import array
+from bisect import bisect_left
+from typing import Iterable
+
+_HASH_MASK = (1 << 64) - 1
+_title_whitespace = re.compile(r'[\s_]+')
+
+
+def canonicalize_title(title: str) -> str:
+    """
+    Normalize a page title or link target the way MediaWiki does before looking a page up.
+
+    Drops any ``#section`` anchor and a leading ``:``, turns underscores and runs of whitespace into single spaces,
+    NFC normalizes (so a macron typed as a combining character matches the precomposed one), and uppercases the
+    first letter.
+    """
+    title = title.split('#', 1)[0]
+    title = unicodedata.normalize('NFC', _title_whitespace.sub(' ', title)).strip(' ')
+    if title.startswith(':'):
+        title = title[1:].lstrip(' ')
+    if title:
+        first = title[0].upper()
+        if len(first) == 1:
+            title = first + title[1:]
+    return title
+
+
+def _title_hash(canonical_title: str) -> int:
+    return hash(canonical_title) & _HASH_MASK
+
+
+class TitleIndex:
+    """
+    An immutable set of page titles that answers ``title in index`` after canonicalizing ``title``.
+
+    Only a sorted array of 64-bit hashes of the canonical titles is kept, plus a directory of where each run of
+    hashes sharing their top bits starts, so a lookup is a hash and a binary search over a handful of entries. The
+    titles themselves aren't stored and can't be listed back out. Hashes are Python's own string hash, which is only
+    stable within a process, so an index can't be saved and loaded.
+    """
+
+    def __init__(self,
+                 titles: Iterable[str],
+                 ) -> None:
+        self._hashes = array('Q', sorted({_title_hash(canonicalize_title(title)) for title in titles}))
+
+        # aim for a few hashes per directory bucket
+        bits = max(1, min(20, (len(self._hashes) // 4).bit_length()))
+        self._shift = 64 - bits
+        directory = array('I', bytes(4 * ((1 << bits) + 1)))
+        for title_hash in self._hashes:
+            directory[(title_hash >> self._shift) + 1] += 1
+        for bucket in range(1, len(directory)):
+            directory[bucket] += directory[bucket - 1]
+        self._directory = directory
+
+    def __contains__(self, title: object) -> bool:
+        if not isinstance(title, str):
+            return False
+        title_hash = _title_hash(canonicalize_title(title))
+        bucket = title_hash >> self._shift
+        end = self._directory[bucket + 1]
+        position = bisect_left(self._hashes, title_hash, self._directory[bucket], end)
+        return position < end and self._hashes[position] == title_hash
+
+    def __len__(self) -> int:
+        return len(self._hashes)
+
+    @property
+    def nbytes(self) -> int:
+        """Memory used by the index, in bytes."""
+        return sys.getsizeof(self._hashes) + sys.getsizeof(self._directory)
@@ -1,54 +1,291 @@
-import asyncio
-import re
+import json
+import threading
 import time
 from datetime import datetime, timezone
-from threading import Thread
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Set
 
 import requests
+from prometheus_client import Counter, Gauge, Histogram
 
-from macron_monitor import module_logger
+from macron_monitor import module_logger, atomic_write_json
+from macron_monitor.RequestScheduler import Priority, RateLimitedError, RequestScheduler, retry_after
+from macron_monitor.RevisionFetcher import USER_AGENT
+from macron_monitor.TitleIndex import TitleIndex, canonicalize_title
 
 wpnz_petscan_query = 'https://petscan.wmflabs.org/?search%5Ffilter=&wikidata%5Fitem=no&combination=subset&cb%5Flabels%5Fno%5Fl=1&wpiu=any&after=&edits%5Bbots%5D=both&sitelinks%5Fno=&outlinks%5Fany=&search%5Fquery=&common%5Fwiki=auto&negcats=&templates%5Fyes=&sparql=&since%5Frev0=&wikidata%5Fprop%5Fitem%5Fuse=&output%5Flimit=&manual%5Flist%5Fwiki=&show%5Fsoft%5Fredirects=no&ores%5Fprob%5Ffrom=&sitelinks%5Fyes=&referrer%5Fname=&page%5Fimage=any&cb%5Flabels%5Fany%5Fl=1&max%5Fsitelink%5Fcount=&langs%5Flabels%5Fyes=&categories=New%20Zealand%20articles%20by%20quality%7C1&common%5Fwiki%5Fother=&format=json&sortorder=ascending&outlinks%5Fyes=&namespace%5Fconversion=keep&ores%5Fprob%5Fto=&show%5Fdisambiguation%5Fpages=no&show%5Fredirects=no&max%5Fage=&wikidata%5Fsource%5Fsites=&templates%5Fany=&depth=0&manual%5Flist=&search%5Fwiki=&before=&language=en&links%5Fto%5Fno=&wikidata%5Flabel%5Flanguage=&sitelinks%5Fany=&cb%5Flabels%5Fyes%5Fl=1&labels%5Fno=&langs%5Flabels%5Fno=&output%5Fcompatability=catscan&search%5Fmax%5Fresults=500&maxlinks=&ns%5B1%5D=1&langs%5Flabels%5Fany=&edits%5Bflagged%5D=both&min%5Fsitelink%5Fcount=&labels%5Fany=&rxp%5Ffilter=&min%5Fredlink%5Fcount=1&minlinks=&edits%5Banons%5D=both&links%5Fto%5Fany=&smaller=&project=wikipedia&pagepile=&outlinks%5Fno=&doit=Do%20it%21&referrer%5Furl=&ores%5Ftype=any&source%5Fcombination=&sortby=none&active%5Ftab=tab%5Foutput&interface%5Flanguage=en&templates%5Fno=&labels%5Fyes=&links%5Fto%5Fall=&subpage%5Ffilter=either&larger=&ores%5Fprediction=any&'
 
+WPNZ_ARTICLES = Gauge('wpnz_articles', 'Articles currently known to be tagged by WikiProject New Zealand')
+WPNZ_REDIRECTS = Gauge('wpnz_redirects', 'Redirects to WikiProject New Zealand articles')
+WPNZ_INDEX_BYTES = Gauge('wpnz_title_index_bytes', 'Memory used by the WikiProject New Zealand title index')
+WPNZ_REFRESH_SECONDS = Histogram('wpnz_refresh_seconds',
+                                 'Time taken to refresh the WikiProject New Zealand article set', ['kind'],
+                                 buckets=(1, 5, 10, 30, 60, 120, 300, 600, 1800, float('inf')))
+WPNZ_REFRESH_FAILURES = Counter('wpnz_refresh_failures', 'Failed refreshes of the WikiProject New Zealand article set')
+
 
 class WPNZArticleProvider:
+    """
+    Keeps the set of titles of articles tagged by WikiProject New Zealand.
+
+    The last known set is loaded from ``snapshot_file`` in the background on startup, so the provider is usable as
+    soon as that is read rather than after a full fetch, then refreshed in the background. Every ``refresh_interval``
+    seconds PetScan is only asked for articles changed since the last refresh, and every ``full_refresh_interval``
+    seconds the whole set is fetched again so articles that have left the project are dropped. Redirects to the
+    articles are looked up on the wiki and count as members too.
+
+    ``article_titles`` is a ``TitleIndex``, so membership is checked after canonicalizing the title. Each refresh
+    builds a new index and swaps it in, so readers never see one that is being changed. The titles themselves are
+    only kept as one newline separated string each for articles and redirects, for snapshots and incremental
+    refreshes.
+
+    Listeners added with ``add_listener`` are called after each new title set is published, for anything built
+    from the titles that has to be rebuilt when they change.
+
+    PetScan and the wiki are queried through ``scheduler`` behind every other request.
+
+    With ``follow_snapshot`` the provider never queries anything itself, and instead reloads ``snapshot_file``
+    whenever it changes. This lets several processes share the refreshes done by one of them.
+    """
     _class_logger = module_logger.getChild(__qualname__)
 
     def __init__(self,
+                 snapshot_file: Optional[str] = None,
+                 refresh_interval: float = 60 * 60,  # hourly
+                 full_refresh_interval: float = 24 * 60 * 60,  # daily
+                 api_url: str = 'https://en.wikipedia.org/w/api.php',
+                 session: Optional[requests.Session] = None,
+                 follow_snapshot: bool = False,
+                 scheduler: Optional[RequestScheduler] = None,
                  **kwargs) -> None:
         self._instance_logger = self._class_logger.getChild(str(id(self)))
         super().__init__(**kwargs)
 
-        self.article_titles = set()
-        self.last_update = ''
-        self._instance_logger.info('Beginning initial population of article title set')
-        self._update_current_wpnz_articles()
+        self.snapshot_file = snapshot_file
+        self.refresh_interval = refresh_interval
+        self.full_refresh_interval = full_refresh_interval
+        self.follow_snapshot = follow_snapshot
+        self.api_url = api_url
+        if session is None:
+            session = requests.Session()
+            session.headers['User-Agent'] = USER_AGENT
+        self.session = session
+        self.scheduler = scheduler if scheduler is not None else RequestScheduler()
 
-        daemon = Thread(target=self._periodic_update, daemon=True, name='background_WPNZArticleUpdate')
+        self.article_titles = TitleIndex(())
+        self._articles = ''
+        self._redirects = ''
+        self.last_refresh = 0.0
+        self.last_full_refresh = 0.0
+        self.ready = threading.Event()
+        self._refresh_lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._snapshot_mtime: Optional[float] = None
+        self._listeners: List[Callable[['WPNZArticleProvider'], None]] = []
+
+        update = self._follow_snapshot if follow_snapshot else self._periodic_update
+        daemon = threading.Thread(target=update, daemon=True, name='background_WPNZArticleUpdate')
         daemon.start()
 
-    def _periodic_update(self):
-        self._instance_logger.info("Started background update thread")
-        while True:
-            time.sleep(60 * 60)  # hourly
-            self._instance_logger.info("Running async update thread")
-            self._update_current_wpnz_articles()
+    def wait_until_ready(self, timeout: Optional[float] = None) -> bool:
+        """Block until there is a title set to check against, either from the snapshot or the first refresh."""
+        return self.ready.wait(timeout)
+
+    def close(self) -> None:
+        self._stopped.set()
+
+    def add_listener(self, listener: Callable[['WPNZArticleProvider'], None]) -> None:
+        """
+        Call ``listener(provider)`` every time a new title set is published, and straight away if there already is one.
+
+        Listeners are called on the thread that published the titles, so they should hand slow work off elsewhere.
+        """
+        self._listeners.append(listener)
+        if self.ready.is_set():
+            listener(self)
+
+    def titles(self) -> List[str]:
+        """The canonical titles of the WPNZ articles, not including redirects."""
+        return self._articles.split('\n') if self._articles else []
+
+    def redirects(self) -> List[str]:
+        return self._redirects.split('\n') if self._redirects else []
 
-    def _update_current_wpnz_articles(self):
-        self._instance_logger.info(f"Sending query to petscan with '{self.last_update}'")
-        query_result = requests.get('&'.join([wpnz_petscan_query, self.last_update]))
+    def refresh(self, full: Optional[bool] = None) -> None:
+        """
+        Fetch changes from PetScan and publish the new title set.
 
-        query_result.raise_for_status()
-        self.last_update = f'after={datetime.now(timezone.utc).strftime("%Y%m%d%H%M%S")}'
-        self._instance_logger.info(f"Updated last_update to {self.last_update}")
+        By default this does a full refresh if one is due and an incremental one otherwise.
+        """
+        with self._refresh_lock:
+            started = time.time()
+            if full is None:
+                full = not self.ready.is_set() or started - self.last_full_refresh >= self.full_refresh_interval
+
+            if full:
+                articles = self._query_petscan()
+                redirects = self._query_redirects(articles)
+                last_full_refresh = started
+            else:
+                changed = self._query_petscan(after=self.last_refresh)
+                articles = set(self.titles()) | changed
+                # only recently edited articles are likely to have gained redirects
+                redirects = set(self.redirects()) | self._query_redirects(changed)
+                last_full_refresh = self.last_full_refresh
+
+            WPNZ_REFRESH_SECONDS.labels('full' if full else 'incremental').observe(time.time() - started)
+            articles = sorted(articles)
+            redirects = sorted(redirects)
+            self._save_snapshot(articles, redirects, started, last_full_refresh)
+            self._publish(articles, redirects, started, last_full_refresh)
+            self._instance_logger.info("Updated list of WPNZ articles with a %s refresh, new size: %d articles and "
+                                       "%d redirects", 'full' if full else 'incremental', len(articles),
+                                       len(redirects))
+
+    def _publish(self, articles: List[str], redirects: List[str], last_refresh: float,
+                 last_full_refresh: float) -> None:
+        article_titles = TitleIndex(articles + redirects)
+        self._articles = '\n'.join(articles)
+        self._redirects = '\n'.join(redirects)
+        self.article_titles = article_titles
+        self.last_refresh = last_refresh
+        self.last_full_refresh = last_full_refresh
+        WPNZ_ARTICLES.set(len(articles))
+        WPNZ_REDIRECTS.set(len(redirects))
+        WPNZ_INDEX_BYTES.set(article_titles.nbytes)
+        self.ready.set()
+        for listener in list(self._listeners):
+            try:
+                listener(self)
+            except Exception as e:
+                self._instance_logger.error("A listener failed after the WPNZ articles were updated", exc_info=e)
+
+    def _query_petscan(self, after: Optional[float] = None) -> Set[str]:
+        last_update = ''
+        if after:
+            last_update = f'after={datetime.fromtimestamp(after, timezone.utc).strftime("%Y%m%d%H%M%S")}'
+        self._instance_logger.info(f"Sending query to petscan with '{last_update}'")
+        query_result = self.scheduler.call(self._get, '&'.join([wpnz_petscan_query, last_update]), timeout=300,
+                                           endpoint='petscan', priority=Priority.BACKGROUND)
 
         parsed_results = query_result.json()
+        return {
+            canonicalize_title(article['title'])
+            for thing in parsed_results['*']
+            for article in thing['a']['*']
+        }
+
+    def _query_redirects(self, titles: Iterable[str], batch_size: int = 50) -> Set[str]:
+        """Ask the wiki for the mainspace redirects to ``titles``, 50 titles per request."""
+        titles = sorted(titles)
+        redirects = set()
+        for start in range(0, len(titles), batch_size):
+            params = {
+                'action': 'query',
+                'format': 'json',
+                'formatversion': '2',
+                'prop': 'redirects',
+                'rdprop': 'title',
+                'rdnamespace': '0',
+                'rdlimit': 'max',
+                'titles': '|'.join(titles[start:start + batch_size]),
+                'maxlag': '5',
+            }
+            while True:
+                result = self.scheduler.call(self._query_api, params, priority=Priority.BACKGROUND)
+                if 'error' in result:
+                    raise ValueError(f"API error fetching redirects: {result['error']}")
+                for page in result.get('query', {}).get('pages', []):
+                    for redirect in page.get('redirects', []):
+                        redirects.add(redirect['title'])
+                if 'continue' not in result:
+                    break
+                params.update(result['continue'])
+        return redirects
+
+    def _get(self, url: str, **kwargs) -> requests.Response:
+        response = self.session.get(url, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def _query_api(self, params: dict) -> dict:
+        response = self._get(self.api_url, params=params, timeout=60)
+        result = response.json()
+        if result.get('error', {}).get('code') == 'maxlag':
+            raise RateLimitedError(retry_after(response), result['error'].get('info', ''))
+        return result
+
+    def _load_snapshot(self) -> None:
+        if not self.snapshot_file or not Path(self.snapshot_file).exists():
+            self._instance_logger.info("No WPNZ article snapshot, the set will be empty until the first refresh")
+            return
+        try:
+            self._snapshot_mtime = Path(self.snapshot_file).stat().st_mtime
+            with open(self.snapshot_file, 'r', encoding='utf-8') as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            articles = list(snapshot['titles'])
+            redirects = list(snapshot.get('redirects', []))
+            last_refresh = float(snapshot['last_refresh'])
+            last_full_refresh = float(snapshot['last_full_refresh'])
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self._instance_logger.warning("Ignoring unreadable WPNZ article snapshot %s", self.snapshot_file,
+                                          exc_info=e)
+            return
+        with self._refresh_lock:
+            if self.ready.is_set() and last_refresh <= self.last_refresh:
+                return  # a refresh finished before the snapshot was read
+            self._publish(articles, redirects, last_refresh, last_full_refresh)
+        self._instance_logger.info("Loaded %d WPNZ articles and %d redirects from %s", len(articles), len(redirects),
+                                   self.snapshot_file)
+
+    def _save_snapshot(self, articles: List[str], redirects: List[str], last_refresh: float,
+                       last_full_refresh: float) -> None:
+        if not self.snapshot_file:
+            return
+        try:
+            atomic_write_json(self.snapshot_file, {
+                'titles': articles,
+                'redirects': redirects,
+                'last_refresh': last_refresh,
+                'last_full_refresh': last_full_refresh,
+            })
+        except OSError as e:
+            self._instance_logger.error("Failed to write the WPNZ article snapshot", exc_info=e)
+
+    def _seconds_until_refresh(self) -> float:
+        if not self.ready.is_set():
+            return 0
+        now = time.time()
+        return max(0.0, min(self.last_refresh + self.refresh_interval,
+                            self.last_full_refresh + self.full_refresh_interval) - now)
+
+    def _periodic_update(self):
+        self._instance_logger.info("Started background update thread")
+        self._load_snapshot()
+        while not self._stopped.wait(self._seconds_until_refresh()):
+            self._instance_logger.info("Running async update thread")
+            try:
+                self.refresh()
+            except (requests.RequestException, RateLimitedError, ValueError, KeyError) as e:
+                WPNZ_REFRESH_FAILURES.inc()
+                self._instance_logger.error("Failed to refresh the WPNZ article set, retrying in a minute",
+                                            exc_info=e)
+                if self._stopped.wait(60):
+                    return
 
-        for thing in parsed_results['*']:
-            for article in thing['a']['*']:
-                self.article_titles.add(article['title'].replace('_', ' '))
-        self._instance_logger.info(f"Updated list of WPNZ articles, new size: {len(self.article_titles)} articles")
+    def _follow_snapshot(self, check_interval: float = 60):
+        self._instance_logger.info("Following changes to %s", self.snapshot_file)
+        self._load_snapshot()
+        while not self._stopped.wait(check_interval if self.ready.is_set() else 1):
+            try:
+                mtime = Path(self.snapshot_file).stat().st_mtime
+            except OSError:
+                continue
+            if mtime != self._snapshot_mtime:
+                self._load_snapshot()
 
 
 if __name__ == '__main__':
-    print(WPNZArticleProvider().article_titles)
+    provider = WPNZArticleProvider()
+    provider.wait_until_ready()
+    print(provider.titles())
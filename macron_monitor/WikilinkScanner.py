@@ -0,0 +1,89 @@
+import re
+from typing import Iterator, List, Optional, Tuple
+
+_token_regex = re.compile(r'\[\[|]]|\{\{|}}|\|')
+
+_LINK = 0
+_TEMPLATE = 1
+
+
+class Wikilink:
+    """
+    A link found by ``scan_wikilinks``.
+
+    Only offsets are stored; ``target`` and ``label`` are sliced out of the text when asked for, so nested links
+    don't each copy the text they enclose.
+    """
+    __slots__ = ('text', 'start', 'pipe', 'end')
+
+    def __init__(self, text: str, start: int, pipe: int, end: int) -> None:
+        self.text = text
+        self.start = start
+        self.pipe = pipe
+        self.end = end
+
+    @property
+    def piped(self) -> bool:
+        return self.pipe >= 0
+
+    @property
+    def target(self) -> str:
+        return self.text[self.start + 2:self.pipe if self.piped else self.end - 2]
+
+    @property
+    def label(self) -> Optional[str]:
+        return self.text[self.pipe + 1:self.end - 2] if self.piped else None
+
+    @property
+    def span(self) -> Tuple[int, int]:
+        return self.start, self.end
+
+    def __iter__(self):
+        return iter((self.target, self.label, self.span))
+
+    def __repr__(self) -> str:
+        return f'Wikilink({self.target!r}, {self.label!r}, {self.span!r})'
+
+
+def scan_wikilinks(text: str) -> Iterator[Wikilink]:
+    """
+    Yield every ``[[target]]`` and ``[[target|label]]`` link in ``text`` in the order they are closed.
+
+    The text is tokenized once and open links and templates are tracked on a stack, so links nested inside
+    templates or inside ``[[File:...]]`` captions are found, and a ``|`` inside a template in a link's label is not
+    mistaken for the link's pipe. An unmatched ``]]`` or ``}}`` is ignored, and a ``[[`` that is never closed
+    produces nothing. Each frame is pushed and popped at most once, so the scan is linear in the length of the text.
+    """
+    # frames are [kind, start, pipe position]
+    stack: List[list] = []
+    open_links = 0
+    open_templates = 0
+    for token in _token_regex.finditer(text):
+        kind = token.group()
+        if kind == '[[':
+            stack.append([_LINK, token.start(), -1])
+            open_links += 1
+        elif kind == '{{':
+            stack.append([_TEMPLATE, token.start(), -1])
+            open_templates += 1
+        elif kind == '|':
+            if stack and stack[-1][0] == _LINK and stack[-1][2] < 0:
+                stack[-1][2] = token.start()
+        elif kind == ']]':
+            if not open_links:
+                continue
+            # anything still open inside the link was never closed
+            while stack[-1][0] != _LINK:
+                stack.pop()
+                open_templates -= 1
+            _, start, pipe = stack.pop()
+            open_links -= 1
+            yield Wikilink(text, start, pipe, token.end())
+        else:  # '}}'
+            if not open_templates:
+                continue
+            while stack[-1][0] != _TEMPLATE:
+                stack.pop()
+                open_links -= 1
+            stack.pop()
+            open_templates -= 1
@@ -1,6 +1,9 @@
 import dataclasses
+import json
 import logging
+import os
 import re
+import tempfile
 
 module_logger = logging.getLogger(__name__)
 
@@ -27,4 +30,28 @@ def count_macrons(*string: str) -> int:
 _macron_regex = re.compile(r'[ĀĒĪŌŪāēīōū]')
 
 def contains_macron(string: str) -> bool:
-    return bool(_macron_regex.findall(string))
\ No newline at end of file
+    return bool(_macron_regex.findall(string))
+
+
+def log_worker_to_console(log_level) -> None:
+    """Send this worker process's logging to the console, named by process so workers can be told apart."""
+    log_handler = logging.StreamHandler()
+    log_handler.setFormatter(logging.Formatter('%(asctime)s - %(levelname)s - %(processName)s - %(name)s - '
+                                               '%(message)s', datefmt="%Y-%m-%dT%H:%M:%S%z"))
+    module_logger.addHandler(log_handler)
+    module_logger.setLevel(log_level)
+
+
+def atomic_write_json(path: str, data) -> None:
+    """Write ``data`` as JSON to ``path`` so readers see either the old file or the new one, never a partial one."""
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.' + os.path.basename(path), suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as tmp_file:
+            json.dump(data, tmp_file, ensure_ascii=False)
+            tmp_file.flush()
+            os.fsync(tmp_file.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
@@ -1,11 +1,20 @@
 import re
-from typing import Optional
+import threading
+from typing import Iterable, List, Optional, Set
 
+from prometheus_client import Gauge, Histogram
 from unidecode import unidecode
 
-from macron_monitor import SuspiciousRev
+from macron_monitor import SuspiciousRev, contains_macron, module_logger
+from macron_monitor.AhoCorasick import AhoCorasick
+from macron_monitor.DiffAnalysis import DiffAnalysis
+from macron_monitor.WPNZArticleProvider import WPNZArticleProvider
 from macron_monitor.detectors import Detector
 
+VOCABULARY_SIZE = Gauge('maori_word_vocabulary_size', 'Unmacroned words MaoriWordDetector currently looks for')
+VOCABULARY_COMPILE_SECONDS = Histogram('maori_word_vocabulary_compile_seconds',
+                                       'Time taken to build the MaoriWordDetector matcher from the WPNZ titles')
+
 WORDS = ['Ahikōuka', 'Atatū', 'Auahitūroa', 'Eketāhuna', 'Hinehōaka', 'Hinenuitepō', 'Hinepūkohurangi', 'Hāhau',
          'Hākuturi', 'Hāmama', 'Hāngi', 'Hāpua', 'Hāpuku', 'Hāwea', 'Hāwera', 'Hūhana', 'Hūkerenui',
          'Kahikatea', 'Kaikōrero', 'Kaikōura', 'Kawhātau', 'Kaūmatua', 'Kererū', 'Kumeū', 'Kākāpō', 'Kākāriki',
@@ -35,7 +44,7 @@ WORDS = ['Ahikōuka', 'Atatū', 'Auahitūroa', 'Eketāhuna', 'Hinehōaka', 'Hine
          'pīnati', 'pīrangi', 'pōtae', 'pōuri', 'pūtu', 'rākau', 'rāpeti', 'rīwai', 'rōpū', 'rūma', 'tamāhine',
          'terēina', 'tuarā', 'tungāne', 'tuāhine', 'tākaro', 'tāone', 'tātahi', 'tātou',
          'tēina', 'tēnei', 'tīmata', 'tīpuna', 'tōhi', 'tōkena', 'tūpuna',
-         'tūrangawaewae', 'tūru', 'tūtae', 'whaikōrero', 'whetū', 'whānau', 'whāngai', 'wāhine',
+         'tūrangawaewae', 'tūru', 'tūtae', 'tūī', 'whaikōrero', 'whetū', 'whānau', 'whāngai', 'wāhine',
          'Ākitio', 'Ākura', 'Āpirana', 'Āpiti', 'Ārohirohi', 'Ātiamuri', 'Āwhitu', 'ākonga', 'āporo',
          'āpōpō', 'ātaahua', 'āwhina', 'Ōakura', 'Ōhaeawai', 'Ōhau', 'Ōhaupō', 'Ōhingaiti',
          'Ōhiwa', 'Ōhope', 'Ōhura', 'Ōkaihau', 'Ōkato', 'Ōkiwi Bay', 'Ōkura', 'Ōkārito', 'Ōmiha', 'Ōmokoroa', 'Ōmāpere',
@@ -44,14 +53,116 @@ WORDS = ['Ahikōuka', 'Atatū', 'Auahitūroa', 'Eketāhuna', 'Hinehōaka', 'Hine
 
 SUSPICIOUS_WORDS = set(map(lambda word: unidecode(word).lower(), WORDS))
 
-giant_regex = re.compile(r'(?![^{]*}})[-\s—\[\'"]+(' + '|'.join(SUSPICIOUS_WORDS) + r')[-—\s.,<!?:;\'\]\"{]+')
+# a word only counts if it is delimited by one of these on each side, so it isn't part of a longer word
+LEADING_DELIMITERS = frozenset('-—[\'"')
+TRAILING_DELIMITERS = frozenset('-—.,<!?:;\']"{')
+
+suspicious_word_matcher = AhoCorasick(SUSPICIOUS_WORDS)
+
+# shorter title words fold into too many English words and abbreviations to be worth looking for
+MIN_TITLE_WORD_LENGTH = 4
+_title_word_regex = re.compile(r'\w+')
+
+
+def title_words(titles: Iterable[str]) -> Set[str]:
+    """The unmacroned, lowercased form of every word with a macron in ``titles``, such as ``rotokakahi``."""
+    words = set()
+    for title in titles:
+        if not contains_macron(title):
+            continue
+        for word in _title_word_regex.findall(title):
+            if len(word) >= MIN_TITLE_WORD_LENGTH and contains_macron(word):
+                words.add(unidecode(word).lower())
+    return words
+
+
+def find_suspicious_words(text: str, matcher: AhoCorasick = suspicious_word_matcher) -> List[str]:
+    """
+    Find the unmacroned words in lowercased ``text``.
+
+    Words inside a template are ignored: a word is skipped when the next ``}}`` after it comes before the next ``{``.
+    """
+    found = []
+    next_open, next_close, checked_from = -1, -1, len(text)
+    for start, end in matcher.iter_matches(text):
+        if start == 0 or end == len(text):
+            continue
+        before, after = text[start - 1], text[end]
+        if not (before in LEADING_DELIMITERS or before.isspace()):
+            continue
+        if not (after in TRAILING_DELIMITERS or after.isspace()):
+            continue
+
+        # matches arrive roughly in order, so the brace searches are only redone once we pass what they found
+        if start < checked_from or start > next_open >= 0 or start > next_close >= 0:
+            next_open, next_close, checked_from = text.find('{', start), text.find('}}', start), start
+        if next_close >= 0 and (next_open < 0 or next_close < next_open):
+            continue
+        found.append(text[start:end])
+    return found
 
 
 class MaoriWordDetector(Detector):
+    """
+    Flags added text containing a Māori word spelled without its macrons.
+
+    The words come from ``WORDS`` and, when given a ``WPNZArticleProvider``, from the macronised words in WPNZ
+    article titles. Title words are only looked for in WPNZ articles, as many of them fold into English words, like
+    ``hone`` from ``Hōne Heke``, that are common everywhere else. The title matcher is rebuilt on a background thread
+    every time the provider refreshes and swapped in once it is built, so detection carries on with the previous
+    matcher meanwhile.
+    """
+    _class_logger = module_logger.getChild(__qualname__)
+
     alert_page = 'User:MacronMonitor/Alerts'
 
-    def detect(self, change: dict, diff: dict) -> Optional[SuspiciousRev]:
-        matches = self._flatten([giant_regex.findall(hunk.lower()) for hunk in diff['added-context']])
+    def __init__(self,
+                 wpnz_article_provider: Optional[WPNZArticleProvider] = None,
+                 ) -> None:
+        self._instance_logger = self._class_logger.getChild(str(id(self)))
+        self.wpnz_article_provider = wpnz_article_provider
+        self.matcher = suspicious_word_matcher
+        self.title_matcher: Optional[AhoCorasick] = None
+        self.vocabulary_ready = threading.Event()
+        self._compile_lock = threading.Lock()
+        self._requested_generation = 0
+        self._published_generation = 0
+
+        if wpnz_article_provider is None:
+            self.vocabulary_ready.set()
+        else:
+            wpnz_article_provider.add_listener(self._on_articles_updated)
+
+    def _on_articles_updated(self, wpnz_article_provider: WPNZArticleProvider) -> None:
+        with self._compile_lock:
+            self._requested_generation += 1
+            generation = self._requested_generation
+        compiler = threading.Thread(target=self._compile, args=(wpnz_article_provider.titles(), generation),
+                                    daemon=True, name='background_MaoriWordCompile')
+        compiler.start()
+
+    def _compile(self, titles: List[str], generation: int) -> None:
+        with VOCABULARY_COMPILE_SECONDS.time():
+            matcher = AhoCorasick(title_words(titles) - SUSPICIOUS_WORDS)
+        with self._compile_lock:
+            # a later refresh may have finished compiling first
+            if generation < self._published_generation:
+                return
+            self.title_matcher = matcher
+            self._published_generation = generation
+        VOCABULARY_SIZE.set(self.matcher.size + matcher.size)
+        self.vocabulary_ready.set()
+        self._instance_logger.info("Now looking for %d unmacroned words, and %d more in WPNZ articles",
+                                   self.matcher.size, matcher.size)
+
+    def detect(self, change: dict, diff: dict, analysis: Optional[DiffAnalysis] = None) -> Optional[SuspiciousRev]:
+        analysis = self._analysis(change, diff, analysis)
+        matchers = [self.matcher]
+        title_matcher = self.title_matcher
+        if title_matcher is not None and analysis.is_wpnz_article:
+            matchers.append(title_matcher)
+        matches = self._flatten([find_suspicious_words(hunk, matcher)
+                                 for matcher in matchers for hunk in analysis.added_lowered])
         if any(matches):
             return SuspiciousRev(
                 alert_page=self.alert_page,
@@ -1,7 +1,7 @@
-import logging
 from typing import Optional
 
-from macron_monitor import SuspiciousRev, count_macrons, module_logger
+from macron_monitor import SuspiciousRev, module_logger
+from macron_monitor.DiffAnalysis import DiffAnalysis
 from macron_monitor.WPNZArticleProvider import WPNZArticleProvider
 from macron_monitor.detectors import Detector
 
@@ -18,19 +18,19 @@ class RemovedMacronDetector(Detector):
         self._instance_logger = self._class_logger.getChild(str(id(self)))
         self.wpnz_article_provider = wpnz_article_provider
 
-    def detect(self, change: dict, diff: dict) -> Optional[SuspiciousRev]:
-        if change['title'] not in self.wpnz_article_provider.article_titles:
+    def detect(self, change: dict, diff: dict, analysis: Optional[DiffAnalysis] = None) -> Optional[SuspiciousRev]:
+        analysis = self._analysis(change, diff, analysis)
+        if not analysis.is_wpnz_article:
             self._instance_logger.debug("Article is not within WPNZ, skipping it")
             return
 
-        deleted_macrons = count_macrons(*diff['deleted-context'])
-        added_macrons = count_macrons(*diff['added-context'])
-
-        if deleted_macrons > added_macrons:
+        stripped = list(dict.fromkeys(analysis.stripped_macron_words))
+        if stripped:
+            words = ', '.join(f'{old} → {new}' for old, new in stripped)
             return SuspiciousRev(
                 alert_page=self.alert_page,
                 title=change['title'],
                 user=change['user'],
                 revision=change['revision'],
-                reason=f"removed '''{deleted_macrons - added_macrons}''' macron(s) from a WPNZ article",
+                reason=f"removed macrons from '''{len(stripped)}''' word(s) in a WPNZ article: {words}",
             )
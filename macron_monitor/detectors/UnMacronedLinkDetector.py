@@ -1,13 +1,38 @@
-from typing import Optional
+from typing import Container, Iterable, List, Optional, Tuple
 
 from macron_monitor import SuspiciousRev, module_logger, count_macrons, contains_macron
+from macron_monitor.DiffAnalysis import DiffAnalysis
 from macron_monitor.WPNZArticleProvider import WPNZArticleProvider
+from macron_monitor.WikilinkScanner import Wikilink, scan_wikilinks
 from macron_monitor.detectors import Detector
 
-import re
+_invalid_target_chars = frozenset('[]<>{}')
 
-link_regex = re.compile(r'\[\[([^\[\]<>{}]*?(?=[ĀĒĪŌŪāēīōū]+?)[^\[\]<>{}]*?)\|(.*?)]]')
-unmacroned_link_regex = re.compile(r'\[\[([^\[\]<>{}]*?(?=[ĀĒĪŌŪāēīōū]+?)[^\[\]<>{}]*?)\|([^ĀĒĪŌŪāēīōū]*?)]]')
+
+def find_macroned_piped_links(text: str, titles: Optional[Container[str]] = None) -> List[Tuple[str, str]]:
+    """Find the ``(target, label)`` of piped links in ``text`` whose target contains a macron."""
+    return select_macroned_piped_links(scan_wikilinks(text), titles)
+
+
+def select_macroned_piped_links(links: Iterable[Wikilink],
+                                titles: Optional[Container[str]] = None) -> List[Tuple[str, str]]:
+    """
+    Pick the ``(target, label)`` of the piped links whose target contains a macron.
+
+    If ``titles`` is given, only links whose target is one of them are returned. The label is only read for links
+    that pass every other check.
+    """
+    found = []
+    for link in links:
+        if not link.piped:
+            continue
+        target = link.target
+        if not contains_macron(target) or not _invalid_target_chars.isdisjoint(target):
+            continue
+        if titles is not None and target not in titles:
+            continue
+        found.append((target, link.label))
+    return found
 
 
 class UnMacronedLinkDetector(Detector):
@@ -22,9 +47,12 @@ class UnMacronedLinkDetector(Detector):
         self._instance_logger = self._class_logger.getChild(str(id(self)))
         self.wpnz_article_provider = wpnz_article_provider
 
-    def detect(self, change: dict, diff: dict) -> Optional[SuspiciousRev]:
-        matches = self._flatten([link_regex.findall(hunk) for hunk in diff['added-context']])
-        wpnz_matches = [m for m in matches if contains_macron(m[0]) and m[0] in self.wpnz_article_provider.article_titles]
+    def detect(self, change: dict, diff: dict, analysis: Optional[DiffAnalysis] = None) -> Optional[SuspiciousRev]:
+        analysis = self._analysis(change, diff, analysis)
+        if not analysis.added_macrons:
+            # only links to a title with a macron in it can be piped over one
+            return
+        wpnz_matches = select_macroned_piped_links(analysis.added_wikilinks, self.wpnz_article_provider.article_titles)
         removed_macron_matches = sorted(list(set(m for m in wpnz_matches if count_macrons(m[0]) > count_macrons(m[1]))))
 
         alert_str = ', '.join([f'[[{m[0]}|{m[1]}]]' for m in removed_macron_matches])
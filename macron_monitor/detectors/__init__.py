@@ -2,14 +2,27 @@ from abc import abstractmethod
 from typing import Optional
 
 from macron_monitor import SuspiciousRev
+from macron_monitor.DiffAnalysis import DiffAnalysis
 
 
 class Detector:
 
+    @property
+    def name(self) -> str:
+        """What the detector is called in metrics."""
+        return type(self).__name__
+
     @staticmethod
     def _flatten(xss):
         return [x for xs in xss for x in xs]
 
+    def _analysis(self, change_message: dict, diff: dict, analysis: Optional[DiffAnalysis]) -> DiffAnalysis:
+        """Use the analysis shared by the caller, or make one if the detector is being called on its own."""
+        if analysis is not None:
+            return analysis
+        return DiffAnalysis(change_message, diff, getattr(self, 'wpnz_article_provider', None))
+
     @abstractmethod
-    def detect(self, change_message: dict, diff: dict) -> Optional[SuspiciousRev]:
+    def detect(self, change_message: dict, diff: dict,
+               analysis: Optional[DiffAnalysis] = None) -> Optional[SuspiciousRev]:
         raise NotImplementedError()
@@ -1,7 +1,31 @@
+import time
 import unittest
 
 from macron_monitor import SuspiciousRev
-from macron_monitor.detectors.MaoriWordDetector import MaoriWordDetector
+from macron_monitor.TitleIndex import TitleIndex
+from macron_monitor.detectors.MaoriWordDetector import MaoriWordDetector, title_words
+
+
+class FakeArticleProvider:
+    def __init__(self, titles):
+        self._titles = titles
+        self.listeners = []
+
+    @property
+    def article_titles(self):
+        return TitleIndex(self._titles)
+
+    def titles(self):
+        return self._titles
+
+    def add_listener(self, listener):
+        self.listeners.append(listener)
+        listener(self)
+
+    def refresh(self, titles):
+        self._titles = titles
+        for listener in self.listeners:
+            listener(self)
 
 
 class test_MaoriWordDetector(unittest.TestCase):
@@ -101,6 +125,38 @@ class test_MaoriWordDetector(unittest.TestCase):
             })
         self.assertEqual(None, result)
 
+    def test_title_words(self):
+        self.assertEqual({'rotokakahi', 'turangi', 'ngati'},
+                         title_words(['Lake Rotokākahi', 'Tūrangi (New Zealand)', 'Ngāti Pā', 'Wellington']))
+
+    def test_vocabulary_follows_wpnz_titles(self):
+        change = {'title': 'Lake Rotokākahi', 'user': 'Cloventt', 'revision': {'old': 1234567, 'new': 1234568}}
+        diff = {'removed-context': [], 'added-context': ['The road from Turangi to Owairaka.']}
+        provider = FakeArticleProvider(['Lake Rotokākahi', 'Tūrangi'])
+        detector = MaoriWordDetector(provider)
+        self.assertTrue(detector.vocabulary_ready.wait(5))
+        self.assertIn("'''turangi'''", detector.detect(change, diff).reason)
+
+        previous = detector.title_matcher
+        provider.refresh(['Lake Rotokākahi', 'Tūrangi', 'Ōwairaka'])
+        deadline = time.monotonic() + 5
+        while detector.title_matcher is previous and time.monotonic() < deadline:
+            time.sleep(0.01)
+
+        self.assertIn("'''owairaka, turangi'''", detector.detect(change, diff).reason)
+
+    def test_title_words_only_apply_to_wpnz_articles(self):
+        diff = {'removed-context': [],
+                'added-context': [' he trained to hone his skills, and sold manuka honey. ']}
+        provider = FakeArticleProvider(['Hōne Heke', 'Mānuka honey'])
+        detector = MaoriWordDetector(provider)
+        self.assertTrue(detector.vocabulary_ready.wait(5))
+
+        change = {'title': 'Beekeeping', 'user': 'Cloventt', 'revision': {'old': 1234567, 'new': 1234568}}
+        self.assertIsNone(detector.detect(change, diff))
+        change['title'] = 'Mānuka honey'
+        self.assertIn("'''hone, manuka'''", detector.detect(change, diff).reason)
+
 
 if __name__ == '__main__':
     unittest.main()
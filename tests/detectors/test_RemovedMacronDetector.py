@@ -0,0 +1,53 @@
+import unittest
+
+from macron_monitor.detectors.RemovedMacronDetector import RemovedMacronDetector
+from tests.detectors import MockWPNZArticleProvider
+
+
+class test_RemovedMacronDetector(unittest.TestCase):
+    def setUp(self):
+        self.article_provider = MockWPNZArticleProvider()
+        self.article_provider.article_titles = {'Lake Taupō'}
+        self.change = {
+            'title': 'Lake Taupō',
+            'user': 'Cloventt',
+            'revision': {
+                'old': 1234567,
+                'new': 1234568,
+            },
+        }
+
+    def test_names_the_stripped_words(self):
+        detector = RemovedMacronDetector(self.article_provider)
+
+        result = detector.detect(self.change, {
+            'deleted-context': ['Lake Taupō is the largest lake in Aotearoa, and Taupō is also a town.'],
+            'added-context': ['Lake Taupo is the largest lake in Aotearoa, and Taupo is also a Māori town.'],
+        })
+
+        self.assertEqual('User:MacronMonitor/Alerts', result.alert_page)
+        self.assertEqual("removed macrons from '''1''' word(s) in a WPNZ article: Taupō → Taupo", result.reason)
+
+    def test_ignores_edits_that_keep_their_macrons(self):
+        detector = RemovedMacronDetector(self.article_provider)
+
+        result = detector.detect(self.change, {
+            'deleted-context': ['Lake Taupō is a lake.'],
+            'added-context': ['Lake Taupō is a lake in the Waikato.'],
+        })
+
+        self.assertEqual(None, result)
+
+    def test_ignores_articles_outside_wpnz(self):
+        detector = RemovedMacronDetector(self.article_provider)
+
+        result = detector.detect(dict(self.change, title='Kyūshū'), {
+            'deleted-context': ['Lake Taupō'],
+            'added-context': ['Lake Taupo'],
+        })
+
+        self.assertEqual(None, result)
+
+
+if __name__ == '__main__':
+    unittest.main()
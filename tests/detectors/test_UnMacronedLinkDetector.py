@@ -1,20 +1,23 @@
 import unittest
 
 from macron_monitor import SuspiciousRev
-from macron_monitor.detectors.UnMacronedLinkDetector import link_regex, UnMacronedLinkDetector
+from macron_monitor.detectors.UnMacronedLinkDetector import find_macroned_piped_links, UnMacronedLinkDetector
 from tests.detectors import MockWPNZArticleProvider
 
 
 class test_UnMacronedLinkDetector(unittest.TestCase):
-    def test_link_regex(self):
-        self.assertEqual([], link_regex.findall("there is no link here"))
-        self.assertEqual([], link_regex.findall("there is no piped link [[here]]"))
-        self.assertEqual([], link_regex.findall("there is a macron but no piped link [[hēre]]"))
-        self.assertEqual([], link_regex.findall("there is no macron but a piped link [[here|here]]"))
-        self.assertEqual([('hēre', 'hēre')], link_regex.findall("there is a macron and a piped link [[hēre|hēre]]"))
-        self.assertEqual([('hēre', 'here')], link_regex.findall("there is a macron and a piped link [[hēre|here]]"))
-        self.assertEqual([('ĀĒĪŌŪāēīōū', 'ĀĒĪŌŪāēīōū')], link_regex.findall("there is a macron and a piped link [[ĀĒĪŌŪāēīōū|ĀĒĪŌŪāēīōū]]"))
-        self.assertEqual([('ĀĒĪŌŪāēīōū', 'AEIOUaeiou')], link_regex.findall("there is a macron and a piped link [[ĀĒĪŌŪāēīōū|AEIOUaeiou]]"))
+    def test_find_macroned_piped_links(self):
+        self.assertEqual([], find_macroned_piped_links("there is no link here"))
+        self.assertEqual([], find_macroned_piped_links("there is no piped link [[here]]"))
+        self.assertEqual([], find_macroned_piped_links("there is a macron but no piped link [[hēre]]"))
+        self.assertEqual([], find_macroned_piped_links("there is no macron but a piped link [[here|here]]"))
+        self.assertEqual([('hēre', 'hēre')], find_macroned_piped_links("there is a macron and a piped link [[hēre|hēre]]"))
+        self.assertEqual([('hēre', 'here')], find_macroned_piped_links("there is a macron and a piped link [[hēre|here]]"))
+        self.assertEqual([('ĀĒĪŌŪāēīōū', 'ĀĒĪŌŪāēīōū')], find_macroned_piped_links("there is a macron and a piped link [[ĀĒĪŌŪāēīōū|ĀĒĪŌŪāēīōū]]"))
+        self.assertEqual([('ĀĒĪŌŪāēīōū', 'AEIOUaeiou')], find_macroned_piped_links("there is a macron and a piped link [[ĀĒĪŌŪāēīōū|AEIOUaeiou]]"))
+        self.assertEqual([('Kākāpō', 'kakapo')], find_macroned_piped_links("{{cite|title=[[Kākāpō|kakapo]]}}"))
+        self.assertEqual([('Kākāpō', 'kakapo'), ('File:Kākāpō.jpg', 'thumb|A [[Kākāpō|kakapo]]')],
+                         find_macroned_piped_links("[[File:Kākāpō.jpg|thumb|A [[Kākāpō|kakapo]]]]"))
 
     def test_detector_does_detect_not_things_that_were_deleted(self):
         article_provider = MockWPNZArticleProvider()
@@ -0,0 +1,27 @@
+import unittest
+
+from macron_monitor.AhoCorasick import AhoCorasick
+
+
+class test_AhoCorasick(unittest.TestCase):
+    def test_finds_overlapping_words(self):
+        matcher = AhoCorasick(['he', 'she', 'his', 'hers'])
+        text = 'ushers'
+
+        self.assertEqual(['she', 'he', 'hers'], [text[start:end] for start, end in matcher.iter_matches(text)])
+
+    def test_finds_words_containing_spaces(self):
+        matcher = AhoCorasick(['maori', 'te pati maori'])
+        text = 'the te pati maori party'
+
+        self.assertEqual([(4, 17), (12, 17)], list(matcher.iter_matches(text)))
+
+    def test_no_matches(self):
+        matcher = AhoCorasick(['kakapo'])
+
+        self.assertEqual([], list(matcher.iter_matches('kākāpō kakap kakapp')))
+        self.assertEqual(1, matcher.size)
+
+
+if __name__ == '__main__':
+    unittest.main()
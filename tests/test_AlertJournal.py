@@ -0,0 +1,66 @@
+import os
+import tempfile
+import time
+import unittest
+
+from macron_monitor import SuspiciousRev
+from macron_monitor.AlertJournal import AlertJournal
+
+
+def alert(revid, user='Someone', title='Taupō', reason='removed macrons'):
+    return SuspiciousRev('User:MacronMonitor/Alerts', title, user, {'old': revid - 1, 'new': revid}, reason)
+
+
+class test_AlertJournal(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'alerts.sqlite3')
+
+    def journal(self) -> AlertJournal:
+        journal = AlertJournal(self.path, flush_interval=60)
+        self.addCleanup(journal.close)
+        return journal
+
+    def test_already_alerted_survives_a_restart(self):
+        journal = self.journal()
+        self.assertTrue(journal.claim(alert(1), 'en.wikipedia.org'))
+        self.assertFalse(journal.claim(alert(1), 'en.wikipedia.org'))
+        self.assertTrue(journal.claim(alert(1, reason='linkpipe over macrons'), 'en.wikipedia.org'))
+        self.assertTrue(journal.claim(alert(1), 'en.wiktionary.org'))
+        journal.record(alert(1), 'en.wikipedia.org')
+        journal.close()
+
+        restarted = self.journal()
+        self.assertFalse(restarted.claim(alert(1), 'en.wikipedia.org'))
+        self.assertTrue(restarted.claim(alert(2), 'en.wikipedia.org'))
+
+    def test_unsaved_alerts_are_sent_again_after_a_restart(self):
+        journal = self.journal()
+        self.assertTrue(journal.claim(alert(1), 'en.wikipedia.org'))
+        journal.close()
+
+        self.assertTrue(self.journal().claim(alert(1), 'en.wikipedia.org'))
+
+    def test_queries_by_user_and_title(self):
+        journal = self.journal()
+        journal.record(alert(1, user='Vandal', title='Taupō'), 'en.wikipedia.org')
+        journal.record(alert(2, user='Vandal', title='Ōtaki'), 'en.wikipedia.org')
+        journal.record(alert(3, user='Someone', title='Taupō'), 'en.wikipedia.org')
+        self.assertEqual(journal.alerts(user='Vandal'), [])  # not written yet
+        journal.flush()
+
+        self.assertEqual([row['revid'] for row in journal.alerts(user='Vandal')], [2, 1])
+        self.assertEqual([row['user'] for row in journal.alerts(title='Taupō')], ['Someone', 'Vandal'])
+        self.assertEqual(len(journal.alerts(limit=1)), 1)
+        self.assertEqual(len(journal.alerts(limit=-1)), 1)
+        self.assertEqual(len(journal.top_users(limit=-1)), 1)
+        self.assertEqual(journal.alerts(since=time.time() + 60), [])
+
+        top = journal.top_users()
+        self.assertEqual([(row['user'], row['alerts'], row['titles']) for row in top],
+                         [('Vandal', 2, 2), ('Someone', 1, 1)])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import time
+import unittest
+
+import pywikibot
+import requests
+
+from macron_monitor import SuspiciousRev
+from macron_monitor.AlertWriter import AlertWriter
+
+
+class FakePage:
+    def __init__(self, text, conflicts=0, failures=0):
+        self.saved_text = text
+        self.text = None
+        self.conflicts = conflicts
+        self.failures = failures
+        self.summaries = []
+
+    def get(self, force=False):
+        return self.saved_text
+
+    def save(self, summary, bot, minor):
+        if self.failures:
+            self.failures -= 1
+            raise pywikibot.exceptions.OtherPageSaveError(None, 'server is down')
+        if self.conflicts:
+            self.conflicts -= 1
+            self.saved_text = self.saved_text + 'someone else edited\n'
+            raise pywikibot.exceptions.EditConflictError(None)
+        self.saved_text = self.text
+        self.summaries.append(summary)
+
+
+class FakeAlertWriter(AlertWriter):
+    def __init__(self, pages, flush_interval=3600, **kwargs):
+        self.pages = pages
+        super().__init__(site=None, flush_interval=flush_interval, **kwargs)
+
+    def _get_page(self, alert_page):
+        return self.pages[alert_page]
+
+
+def _alert(title, revision, alert_page='User:MacronMonitor/Alerts'):
+    return SuspiciousRev(alert_page=alert_page, title=title, user='Cloventt', revision={'old': 1, 'new': revision},
+                         reason='test')
+
+
+class test_AlertWriter(unittest.TestCase):
+    def test_writes_one_edit_per_page(self):
+        alerts = FakePage('==Alerts==\n')
+        other = FakePage('==Alerts==\n')
+        writer = FakeAlertWriter({'User:MacronMonitor/Alerts': alerts, 'User:Other/Alerts': other})
+
+        writer.add(_alert('Kākāpō', 1))
+        writer.add(_alert('Taupō', 2))
+        writer.add(_alert('Ōtaki', 3, alert_page='User:Other/Alerts'))
+        writer.flush()
+
+        self.assertEqual(['add 2 alerts for edits on pages [[Kākāpō]], [[Taupō]]'], alerts.summaries)
+        self.assertEqual(['add alert for edit on page [[Ōtaki]]'], other.summaries)
+        self.assertEqual('==Alerts==\n' + _alert('Taupō', 2).to_string() + '\n' + _alert('Kākāpō', 1).to_string()
+                         + '\n', alerts.saved_text)
+
+    def test_retries_edit_conflicts(self):
+        page = FakePage('==Alerts==\n', conflicts=2)
+        writer = FakeAlertWriter({'User:MacronMonitor/Alerts': page})
+
+        writer.add(_alert('Kākāpō', 1))
+        writer.flush()
+
+        self.assertEqual(1, len(page.summaries))
+        self.assertIn('someone else edited', page.saved_text)
+        self.assertIn('Kākāpō', page.saved_text)
+
+    def test_keeps_alerts_that_failed_to_save(self):
+        page = FakePage('==Alerts==\n', failures=1)
+        writer = FakeAlertWriter({'User:MacronMonitor/Alerts': page})
+
+        writer.add(_alert('Kākāpō', 1))
+        writer.flush()
+        self.assertEqual([], page.summaries)
+
+        writer.add(_alert('Taupō', 2))
+        writer.flush()
+        self.assertEqual(['add 2 alerts for edits on pages [[Kākāpō]], [[Taupō]]'], page.summaries)
+
+    def test_reports_alerts_once_they_are_saved(self):
+        page = FakePage('==Alerts==\n', failures=1)
+        writer = FakeAlertWriter({'User:MacronMonitor/Alerts': page})
+        written = []
+
+        writer.add(_alert('Kākāpō', 1), lambda: written.append(1))
+        writer.add(_alert('Taupō', 2))
+        writer.flush()
+        self.assertEqual([], written)
+
+        writer.flush()
+        self.assertEqual([1], written)
+
+    def test_keeps_alerts_when_a_write_raises_something_else(self):
+        page = FakePage('==Alerts==\n')
+        other = FakePage('==Alerts==\n')
+        failures = [requests.ConnectionError('connection reset')]
+
+        class FlakyAlertWriter(FakeAlertWriter):
+            def _write_page(self, alert_page, alerts):
+                if alert_page == 'User:MacronMonitor/Alerts' and failures:
+                    raise failures.pop()
+                return super()._write_page(alert_page, alerts)
+
+        writer = FlakyAlertWriter({'User:MacronMonitor/Alerts': page, 'User:Other/Alerts': other},
+                                  flush_interval=0.05)
+        writer.add(_alert('Kākāpō', 1))
+        writer.add(_alert('Ōtaki', 2, alert_page='User:Other/Alerts'))
+
+        # the background thread carries on after the failure and saves the alert on a later flush
+        deadline = time.monotonic() + 5
+        while not page.summaries and time.monotonic() < deadline:
+            time.sleep(0.05)
+        writer.close()
+        self.assertEqual(['add alert for edit on page [[Kākāpō]]'], page.summaries)
+        self.assertEqual(['add alert for edit on page [[Ōtaki]]'], other.summaries)
+
+    def test_offline_writes_nothing(self):
+        page = FakePage('==Alerts==\n')
+        writer = FakeAlertWriter({'User:MacronMonitor/Alerts': page}, offline=True)
+
+        writer.add(_alert('Kākāpō', 1))
+        writer.close()
+
+        self.assertEqual([], page.summaries)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import io
+import json
+import unittest
+
+import pywikibot
+
+from macron_monitor import SuspiciousRev
+from macron_monitor.Backfill import Backfill
+
+
+class FakeSite:
+    def __init__(self, changes):
+        self.changes = changes
+        self.calls = []
+
+    def base_url(self, path):
+        return f'https://en.wikipedia.org{path}'
+
+    def scriptpath(self):
+        return '/w'
+
+    def recentchanges(self, **kwargs):
+        self.calls.append(kwargs)
+        return iter(self.changes)
+
+
+class FakeMonitor:
+    workers = 2
+    queue_size = 4
+
+    def __init__(self, site, already_sent=()):
+        self.site = site
+        self.already_sent = set(already_sent)
+        self.updated = []
+
+    def _process_change(self, change):
+        if change['title'] == 'Taupō':
+            return [SuspiciousRev('User:MacronMonitor/Alerts', change['title'], change['user'], change['revision'],
+                                  'removed macrons')]
+        return []
+
+    def _unsent_alerts(self, change, detected_issues):
+        return [alert for alert in detected_issues if alert.revision['new'] not in self.already_sent]
+
+    def _send_alert(self, suspicious_rev, change):
+        self.updated.append(suspicious_rev)
+
+
+CHANGES = [
+    {'title': 'Taupō', 'user': 'Cloventt', 'revid': 12, 'old_revid': 11, 'timestamp': '2024-01-01T00:00:05Z'},
+    {'title': 'New page', 'user': 'Cloventt', 'revid': 13, 'old_revid': 0, 'timestamp': '2024-01-01T00:00:06Z'},
+    {'title': 'Hidden', 'userhidden': '', 'revid': 14, 'old_revid': 10, 'timestamp': '2024-01-01T00:00:07Z'},
+    {'title': 'Ōtaki', 'user': 'Cloventt', 'revid': 15, 'old_revid': 9, 'timestamp': '2024-01-01T00:00:08Z'},
+]
+
+START = pywikibot.Timestamp(2024, 1, 1)
+END = pywikibot.Timestamp(2024, 1, 2)
+
+
+class test_Backfill(unittest.TestCase):
+    def test_writes_alerts_to_output(self):
+        site = FakeSite(CHANGES)
+        monitor = FakeMonitor(site)
+        output = io.StringIO()
+        backfill = Backfill(monitor, output=output, max_rate=0)
+        backfill.run(START, END)
+
+        self.assertEqual(2, backfill.processed)
+        self.assertEqual(1, backfill.detected)
+        self.assertEqual([], monitor.updated)
+        alert = json.loads(output.getvalue())
+        self.assertEqual('Taupō', alert['title'])
+        self.assertEqual({'old': 11, 'new': 12}, alert['revision'])
+
+        self.assertTrue(site.calls[0]['reverse'])
+        self.assertEqual([0], site.calls[0]['namespaces'])
+        self.assertFalse(site.calls[0]['bot'])
+
+    def test_writes_alerts_to_pages_without_output(self):
+        monitor = FakeMonitor(FakeSite(CHANGES))
+        Backfill(monitor, max_rate=0).run(START, END)
+        self.assertEqual(['Taupō'], [alert.title for alert in monitor.updated])
+
+    def test_skips_alerts_that_were_already_sent(self):
+        monitor = FakeMonitor(FakeSite(CHANGES), already_sent=[12])
+        backfill = Backfill(monitor, max_rate=0)
+        backfill.run(START, END)
+        self.assertEqual(1, backfill.detected)
+        self.assertEqual([], monitor.updated)
+
+    def test_builds_change_events(self):
+        backfill = Backfill(FakeMonitor(FakeSite(CHANGES[:1])), max_rate=0)
+        change, = backfill._recent_changes(START, END)
+        self.assertEqual(1704067205, change['timestamp'])
+        self.assertEqual('https://en.wikipedia.org/w/index.php?diff=12&oldid=11', change['notify_url'])
+
+
+if __name__ == '__main__':
+    unittest.main()
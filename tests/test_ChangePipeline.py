@@ -0,0 +1,78 @@
+import random
+import threading
+import time
+import unittest
+
+from macron_monitor.ChangePipeline import ChangePipeline
+
+
+class test_ChangePipeline(unittest.TestCase):
+    def test_emits_in_arrival_order(self):
+        emitted = []
+
+        def process(change):
+            time.sleep(random.uniform(0, 0.01))
+            return change['id'] * 2
+
+        pipeline = ChangePipeline(process, lambda change, result: emitted.append((change['id'], result)),
+                                  workers=8, queue_size=4)
+        pipeline.run({'id': i} for i in range(50))
+
+        self.assertEqual([(i, i * 2) for i in range(50)], emitted)
+
+    def test_failed_changes_are_skipped(self):
+        emitted = []
+
+        def process(change):
+            if change['id'] == 3:
+                raise ValueError('bad change')
+            return change['id']
+
+        pipeline = ChangePipeline(process, lambda change, result: emitted.append(result), workers=2, queue_size=2)
+        pipeline.run({'id': i} for i in range(6))
+
+        self.assertEqual([0, 1, 2, 4, 5], emitted)
+
+    def test_reader_blocks_when_queue_is_full(self):
+        release = threading.Event()
+        read = []
+
+        def changes():
+            for i in range(10):
+                read.append(i)
+                yield {'id': i}
+
+        pipeline = ChangePipeline(lambda change: release.wait(), lambda change, result: None,
+                                  workers=1, queue_size=2)
+        runner = threading.Thread(target=pipeline.run, args=(changes(),))
+        runner.start()
+        time.sleep(0.2)
+        # two queued, one held by the emitter and one blocked on the full queue
+        self.assertLessEqual(len(read), 4)
+        release.set()
+        runner.join(timeout=5)
+        self.assertEqual(list(range(10)), read)
+
+    def test_stop_drains_in_flight_changes(self):
+        emitted = []
+        source_blocked = threading.Event()
+
+        def changes():
+            yield from ({'id': i} for i in range(3))
+            source_blocked.wait()
+
+        pipeline = ChangePipeline(lambda change: change['id'], lambda change, result: emitted.append(result),
+                                  workers=2, queue_size=8)
+        runner = threading.Thread(target=pipeline.run, args=(changes(),))
+        runner.start()
+        time.sleep(0.2)
+        pipeline.stop()
+        runner.join(timeout=5)
+        source_blocked.set()
+
+        self.assertFalse(runner.is_alive())
+        self.assertEqual([0, 1, 2], emitted)
+
+
+if __name__ == '__main__':
+    unittest.main()
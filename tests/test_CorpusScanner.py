@@ -0,0 +1,110 @@
+import io
+import json
+import os
+import tempfile
+import unittest
+
+from macron_monitor.AhoCorasick import AhoCorasick
+from macron_monitor.CorpusScanner import CorpusScanner, PageFindings, read_findings, scan_text, write_report
+from macron_monitor.RequestScheduler import RequestScheduler
+from macron_monitor.TitleIndex import TitleIndex
+
+TEXTS = {
+    'Kākāpō': 'The kakapo is a parrot.',
+    'Taupō': 'Lake Taupo, near [[Tūrangi|Turangi]] and [[Tūrangi|Turangi]], is the largest lake.',
+    'Ōtaki': 'Ōtaki is a town.',
+    'Tūrangi': 'The town of Turangi is near Taupo.',
+}
+
+
+class FakeResponse:
+    def __init__(self, result):
+        self.result = result
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.result
+
+
+class FakeSession:
+    def __init__(self):
+        self.queries = []
+
+    def get(self, url, params=None, **kwargs):
+        titles = params['titles'].split('|')
+        self.queries.append(titles)
+        pages = [{'title': title, 'revisions': [{'revid': 100 + i, 'slots': {'main': {'content': TEXTS[title]}}}]}
+                 for i, title in enumerate(titles) if title in TEXTS]
+        # split the answer over two responses to exercise continuation
+        if 'rvcontinue' not in params and len(pages) > 1:
+            return FakeResponse({'continue': {'rvcontinue': '1', 'continue': '||'}, 'query': {'pages': pages[:1]}})
+        if 'rvcontinue' in params:
+            pages = pages[1:]
+        return FakeResponse({'query': {'pages': pages}})
+
+
+class test_CorpusScanner(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.findings_file = os.path.join(directory.name, 'findings.jsonl')
+        self.state_file = os.path.join(directory.name, 'state.json')
+        self.session = FakeSession()
+
+    def scanner(self, titles=tuple(TEXTS) + ('Missing page',)) -> CorpusScanner:
+        return CorpusScanner(titles, self.findings_file, self.state_file, processes=1, batch_size=2,
+                             scheduler=RequestScheduler(rates={}), session=self.session)
+
+    def test_scan_text(self):
+        words, links = scan_text(TEXTS['Taupō'].replace('[[Tūrangi|Turangi]] and ', ''), TitleIndex(['Tūrangi']),
+                                 AhoCorasick({'taupo', 'turangi'}))
+        self.assertEqual(words, {'taupo': 1})
+        self.assertEqual(links, {'[[Tūrangi|Turangi]]': 1})
+
+    def test_scans_every_title_in_batches(self):
+        scanner = self.scanner()
+        scanner.run()
+
+        self.assertEqual(scanner.scanned, 4)
+        batches = [titles for i, titles in enumerate(self.session.queries) if self.session.queries[i - 1] != titles]
+        self.assertEqual(batches, [['Kākāpō', 'Missing page'], ['Taupō', 'Tūrangi'], ['Ōtaki']])
+        findings = {page.title: page for page in read_findings(self.findings_file)}
+        self.assertEqual(set(findings), {'Kākāpō', 'Taupō', 'Tūrangi'})
+        self.assertEqual(findings['Taupō'].links, {'[[Tūrangi|Turangi]]': 2})
+        self.assertEqual(findings['Tūrangi'].words, {'turangi': 1, 'taupo': 1})
+        with open(self.state_file) as state:
+            self.assertEqual(json.load(state)['after'], 'Ōtaki')
+
+    def test_resumes_after_the_last_finished_batch(self):
+        self.scanner(titles=['Kākāpō', 'Missing page']).run()
+        with open(self.findings_file, 'a', encoding='utf-8') as findings:
+            findings.write('{"title": "written after the state was saved"\n')
+
+        self.session.queries.clear()
+        scanner = self.scanner()
+        scanner.run()
+        self.assertNotIn('Kākāpō', [title for titles in self.session.queries for title in titles])
+        self.assertEqual(scanner.scanned, 3)
+        titles = [page.title for page in read_findings(self.findings_file)]
+        self.assertEqual(sorted(titles), ['Kākāpō', 'Taupō', 'Tūrangi'])
+
+    def test_report_is_ranked(self):
+        output = io.StringIO()
+        listed = write_report([
+            PageFindings('Kākāpō', 1, {'kakapo': 1}, {}),
+            PageFindings('Taupō', 2, {'taupo': 3}, {'[[Tūrangi|Turangi]]': 1}),
+            PageFindings('Ōtaki', 3, {'otaki': 2}, {}),
+        ], output, top=2)
+
+        self.assertEqual(listed, 2)
+        lines = output.getvalue().splitlines()
+        self.assertTrue(lines[0].startswith("# '''[[Taupō]]'''"))
+        self.assertIn("''taupo'' ×3", lines[0])
+        self.assertIn('<nowiki>[[Tūrangi|Turangi]]</nowiki>', lines[0])
+        self.assertTrue(lines[1].startswith("# '''[[Ōtaki]]'''"))
+
+
+if __name__ == '__main__':
+    unittest.main()
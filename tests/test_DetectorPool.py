@@ -0,0 +1,113 @@
+import os
+import time
+import unittest
+
+from prometheus_client import REGISTRY
+
+from macron_monitor import SuspiciousRev
+from macron_monitor.DetectorPool import DetectorPool
+from macron_monitor.detectors import Detector
+
+
+class TitleDetector(Detector):
+    def __init__(self, prefix):
+        self.prefix = prefix
+
+    def detect(self, change, diff, analysis=None):
+        if change['title'] == 'Slow':
+            time.sleep(30)
+        if change['title'] == 'Broken':
+            raise ValueError(change['title'])
+        if change['title'] == 'Process':
+            return SuspiciousRev('User:MacronMonitor/Alerts', change['title'], change['user'], change['revision'],
+                                 str(os.getpid()))
+        if diff['added-context']:
+            return SuspiciousRev('User:MacronMonitor/Alerts', change['title'], change['user'], change['revision'],
+                                 f"{self.prefix}: {diff['added-context'][0]}")
+        return None
+
+
+class AnalysisDetector(Detector):
+    def detect(self, change, diff, analysis=None):
+        return SuspiciousRev('User:MacronMonitor/Alerts', change['title'], change['user'], change['revision'],
+                             str(id(analysis)))
+
+
+def _create_detectors(prefix):
+    return [TitleDetector(prefix)]
+
+
+def _create_analysis_detectors():
+    return [AnalysisDetector(), AnalysisDetector()]
+
+
+def change(title, revision=1):
+    return {'title': title, 'user': 'Someone', 'revision': {'old': revision - 1, 'new': revision}}
+
+
+def _skipped(reason):
+    return REGISTRY.get_sample_value('detector_calls_skipped_total', {'reason': reason}) or 0
+
+
+class test_DetectorPool(unittest.TestCase):
+    def setUp(self):
+        self.pool = DetectorPool(_create_detectors, ('built in the worker',), processes=1, budget=2.0)
+        self.addCleanup(self.pool.close)
+        self.assertTrue(self.pool.wait_until_ready(60))
+
+    def test_detectors_run_in_the_worker(self):
+        [alert] = self.pool.detect(change('Taupō'), {'added-context': ['Taupo']})
+        self.assertEqual(alert.reason, 'built in the worker: Taupo')
+        self.assertEqual([], self.pool.detect(change('Taupō'), {'added-context': []}))
+
+    def test_detectors_share_one_analysis_per_change(self):
+        pool = DetectorPool(_create_analysis_detectors, processes=1)
+        self.addCleanup(pool.close)
+        self.assertTrue(pool.wait_until_ready(60))
+
+        first, second = pool.detect(change('Taupō'), {'added-context': []})
+        self.assertEqual(first.reason, second.reason)
+
+    def test_exceptions_are_raised_in_the_caller(self):
+        with self.assertRaises(ValueError):
+            self.pool.detect(change('Broken'), {'added-context': []})
+        self.assertEqual(1, len(self.pool.detect(change('Taupō'), {'added-context': ['Taupo']})))
+
+    def test_overrun_is_killed_and_the_worker_restarted(self):
+        overruns = REGISTRY.get_sample_value('detector_overruns_total', {'detector': 'TitleDetector'}) or 0
+        skipped = _skipped('overrun')
+        started = time.monotonic()
+        with self.assertLogs('macron_monitor', 'ERROR') as logs:
+            self.assertIsNone(self.pool.detect(change('Slow', revision=42), {'added-context': ['Taupo']}))
+        self.assertLess(time.monotonic() - started, 10)
+        self.assertEqual(REGISTRY.get_sample_value('detector_overruns_total', {'detector': 'TitleDetector'}),
+                         overruns + 1)
+        self.assertEqual(skipped + 1, _skipped('overrun'))
+        self.assertIn('revision 42', logs.output[0])
+
+        self.assertTrue(self.pool.wait_until_ready(60))
+        [alert] = self.pool.detect(change('Taupō'), {'added-context': ['Taupo']})
+        self.assertEqual(alert.title, 'Taupō')
+
+    def test_call_while_the_only_worker_restarts_is_skipped_straight_away(self):
+        skipped = _skipped('restarting')
+        with self.assertLogs('macron_monitor', 'ERROR'):
+            self.pool.detect(change('Slow'), {'added-context': []})
+            started = time.monotonic()
+            self.assertIsNone(self.pool.detect(change('Taupō'), {'added-context': ['Taupo']}))
+        self.assertLess(time.monotonic() - started, 1)
+        self.assertEqual(skipped + 1, _skipped('restarting'))
+
+    def test_prefers_a_ready_worker_to_one_that_is_starting(self):
+        pool = DetectorPool(_create_detectors, ('built in the worker',), processes=2)
+        self.addCleanup(pool.close)
+        self.assertTrue(pool.wait_until_ready(60))
+        starting, ready = pool._workers
+        starting._restart('test')
+
+        [alert] = pool.detect(change('Process'), {'added-context': []})
+        self.assertEqual(alert.reason, str(ready.process.pid))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import unittest
+
+from macron_monitor.DiffAnalysis import DiffAnalysis
+from tests.detectors import MockWPNZArticleProvider
+
+
+class test_DiffAnalysis(unittest.TestCase):
+    def setUp(self):
+        self.change = {
+            'title': 'Kākāpō',
+            'user': 'Cloventt',
+            'revision': {
+                'old': 1234567,
+                'new': 1234568,
+            },
+        }
+        self.diff = {
+            'deleted-context': ['The Kākāpō lives on [[Whenua Hou]].'],
+            'added-context': ['The Kakapo lives on [[Whenua Hou|Codfish Island]] in Aotearoa.'],
+        }
+
+    def test_lazily_computes_each_view_once(self):
+        analysis = DiffAnalysis(self.change, self.diff)
+
+        self.assertEqual(3, analysis.deleted_macrons)
+        self.assertEqual(0, analysis.added_macrons)
+        self.assertEqual([('Kākāpō', 'Kakapo')], analysis.stripped_macron_words)
+        self.assertEqual(['the kakapo lives on [[whenua hou|codfish island]] in aotearoa.'], analysis.added_lowered)
+        self.assertEqual([('Whenua Hou', 'Codfish Island')],
+                         [(link.target, link.label) for link in analysis.added_wikilinks])
+
+        self.diff['added-context'].append('Something else')
+        self.assertEqual(1, len(analysis.added_wikilinks))
+        self.assertEqual(1, len(analysis.added_lowered))
+
+    def test_wpnz_membership(self):
+        article_provider = MockWPNZArticleProvider()
+        article_provider.article_titles.update(['Kākāpō'])
+
+        self.assertTrue(DiffAnalysis(self.change, self.diff, article_provider).is_wpnz_article)
+        self.assertFalse(DiffAnalysis(dict(self.change, title='Kyūshū'), self.diff, article_provider).is_wpnz_article)
+        self.assertFalse(DiffAnalysis(self.change, self.diff).is_wpnz_article)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+import unittest
+
+from pywikibot import diff
+
+from macron_monitor.DiffProvider import line_diff, parse_revision_content, CachingDiffProvider, DiffProvider
+
+OLD_TEXT = """Kākāpō is a parrot.
+It lives in [[Aotearoa]].
+
+It is nocturnal.
+The end."""
+
+NEW_TEXT = """The Kakapo is a parrot.
+It lives in [[Aotearoa]].
+
+It is nocturnal and flightless.
+A new line about [[Whenua Hou]].
+The end."""
+
+# trimmed down version of what action=compare renders for the two texts above
+COMPARE_HTML = '''<tr>
+  <td class="diff-marker" data-marker="−"></td>
+  <td class="diff-deletedline diff-side-deleted"><div><del class="diffchange">Kākāpō</del> is a parrot.</div></td>
+  <td class="diff-marker" data-marker="+"></td>
+  <td class="diff-addedline diff-side-added"><div><ins class="diffchange">The Kakapo</ins> is a parrot.</div></td>
+</tr>
+<tr>
+  <td class="diff-marker"></td>
+  <td class="diff-context diff-side-deleted"><div>It lives in [[Aotearoa]].</div></td>
+  <td class="diff-marker"></td>
+  <td class="diff-context diff-side-added"><div>It lives in [[Aotearoa]].</div></td>
+</tr>
+<tr>
+  <td class="diff-marker" data-marker="−"></td>
+  <td class="diff-deletedline diff-side-deleted"><div>It is nocturnal.</div></td>
+  <td class="diff-marker" data-marker="+"></td>
+  <td class="diff-addedline diff-side-added"><div>It is nocturnal<ins class="diffchange"> and flightless</ins>.</div></td>
+</tr>
+<tr>
+  <td colspan="2" class="diff-empty diff-side-deleted"></td>
+  <td class="diff-marker" data-marker="+"></td>
+  <td class="diff-addedline diff-side-added"><div>A new line about [[Whenua Hou]].</div></td>
+</tr>'''
+
+
+class test_DiffProvider(unittest.TestCase):
+    def test_line_diff_matches_html_comparator(self):
+        self.assertEqual(diff.html_comparator(COMPARE_HTML), line_diff(OLD_TEXT, NEW_TEXT))
+
+    def test_line_diff_of_identical_text_is_empty(self):
+        self.assertEqual({'deleted-context': [], 'added-context': []}, line_diff(OLD_TEXT, OLD_TEXT))
+
+    def test_line_diff_of_new_page(self):
+        self.assertEqual({'deleted-context': [''], 'added-context': ['Hello', 'World']}, line_diff('', 'Hello\nWorld'))
+
+    def test_parse_revision_content_skips_hidden_revisions(self):
+        self.assertEqual({2: 'new text'}, parse_revision_content({
+            'query': {'pages': [{
+                'title': 'Test Page',
+                'revisions': [
+                    {'revid': 1, 'slots': {'main': {'texthidden': True}}},
+                    {'revid': 2, 'slots': {'main': {'content': 'new text'}}},
+                ],
+            }]},
+        }))
+
+    def test_caching_diff_provider_only_fetches_once(self):
+        class CountingDiffProvider(DiffProvider):
+            calls = 0
+
+            def get_diff(self, change):
+                self.calls += 1
+                return line_diff(OLD_TEXT, NEW_TEXT)
+
+        counting = CountingDiffProvider()
+        caching = CachingDiffProvider(counting)
+        change = {'revision': {'old': 1234567, 'new': 1234568}}
+
+        self.assertEqual(caching.get_diff(change), caching.get_diff(change))
+        self.assertEqual(1, counting.calls)
+
+
+if __name__ == '__main__':
+    unittest.main()
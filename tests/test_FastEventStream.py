@@ -0,0 +1,84 @@
+import json
+import unittest
+
+from macron_monitor.FastEventStream import FastEventStream, ChangeEvent
+
+
+def _event(**overrides):
+    event = {
+        '$schema': '/mediawiki/recentchange/1.0.0',
+        'meta': {'domain': 'en.wikipedia.org'},
+        'type': 'edit',
+        'namespace': 0,
+        'title': 'Kākāpō',
+        'comment': 'copyedit',
+        'timestamp': 1700000000,
+        'user': 'Cloventt',
+        'bot': False,
+        'notify_url': 'https://en.wikipedia.org/w/index.php?diff=1234568&oldid=1234567',
+        'server_name': 'en.wikipedia.org',
+        'revision': {'old': 1234567, 'new': 1234568},
+    }
+    event.update(overrides)
+    return json.dumps(event, separators=(',', ':'), ensure_ascii=False).encode()
+
+
+def _sse(*events):
+    lines = [b':ok', b'']
+    for i, data in enumerate(events):
+        lines += [b'event: message', f'id: [{{"offset":{i}}}]'.encode(), b'data: ' + data, b'']
+    return lines
+
+
+class test_FastEventStream(unittest.TestCase):
+    def test_keeps_matching_edits(self):
+        stream = FastEventStream()
+
+        changes = list(stream.parse(_sse(_event())))
+
+        self.assertEqual(1, len(changes))
+        self.assertIsInstance(changes[0], ChangeEvent)
+        self.assertEqual('Kākāpō', changes[0]['title'])
+        self.assertEqual('Cloventt', changes[0]['user'])
+        self.assertEqual({'old': 1234567, 'new': 1234568}, changes[0]['revision'])
+        self.assertEqual('[{"offset":0}]', changes[0].event_id)
+        self.assertEqual('[{"offset":0}]', stream.last_event_id)
+
+    def test_discards_other_events(self):
+        stream = FastEventStream()
+
+        changes = list(stream.parse(_sse(
+            _event(server_name='de.wikipedia.org'),
+            _event(bot=True),
+            _event(type='log'),
+            _event(namespace=1),
+            _event(namespace=0, comment='"bot":false "type":"edit"', server_name='fr.wikipedia.org'),
+            _event(meta={'domain': 'canary'}),
+            _event(title='Taupō'),
+        )))
+
+        self.assertEqual(['Taupō'], [change.title for change in changes])
+        self.assertEqual('[{"offset":6}]', stream.last_event_id)
+
+    def test_keeps_edits_to_every_listed_wiki(self):
+        stream = FastEventStream(server_name=['en.wikipedia.org', 'en.wiktionary.org'])
+
+        changes = list(stream.parse(_sse(
+            _event(title='Kākāpō'),
+            _event(title='kākāpō', server_name='en.wiktionary.org'),
+            _event(title='Kākāpō', server_name='de.wikipedia.org'),
+        )))
+
+        self.assertEqual([('en.wikipedia.org', 'Kākāpō'), ('en.wiktionary.org', 'kākāpō')],
+                         [(change.server_name, change.title) for change in changes])
+
+    def test_change_event_has_no_dict(self):
+        change = ChangeEvent('Taupō', 'Cloventt', {'old': 1, 'new': 2}, 1700000000, '')
+
+        self.assertFalse(hasattr(change, '__dict__'))
+        with self.assertRaises(KeyError):
+            change['comment']
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,31 @@
+import unittest
+
+from macron_monitor.LRUCache import LRUCache
+
+
+class test_LRUCache(unittest.TestCase):
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(1, cache.get('a'))
+        cache.put('c', 3)
+
+        self.assertIn('a', cache)
+        self.assertNotIn('b', cache)
+        self.assertIn('c', cache)
+        self.assertEqual(2, len(cache))
+
+    def test_put_if_absent(self):
+        cache = LRUCache(2)
+        self.assertTrue(cache.put_if_absent(1234568, True))
+        self.assertFalse(cache.put_if_absent(1234568, True))
+        cache.put_if_absent(1234569, True)
+        cache.put_if_absent(1234570, True)
+
+        self.assertNotIn(1234568, cache)
+        self.assertTrue(cache.put_if_absent(1234568, True))
+
+
+if __name__ == '__main__':
+    unittest.main()
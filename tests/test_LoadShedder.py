@@ -0,0 +1,113 @@
+import os
+import tempfile
+import unittest
+
+from macron_monitor.FastEventStream import ChangeEvent
+from macron_monitor.LoadShedder import LoadShedder, ShedLevel, SpillFile, is_anonymous, size_change
+from macron_monitor.TitleIndex import TitleIndex
+
+
+class FakeArticleProvider:
+    def __init__(self, titles):
+        self.article_titles = TitleIndex(titles)
+
+
+def change(revision, title='Some page', user='Someone', old_length=1000, new_length=1500):
+    return ChangeEvent(title, user, {'old': revision - 1, 'new': revision}, 1600000000 + revision,
+                       'https://en.wikipedia.org/w/index.php?diff=%d' % revision,
+                       length={'old': old_length, 'new': new_length})
+
+
+class test_LoadShedder(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.spill_file = os.path.join(directory.name, 'spill.jsonl')
+        self.lag = 0.0
+
+    def shedder(self, **kwargs) -> LoadShedder:
+        shedder = LoadShedder(self.spill_file, lambda: self.lag, FakeArticleProvider(['Taupō']), defer_lag=100,
+                              sample_lag=1000, **kwargs)
+        self.addCleanup(shedder.close)
+        return shedder
+
+    def test_is_anonymous(self):
+        self.assertTrue(is_anonymous('192.0.2.1'))
+        self.assertTrue(is_anonymous('2001:db8::1'))
+        self.assertTrue(is_anonymous('~2025-12345-67'))
+        self.assertFalse(is_anonymous('Someone'))
+        self.assertFalse(is_anonymous('1984'))
+
+    def test_size_change(self):
+        self.assertEqual(size_change(change(1, old_length=1000, new_length=997)), -3)
+        self.assertIsNone(size_change(change(1, old_length=None)))
+        self.assertIsNone(size_change({'title': 'Page'}))
+
+    def test_likely_edits(self):
+        shedder = self.shedder()
+        self.assertTrue(shedder.is_likely(change(1, title='Taupō')))
+        self.assertTrue(shedder.is_likely(change(2, user='192.0.2.1')))
+        self.assertTrue(shedder.is_likely(change(3, new_length=996)))
+        self.assertFalse(shedder.is_likely(change(4, new_length=500)))
+        self.assertFalse(shedder.is_likely(change(5)))
+
+    def test_processes_everything_below_the_threshold(self):
+        changes = [change(revision) for revision in range(1, 4)]
+        self.assertEqual(list(self.shedder().filter(changes)), changes)
+
+    def test_defers_unlikely_edits_and_catches_up_once_the_lag_falls(self):
+        shedder = self.shedder(catch_up_batch=2)
+        self.lag = 200
+        likely = change(1, title='Taupō')
+        processed = list(shedder.filter([likely, change(2), change(3), change(4)]))
+        self.assertEqual(processed, [likely])
+        self.assertEqual(shedder.level, ShedLevel.DEFER)
+        self.assertEqual(shedder.spill.pending, 3)
+
+        self.lag = 10
+        processed = list(shedder.filter([change(5)]))
+        self.assertEqual([c['revision']['new'] for c in processed], [5, 2, 3])
+        self.assertTrue(all(shedder.caught_up(c) for c in processed[1:]))
+        self.assertFalse(shedder.caught_up(processed[0]))
+
+        processed = list(shedder.filter([change(6)]))
+        self.assertEqual([c['revision']['new'] for c in processed], [6, 4])
+        self.assertEqual(shedder.spill.pending, 0)
+        self.assertEqual(os.path.getsize(self.spill_file), 0)
+
+    def test_does_not_catch_up_just_under_the_threshold(self):
+        shedder = self.shedder()
+        self.lag = 200
+        list(shedder.filter([change(1)]))
+        self.lag = 90
+        self.assertEqual(len(list(shedder.filter([change(2)]))), 1)
+        self.assertEqual(shedder.spill.pending, 1)
+
+    def test_samples_unlikely_edits_when_far_behind(self):
+        self.lag = 5000
+        shedder = self.shedder(sample_rate=0)
+        self.assertEqual(list(shedder.filter([change(1), change(2)])), [])
+        self.assertEqual(shedder.level, ShedLevel.SAMPLE)
+        self.assertEqual(shedder.spill.pending, 0)
+
+        shedder.sample_rate = 1
+        list(shedder.filter([change(3)]))
+        self.assertEqual(shedder.spill.pending, 1)
+
+    def test_spilled_edits_survive_a_restart(self):
+        spill = SpillFile(self.spill_file)
+        spill.append(change(1))
+        spill.append(change(2))
+        spill.close()
+
+        spill = SpillFile(self.spill_file)
+        self.addCleanup(spill.close)
+        self.assertEqual(spill.pending, 2)
+        restored = spill.read(5)
+        self.assertEqual([c['revision']['new'] for c in restored], [1, 2])
+        self.assertEqual(restored[0]['length'], {'old': 1000, 'new': 1500})
+        self.assertEqual(restored[0]['title'], 'Some page')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+
+from macron_monitor.MacronAlignment import changed_span, stripped_macron_words
+
+
+class test_MacronAlignment(unittest.TestCase):
+    def test_changed_span_keeps_whole_words(self):
+        self.assertEqual(('Māori', 'Maori'), changed_span('The Māori language', 'The Maori language'))
+        self.assertEqual(('', ' today'), changed_span('Kākāpō', 'Kākāpō today'))
+        self.assertEqual(('', ''), changed_span('Taupō', 'Taupō'))
+
+    def test_reports_each_stripped_word(self):
+        self.assertEqual([('Māori', 'Maori'), ('Taupō', 'Taupo')], stripped_macron_words(
+            ['The Māori name of Lake Taupō is Taupō-nui-a-Tia.'],
+            ['The Maori name of Lake Taupo is Taupō-nui-a-Tia.'],
+        ))
+
+    def test_added_macrons_do_not_cancel_removed_ones(self):
+        self.assertEqual([('Māori', 'Maori')], stripped_macron_words(
+            ['Spoken by Māori in Aotearoa.'],
+            ['Spoken by Maori in Ōtautahi and Aotearoa.'],
+        ))
+
+    def test_moved_and_deleted_words_are_not_stripped(self):
+        self.assertEqual([], stripped_macron_words(['Kākāpō and tūī.'], ['Tūī and Kākāpō.']))
+        self.assertEqual([], stripped_macron_words(['Kākāpō are rare.'], ['They are rare.']))
+        self.assertEqual([], stripped_macron_words(['Kākāpō'], ['Kākāpō', 'Kākāpō']))
+
+    def test_counts_repeated_words(self):
+        self.assertEqual([('Māori', 'Maori')] * 2, stripped_macron_words(
+            ['Māori and Māori', 'Māori'],
+            ['Maori and Maori', 'Māori'],
+        ))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,80 @@
+import os
+import tempfile
+import threading
+import time
 import unittest
 
+import requests
+
 from macron_monitor import count_macrons
+from macron_monitor.MacronMonitor import MacronMonitor
+from macron_monitor.SiteConfig import SiteConfig
+from macron_monitor.detectors import Detector
+
+
+class SlowLoginSite:
+    def __init__(self):
+        self.allow_login = threading.Event()
+
+    def login(self):
+        self.allow_login.wait(5)
+
+
+class BufferingMonitor(MacronMonitor):
+    def __init__(self, site, changes):
+        self.fake_site = site
+        self.changes = changes
+        self.read = []
+        self.processed = []
+        super().__init__(offline=True, site_config=SiteConfig(detectors=()))
+
+    def _create_site(self):
+        return self.fake_site
+
+    def _create_stream(self, stream_backend):
+        for change in self.changes:
+            self.read.append(change['revision']['new'])
+            yield change
+
+    def _process_change(self, change):
+        return []
+
+    def _emit_alerts(self, change, detected_issues):
+        super()._emit_alerts(change, detected_issues)
+        self.processed.append(change['revision']['new'])
+
+
+class NullSite:
+    def login(self):
+        pass
+
+
+class UnreachableDiffProvider:
+    def get_diff(self, change):
+        raise requests.ConnectionError('the API is unreachable')
+
+
+class RecordedDiffProvider:
+    def get_diff(self, change):
+        return {'deleted-context': ['Kākāpō'], 'added-context': ['Kakapo']}
+
+
+class RestartingDetectorPool:
+    def detect(self, change, diff):
+        return None
+
+
+class NullDetector(Detector):
+    def detect(self, change, diff, analysis=None):
+        return None
+
+
+class OfflineMonitor(MacronMonitor):
+    def __init__(self, **kwargs):
+        super().__init__(offline=True, site_config=SiteConfig(detectors=()), **kwargs)
+
+    def _create_site(self):
+        return NullSite()
 
 
 class test_MacronMonitor(unittest.TestCase):
@@ -14,6 +88,56 @@ class test_MacronMonitor(unittest.TestCase):
         self.assertEqual(count_macrons("david"), 0)
         self.assertEqual(count_macrons("david", "david", "david", "david"), 0)
 
+    def test_stream_is_read_while_logging_in(self):
+        site = SlowLoginSite()
+        changes = [{'title': 'Kākāpō', 'revision': {'old': i, 'new': i + 1}, 'timestamp': time.time()}
+                   for i in range(3)]
+        monitor = BufferingMonitor(site, changes)
+        runner = threading.Thread(target=monitor.run)
+        runner.start()
+
+        deadline = time.monotonic() + 5
+        while len(monitor.read) < 3 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        self.assertEqual([1, 2, 3], monitor.read)
+        self.assertEqual([], monitor.processed)
+
+        site.allow_login.set()
+        runner.join(5)
+        self.assertEqual([1, 2, 3], monitor.processed)
+
+    def test_retries_changes_whose_diff_could_not_be_fetched(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        monitor = OfflineMonitor(spill_file=os.path.join(directory.name, 'spill.jsonl'))
+        self.addCleanup(monitor.alert_writer.close)
+        self.addCleanup(monitor.load_shedder.close)
+        monitor.diff_provider = UnreachableDiffProvider()
+        monitor.detectors = [NullDetector()]
+
+        failed = {'title': 'Kākāpō', 'user': 'Cloventt', 'revision': {'old': 1, 'new': 2}, 'timestamp': time.time(),
+                  'notify_url': 'https://en.wikipedia.org/w/index.php?diff=2'}
+        monitor._handle_change(failed)
+        self.assertEqual(1, monitor.load_shedder.spill.pending)
+
+        live = {'title': 'Taupō', 'user': 'Cloventt', 'revision': {'old': 3, 'new': 4}, 'timestamp': time.time()}
+        retried = list(monitor.load_shedder.filter([live]))[1]
+        self.assertEqual(2, retried['revision']['new'])
+        self.assertTrue(monitor.load_shedder.is_catch_up(retried))
+
+    def test_retries_changes_the_detector_processes_did_not_finish(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        monitor = OfflineMonitor(spill_file=os.path.join(directory.name, 'spill.jsonl'))
+        self.addCleanup(monitor.alert_writer.close)
+        self.addCleanup(monitor.load_shedder.close)
+        monitor.diff_provider = RecordedDiffProvider()
+        monitor.detector_pool = RestartingDetectorPool()
+
+        monitor._handle_change({'title': 'Kākāpō', 'user': 'Cloventt', 'revision': {'old': 1, 'new': 2},
+                                'timestamp': time.time(), 'notify_url': 'https://en.wikipedia.org/w/index.php?diff=2'})
+        self.assertEqual(1, monitor.load_shedder.spill.pending)
+
 
 if __name__ == '__main__':
     unittest.main()
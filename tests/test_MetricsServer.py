@@ -0,0 +1,91 @@
+import json
+import os
+import tempfile
+import threading
+import time
+import unittest
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+from macron_monitor import SuspiciousRev
+from macron_monitor.AlertJournal import AlertJournal
+from macron_monitor.MetricsServer import start_metrics_server
+
+
+def busy_loop(stop):
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class test_MetricsServer(unittest.TestCase):
+    def start(self, **kwargs):
+        server = start_metrics_server(0, addr='127.0.0.1', **kwargs)
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        return f'http://127.0.0.1:{server.server_address[1]}'
+
+    def test_serves_metrics(self):
+        url = self.start()
+        with urlopen(f'{url}/metrics') as response:
+            self.assertIn(b'python_info', response.read())
+
+    def test_profiler_is_off_by_default(self):
+        url = self.start()
+        with self.assertRaises(HTTPError) as raised:
+            urlopen(f'{url}/debug/profile?seconds=0.1')
+        self.assertEqual(404, raised.exception.code)
+
+    def test_profiles_running_threads(self):
+        url = self.start(enable_profiler=True)
+        stop = threading.Event()
+        worker = threading.Thread(target=busy_loop, args=(stop,), name='busy')
+        worker.start()
+        try:
+            with urlopen(f'{url}/debug/profile?seconds=0.2') as response:
+                profile = response.read().decode()
+        finally:
+            stop.set()
+            worker.join()
+
+        busy_stacks = [line for line in profile.splitlines() if line.startswith('busy;')]
+        self.assertTrue(busy_stacks)
+        self.assertTrue(all('busy_loop' in line for line in busy_stacks))
+        self.assertTrue(all(int(line.rsplit(' ', 1)[1]) > 0 for line in busy_stacks))
+
+    def test_rejects_bad_duration(self):
+        url = self.start(enable_profiler=True)
+        with self.assertRaises(HTTPError) as raised:
+            urlopen(f'{url}/debug/profile?seconds=soon')
+        self.assertEqual(400, raised.exception.code)
+
+    def test_serves_alerts_from_the_journal(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        journal = AlertJournal(os.path.join(directory.name, 'alerts.sqlite3'))
+        self.addCleanup(journal.close)
+        journal.record(SuspiciousRev('User:MacronMonitor/Alerts', 'Lake Taupō', 'Vandal', {'old': 1, 'new': 2},
+                                     'removed macrons'), 'en.wikipedia.org')
+        journal.flush()
+        url = self.start(alert_journal=journal)
+
+        with urlopen(f'{url}/alerts?title=Lake_Taup%C5%8D') as response:
+            self.assertEqual('application/json', response.headers['Content-Type'])
+            alerts = json.loads(response.read())
+        self.assertEqual([(alert['user'], alert['revid']) for alert in alerts], [('Vandal', 2)])
+        with urlopen(f'{url}/alerts/top-users?limit=5') as response:
+            self.assertEqual(json.loads(response.read())[0]['user'], 'Vandal')
+        with self.assertRaises(HTTPError) as raised:
+            urlopen(f'{url}/alerts?limit=lots')
+        self.assertEqual(400, raised.exception.code)
+        with self.assertRaises(HTTPError) as raised:
+            urlopen(f'{url}/alerts?limit=-1')
+        self.assertEqual(400, raised.exception.code)
+
+    def test_alerts_are_off_without_a_journal(self):
+        url = self.start()
+        with self.assertRaises(HTTPError) as raised:
+            urlopen(f'{url}/alerts?user=Vandal')
+        self.assertEqual(404, raised.exception.code)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,32 @@
+import unittest
+
+from macron_monitor.MonitorCoordinator import _WorkerMonitor, _worker_kwargs
+from macron_monitor.SiteConfig import SiteConfig
+
+
+class NullSite:
+    def login(self):
+        pass
+
+
+class OfflineWorkerMonitor(_WorkerMonitor):
+    def _create_site(self):
+        return NullSite()
+
+
+class test_MonitorCoordinator(unittest.TestCase):
+    def test_workers_share_the_api_rate(self):
+        kwargs = _worker_kwargs(4, {'api_rate': 40.0, 'api_max_concurrency': 16, 'wpnz_snapshot_file': 'x.json'})
+        self.assertEqual(10.0, kwargs['api_rate'])
+        self.assertEqual(4, kwargs['api_max_concurrency'])
+        self.assertEqual('x.json', kwargs['wpnz_snapshot_file'])
+        self.assertEqual(1, _worker_kwargs(32, {})['api_max_concurrency'])
+
+        monitor = OfflineWorkerMonitor(None, offline=True, site_config=SiteConfig(detectors=()),
+                                       **dict(kwargs, wpnz_snapshot_file=None))
+        self.assertEqual(10.0, monitor.scheduler._buckets['api'].rate)
+        self.assertEqual(4, monitor.scheduler.max_concurrency)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,124 @@
+import threading
+import time
+import unittest
+
+import pywikibot
+import requests
+
+from macron_monitor.RequestScheduler import Priority, RateLimitedError, RequestScheduler, TokenBucket
+
+
+def _http_error(status, headers=None):
+    response = requests.Response()
+    response.status_code = status
+    response.headers.update(headers or {})
+    return requests.HTTPError(response=response)
+
+
+class test_RequestScheduler(unittest.TestCase):
+    def test_retries_transient_failures_with_backoff(self):
+        scheduler = RequestScheduler(rates={}, backoff=0.01)
+        failures = [requests.ConnectionError(), _http_error(503, {'Retry-After': '0'}),
+                    pywikibot.exceptions.APIError('maxlag', 'lagged')]
+
+        def flaky():
+            if failures:
+                raise failures.pop(0)
+            return 'ok'
+
+        self.assertEqual('ok', scheduler.call(flaky))
+        self.assertEqual([], failures)
+
+    def test_other_errors_and_exhausted_retries_are_raised(self):
+        scheduler = RequestScheduler(rates={}, backoff=0.01, max_retries=2)
+        calls = []
+
+        def not_found():
+            calls.append(1)
+            raise _http_error(404)
+
+        with self.assertRaises(requests.HTTPError):
+            scheduler.call(not_found)
+        self.assertEqual(1, len(calls))
+
+        def always_lagged():
+            calls.append(1)
+            raise RateLimitedError(0.01)
+
+        with self.assertRaises(RateLimitedError):
+            scheduler.call(always_lagged)
+        self.assertEqual(4, len(calls))
+
+    def test_gives_up_rather_than_retry_past_the_deadline(self):
+        scheduler = RequestScheduler(rates={}, backoff=10, retry_deadline=1)
+        calls = []
+
+        def always_down():
+            calls.append(1)
+            raise requests.ConnectionError()
+
+        started = time.monotonic()
+        with self.assertRaises(requests.ConnectionError):
+            scheduler.call(always_down)
+        self.assertEqual(1, len(calls))
+        self.assertLess(time.monotonic() - started, 1)
+
+        # retries that fit inside the deadline still happen
+        failures = [requests.ConnectionError()]
+
+        def flaky():
+            if failures:
+                raise failures.pop(0)
+            return 'ok'
+
+        self.assertEqual('ok', RequestScheduler(rates={}, backoff=0.01).call(flaky, retry_deadline=5))
+
+    def test_concurrency_halves_on_errors_and_grows_back(self):
+        scheduler = RequestScheduler(rates={}, max_concurrency=8, backoff=0, max_retries=1)
+
+        def server_error():
+            raise _http_error(500)
+
+        with self.assertRaises(requests.HTTPError):
+            scheduler.call(server_error)
+        self.assertEqual(4, scheduler.limit)
+
+        for _ in range(100):
+            scheduler.call(lambda: None)
+        self.assertEqual(8, scheduler.limit)
+
+    def test_higher_priority_goes_first(self):
+        scheduler = RequestScheduler(rates={}, max_concurrency=1, min_concurrency=1)
+        release = threading.Event()
+        order = []
+        blocker = threading.Thread(target=scheduler.call, args=(release.wait,))
+        blocker.start()
+        while scheduler._in_flight < 1:
+            time.sleep(0.001)
+
+        waiters = []
+        for priority in [Priority.BACKGROUND, Priority.NORMAL, Priority.HIGH]:
+            waiter = threading.Thread(target=scheduler.call, args=(order.append, priority.name),
+                                      kwargs={'priority': priority})
+            waiter.start()
+            waiters.append(waiter)
+        while len(scheduler._waiting) < 3:
+            time.sleep(0.001)
+        release.set()
+        for thread in [blocker] + waiters:
+            thread.join(5)
+
+        self.assertEqual(['HIGH', 'NORMAL', 'BACKGROUND'], order)
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate=10, burst=2)
+        now = bucket.updated
+        self.assertEqual(0, bucket.wait_time(now))
+        bucket.take()
+        bucket.take()
+        self.assertAlmostEqual(0.1, bucket.wait_time(now))
+        self.assertEqual(0, bucket.wait_time(now + 0.11))
+
+
+if __name__ == '__main__':
+    unittest.main()
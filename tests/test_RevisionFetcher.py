@@ -0,0 +1,91 @@
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import pywikibot
+
+from macron_monitor.RequestScheduler import RequestScheduler
+from macron_monitor.RevisionFetcher import BatchingRevisionFetcher
+
+
+class FakeResponse:
+    def __init__(self, data):
+        self.data = data
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.data
+
+
+class FakeSession:
+    def __init__(self, error=None):
+        self.requests = []
+        self.error = error
+        self._lock = threading.Lock()
+
+    def get(self, url, params, timeout):
+        with self._lock:
+            self.requests.append(dict(params))
+        if self.error:
+            return FakeResponse({'error': self.error})
+        revids = [int(revid) for revid in params['revids'].split('|')]
+        return FakeResponse({'query': {
+            'badrevids': {'404': {'revid': 404}},
+            'pages': [{
+                'title': 'Test Page',
+                'revisions': [{'revid': revid, 'slots': {'main': {'content': f'text of {revid}'}}}
+                              for revid in revids if revid != 404],
+            }],
+        }})
+
+
+class test_RevisionFetcher(unittest.TestCase):
+    def test_coalesces_concurrent_fetches(self):
+        session = FakeSession()
+        fetcher = BatchingRevisionFetcher('https://example.org/w/api.php', window=0.2, session=session)
+
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            results = list(pool.map(lambda i: fetcher.fetch([i * 2, i * 2 + 1]), range(10)))
+
+        for i, result in enumerate(results):
+            self.assertEqual({i * 2: f'text of {i * 2}', i * 2 + 1: f'text of {i * 2 + 1}'}, result)
+        self.assertEqual(1, len(session.requests))
+
+    def test_takes_one_scheduler_token_per_request(self):
+        session = FakeSession()
+        scheduler = RequestScheduler(rates={'api': (0.001, 100)})
+        fetcher = BatchingRevisionFetcher('https://example.org/w/api.php', window=0.2, session=session,
+                                          scheduler=scheduler)
+
+        with ThreadPoolExecutor(max_workers=10) as pool:
+            list(pool.map(lambda i: fetcher.fetch([i * 2, i * 2 + 1]), range(10)))
+
+        self.assertEqual(1, len(session.requests))
+        self.assertAlmostEqual(99, scheduler._buckets['api'].tokens, places=1)
+
+    def test_splits_batches_at_max_batch(self):
+        session = FakeSession()
+        fetcher = BatchingRevisionFetcher('https://example.org/w/api.php', window=0.2, max_batch=4, session=session)
+
+        result = fetcher.fetch(range(10))
+
+        self.assertEqual(10, len(result))
+        self.assertEqual(3, len(session.requests))
+
+    def test_missing_revisions_are_left_out(self):
+        fetcher = BatchingRevisionFetcher('https://example.org/w/api.php', session=FakeSession())
+
+        self.assertEqual({1: 'text of 1'}, fetcher.fetch([1, 404]))
+
+    def test_api_errors_reach_every_waiter(self):
+        fetcher = BatchingRevisionFetcher('https://example.org/w/api.php',
+                                          session=FakeSession(error={'code': 'maxlag', 'info': 'lagged'}))
+
+        with self.assertRaises(pywikibot.exceptions.APIError):
+            fetcher.fetch([1, 2])
+
+
+if __name__ == '__main__':
+    unittest.main()
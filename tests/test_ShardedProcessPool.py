@@ -0,0 +1,81 @@
+import os
+import unittest
+
+from macron_monitor.ShardedProcessPool import ShardedProcessPool, WorkerDiedError, shard_for
+
+_prefix = None
+
+
+def _set_prefix(prefix):
+    global _prefix
+    _prefix = prefix
+
+
+def _tag(change):
+    return _prefix, os.getpid(), change['title']
+
+
+def _fail(change):
+    raise ValueError(change['title'])
+
+
+def _die_once(change, marker):
+    if not os.path.exists(marker):
+        open(marker, 'w').close()
+        os._exit(1)
+    return change['title']
+
+
+def _die(change):
+    os._exit(1)
+
+
+def _title(change, *args):
+    return change['title']
+
+
+class test_ShardedProcessPool(unittest.TestCase):
+    def test_shard_for_is_stable(self):
+        self.assertEqual(shard_for('en.wikipedia.org|Kākāpō', 8), shard_for('en.wikipedia.org|Kākāpō', 8))
+        self.assertTrue(all(0 <= shard_for(str(i), 3) < 3 for i in range(100)))
+
+    def test_same_key_goes_to_same_process(self):
+        pool = ShardedProcessPool(2, key=_title, initializer=_set_prefix, initargs=('worker',), threads=2)
+        try:
+            futures = [pool.submit(_tag, {'title': title}) for title in ['Taupō', 'Kākāpō', 'Whanganui'] * 5]
+            results = [future.result(timeout=30) for future in futures]
+        finally:
+            pool.shutdown()
+
+        self.assertTrue(all(prefix == 'worker' for prefix, _, _ in results))
+        pids = {}
+        for _, pid, title in results:
+            pids.setdefault(title, set()).add(pid)
+        self.assertTrue(all(len(title_pids) == 1 for title_pids in pids.values()))
+
+    def test_exceptions_are_returned(self):
+        pool = ShardedProcessPool(1, key=_title)
+        try:
+            future = pool.submit(_fail, {'title': 'Taupō'})
+            with self.assertRaises(ValueError):
+                future.result(timeout=30)
+        finally:
+            pool.shutdown()
+
+    def test_dead_worker_is_restarted_and_its_calls_resent(self):
+        marker = os.path.join(os.path.dirname(__file__), f'.die_once_{os.getpid()}')
+        self.addCleanup(lambda: os.path.exists(marker) and os.unlink(marker))
+        pool = ShardedProcessPool(1, key=_title)
+        try:
+            self.assertEqual('Taupō', pool.submit(_die_once, {'title': 'Taupō'}, marker).result(timeout=30))
+        finally:
+            pool.shutdown()
+
+    def test_gives_up_on_a_call_that_keeps_killing_its_worker(self):
+        pool = ShardedProcessPool(1, key=_title, max_resends=1)
+        try:
+            with self.assertRaises(WorkerDiedError):
+                pool.submit(_die, {'title': 'Taupō'}).result(timeout=60)
+            self.assertEqual('Ōtaki', pool.submit(_title, {'title': 'Ōtaki'}).result(timeout=30))
+        finally:
+            pool.shutdown()
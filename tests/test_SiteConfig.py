@@ -0,0 +1,35 @@
+import json
+import os
+import tempfile
+import unittest
+
+from macron_monitor.SiteConfig import DEFAULT_DETECTORS, SiteConfig, load_site_configs
+
+
+class test_SiteConfig(unittest.TestCase):
+    def _write(self, config) -> str:
+        fd, path = tempfile.mkstemp(suffix='.json')
+        with os.fdopen(fd, 'w') as config_file:
+            json.dump(config, config_file)
+        self.addCleanup(os.unlink, path)
+        return path
+
+    def test_loads_sites(self):
+        path = self._write({'sites': [
+            {},
+            {'code': 'en', 'family': 'wiktionary', 'alert_page': 'User:MacronMonitor/Wiktionary',
+             'detectors': ['MaoriWordDetector']},
+        ]})
+
+        self.assertEqual([
+            SiteConfig(),
+            SiteConfig(code='en', family='wiktionary', server_name='en.wiktionary.org',
+                       alert_page='User:MacronMonitor/Wiktionary', detectors=('MaoriWordDetector',)),
+        ], load_site_configs(path))
+        self.assertEqual(DEFAULT_DETECTORS, SiteConfig().detectors)
+
+    def test_rejects_empty_and_duplicate_sites(self):
+        with self.assertRaises(ValueError):
+            load_site_configs(self._write({'sites': []}))
+        with self.assertRaises(ValueError):
+            load_site_configs(self._write({'sites': [{'code': 'en'}, {'server_name': 'en.wikipedia.org'}]}))
@@ -0,0 +1,29 @@
+import threading
+import unittest
+
+from macron_monitor.StartupTimer import StartupTimer
+
+
+class test_StartupTimer(unittest.TestCase):
+    def test_records_each_phase_once(self):
+        timer = StartupTimer()
+        with timer.phase('login'):
+            pass
+        timer.end('login')
+        timer.start('stream_first_event')
+
+        ready = threading.Event()
+        timer.end_when_set('wpnz_titles', ready)
+        ready.set()
+        for _ in range(100):
+            if 'wpnz_titles' in timer.report():
+                break
+            threading.Event().wait(0.01)
+
+        report = timer.report().splitlines()
+        self.assertEqual(['login', 'wpnz_titles'], sorted(line.split()[0] for line in report[1:-1]))
+        self.assertEqual('not finished: stream_first_event', report[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
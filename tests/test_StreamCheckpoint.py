@@ -0,0 +1,57 @@
+import os
+import tempfile
+import unittest
+
+from macron_monitor.FastEventStream import ChangeEvent
+from macron_monitor.StreamCheckpoint import StreamCheckpoint
+
+
+class test_StreamCheckpoint(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'checkpoint.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_round_trip(self):
+        checkpoint = StreamCheckpoint(self.path, flush_interval=3600)
+        self.assertIsNone(checkpoint.load())
+
+        checkpoint.record({'timestamp': 1700000000})
+        checkpoint.record(ChangeEvent('Taupō', 'Cloventt', {'old': 1, 'new': 2}, 1700000001, '', '[{"offset":2}]'))
+        self.assertFalse(os.path.exists(self.path))
+        checkpoint.close()
+
+        self.assertEqual({'event_id': '[{"offset":2}]', 'timestamp': 1700000001}, StreamCheckpoint(self.path).load())
+        self.assertEqual(['checkpoint.json'], os.listdir(self.directory.name))
+
+    def test_stops_before_the_oldest_held_change(self):
+        checkpoint = StreamCheckpoint(self.path, flush_interval=3600)
+        checkpoint.record({'timestamp': 1700000001})
+        first = checkpoint.record({'timestamp': 1700000002}, holds=2)
+        second = checkpoint.record({'timestamp': 1700000003}, holds=1)
+        checkpoint.record({'timestamp': 1700000004})
+        checkpoint.record({'timestamp': 1700000005})
+
+        checkpoint.flush()
+        self.assertEqual(1700000001, StreamCheckpoint(self.path).load()['timestamp'])
+
+        checkpoint.release(second)
+        checkpoint.release(first)
+        checkpoint.flush()
+        self.assertEqual(1700000001, StreamCheckpoint(self.path).load()['timestamp'])
+
+        checkpoint.release(first)
+        checkpoint.close()
+        self.assertEqual(1700000005, StreamCheckpoint(self.path).load()['timestamp'])
+
+    def test_ignores_corrupt_checkpoint(self):
+        with open(self.path, 'w') as checkpoint_file:
+            checkpoint_file.write('{"event_id": ')
+
+        self.assertIsNone(StreamCheckpoint(self.path).load())
+
+
+if __name__ == '__main__':
+    unittest.main()
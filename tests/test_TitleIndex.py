@@ -0,0 +1,46 @@
+import unicodedata
+import unittest
+
+from macron_monitor.TitleIndex import TitleIndex, canonicalize_title
+
+
+class test_TitleIndex(unittest.TestCase):
+    def test_canonicalize_title(self):
+        self.assertEqual('Lake Taupō', canonicalize_title('Lake_Taupō'))
+        self.assertEqual('Lake Taupō', canonicalize_title('  lake   _Taupō '))
+        self.assertEqual('Lake Taupō', canonicalize_title('Lake Taupō#Geology'))
+        self.assertEqual('Lake Taupō', canonicalize_title(':Lake Taupō'))
+        self.assertEqual('Ōtaki', canonicalize_title('ōtaki'))
+        self.assertEqual('Ōtaki', canonicalize_title(unicodedata.normalize('NFD', 'ōtaki')))
+        self.assertEqual('ßeta', canonicalize_title('ßeta'))
+        self.assertEqual('', canonicalize_title('#Section'))
+
+    def test_membership(self):
+        titles = ['Kākāpō', 'Lake Taupō', 'Ōtaki'] + [f'Article {i}' for i in range(1000)]
+        index = TitleIndex(titles)
+
+        self.assertEqual(len(titles), len(index))
+        for title in titles:
+            self.assertIn(title, index)
+        self.assertIn('kākāpō', index)
+        self.assertIn('Lake_Taupō#History', index)
+        self.assertNotIn('Kakapo', index)
+        self.assertNotIn('Article 1000', index)
+        self.assertNotIn(None, index)
+
+    def test_empty(self):
+        index = TitleIndex([])
+        self.assertEqual(0, len(index))
+        self.assertNotIn('Kākāpō', index)
+
+    def test_duplicates_after_canonicalizing_are_merged(self):
+        self.assertEqual(1, len(TitleIndex(['Lake Taupō', 'lake_Taupō', 'Lake Taupō#Geology'])))
+
+    def test_smaller_than_a_set(self):
+        titles = [f'Article about a place in New Zealand number {i}' for i in range(10000)]
+        index = TitleIndex(titles)
+        self.assertLess(index.nbytes, 12 * len(titles))
+
+
+if __name__ == '__main__':
+    unittest.main()
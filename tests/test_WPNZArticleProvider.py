@@ -0,0 +1,143 @@
+import json
+import os
+import tempfile
+import unittest
+
+from macron_monitor.RequestScheduler import RequestScheduler
+from macron_monitor.WPNZArticleProvider import WPNZArticleProvider
+
+
+class FakeResponse:
+    def __init__(self, result):
+        self.result = result
+
+    def raise_for_status(self):
+        pass
+
+    def json(self):
+        return self.result
+
+
+class FakeSession:
+    def __init__(self, *results, redirects=None):
+        self.results = list(results)
+        self.redirects = redirects or {}
+        self.urls = []
+        self.redirect_queries = []
+
+    def get(self, url, params=None, **kwargs):
+        if params is not None:
+            self.redirect_queries.append(params['titles'])
+            return FakeResponse(self._redirect_result(params))
+        self.urls.append(url)
+        titles = self.results.pop(0)
+        return FakeResponse({'*': [{'a': {'*': [{'title': title} for title in titles]}}]})
+
+    def _redirect_result(self, params):
+        pages = []
+        for title in params['titles'].split('|'):
+            page = {'title': title}
+            if title in self.redirects:
+                page['redirects'] = [{'ns': 0, 'title': redirect} for redirect in self.redirects[title]]
+            pages.append(page)
+        # split the answer over two responses to exercise continuation
+        if 'rdcontinue' not in params and len(pages) > 1:
+            return {'continue': {'rdcontinue': '1', 'continue': '||'}, 'query': {'pages': pages[:1]}}
+        if 'rdcontinue' in params:
+            pages = pages[1:]
+        return {'query': {'pages': pages}}
+
+
+class test_WPNZArticleProvider(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'wpnz-articles.json')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def provider(self, session):
+        provider = WPNZArticleProvider(snapshot_file=self.path, refresh_interval=3600, session=session,
+                                       scheduler=RequestScheduler(rates={}))
+        self.addCleanup(provider.close)
+        return provider
+
+    def test_first_start_fetches_everything_in_background(self):
+        session = FakeSession(['Kākāpō', 'Lake_Taupō'], redirects={'Lake Taupō': ['Taupo Lake', 'Lake Taupo']})
+        provider = self.provider(session)
+        self.assertTrue(provider.wait_until_ready(5))
+        self.assertEqual(['Kākāpō', 'Lake Taupō'], provider.titles())
+        self.assertEqual(['Lake Taupo', 'Taupo Lake'], provider.redirects())
+        self.assertEqual(['Kākāpō|Lake Taupō'], session.redirect_queries[:1])
+        for title in ['Kākāpō', 'lake_Taupō', 'Lake Taupo', 'Taupo Lake#History']:
+            self.assertIn(title, provider.article_titles)
+        self.assertNotIn('Kakapo', provider.article_titles)
+
+        with open(self.path) as snapshot_file:
+            snapshot = json.load(snapshot_file)
+        self.assertEqual(['Kākāpō', 'Lake Taupō'], snapshot['titles'])
+        self.assertEqual(['Lake Taupo', 'Taupo Lake'], snapshot['redirects'])
+
+    def test_starts_from_snapshot_without_fetching(self):
+        with open(self.path, 'w') as snapshot_file:
+            json.dump({'titles': ['Kākāpō'], 'redirects': ['Kakapo'], 'last_refresh': 4e9, 'last_full_refresh': 4e9},
+                      snapshot_file)
+
+        session = FakeSession()
+        provider = self.provider(session)
+        self.assertTrue(provider.wait_until_ready(5))
+        self.assertIn('Kākāpō', provider.article_titles)
+        self.assertIn('Kakapo', provider.article_titles)
+        self.assertEqual(2, len(provider.article_titles))
+        self.assertEqual([], session.urls)
+
+    def test_incremental_refresh_adds_and_full_refresh_removes(self):
+        with open(self.path, 'w') as snapshot_file:
+            json.dump({'titles': ['Kākāpō', 'Ōtaki'], 'last_refresh': 4e9, 'last_full_refresh': 4e9}, snapshot_file)
+
+        provider = self.provider(FakeSession(['Whanganui'], ['Kākāpō', 'Whanganui'],
+                                             redirects={'Whanganui': ['Wanganui']}))
+        self.assertTrue(provider.wait_until_ready(5))
+        before = provider.article_titles
+
+        provider.refresh(full=False)
+        self.assertEqual(['Kākāpō', 'Whanganui', 'Ōtaki'], provider.titles())
+        self.assertIn('Wanganui', provider.article_titles)
+        self.assertEqual(['Whanganui'], provider.session.redirect_queries)
+        self.assertRegex(provider.session.urls[0], r'&after=\d{14}$')
+        self.assertNotIn('Whanganui', before)
+
+        provider.refresh(full=True)
+        self.assertEqual(['Kākāpō', 'Whanganui'], provider.titles())
+        self.assertNotIn('Ōtaki', provider.article_titles)
+        self.assertTrue(provider.session.urls[1].endswith('&&'))
+
+        reloaded = self.provider(FakeSession())
+        self.assertTrue(reloaded.wait_until_ready(5))
+        self.assertEqual(provider.titles(), reloaded.titles())
+        self.assertEqual(provider.redirects(), reloaded.redirects())
+        self.assertEqual(provider.last_refresh, reloaded.last_refresh)
+
+    def test_listeners_hear_about_every_refresh(self):
+        with open(self.path, 'w') as snapshot_file:
+            json.dump({'titles': ['Kākāpō'], 'last_refresh': 4e9, 'last_full_refresh': 4e9}, snapshot_file)
+        provider = self.provider(FakeSession(['Kākāpō', 'Ōtaki']))
+        self.assertTrue(provider.wait_until_ready(5))
+        heard = []
+
+        provider.add_listener(lambda updated: heard.append(updated.titles()))
+        provider.refresh(full=True)
+
+        self.assertEqual([['Kākāpō'], ['Kākāpō', 'Ōtaki']], heard)
+
+    def test_ignores_corrupt_snapshot(self):
+        with open(self.path, 'w') as snapshot_file:
+            snapshot_file.write('{"titles": [')
+
+        provider = self.provider(FakeSession(['Kākāpō']))
+        self.assertTrue(provider.wait_until_ready(5))
+        self.assertEqual(['Kākāpō'], provider.titles())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+
+from macron_monitor.WikilinkScanner import scan_wikilinks
+
+
+class test_WikilinkScanner(unittest.TestCase):
+    def test_plain_and_piped_links(self):
+        text = 'See [[Kākāpō]] and [[Whenua Hou|the island]].'
+
+        self.assertEqual([('Kākāpō', None, (4, 14)), ('Whenua Hou', 'the island', (19, 44))],
+                         [tuple(link) for link in scan_wikilinks(text)])
+
+    def test_pipes_inside_templates_in_labels(self):
+        text = '[[Māori language|{{lang|mi|te reo}}]]'
+
+        self.assertEqual([('Māori language', '{{lang|mi|te reo}}')],
+                         [(link.target, link.label) for link in scan_wikilinks(text)])
+
+    def test_nested_links_in_file_captions(self):
+        text = '[[File:Kākāpō.jpg|thumb|A [[Kākāpō|kakapo]] on [[Whenua Hou]]]]'
+
+        self.assertEqual(['Kākāpō', 'Whenua Hou', 'File:Kākāpō.jpg'],
+                         [link.target for link in scan_wikilinks(text)])
+
+    def test_unbalanced_brackets(self):
+        self.assertEqual([], list(scan_wikilinks('[[Kākāpō|kakapo')))
+        self.assertEqual([], list(scan_wikilinks(']] }} [[')))
+        self.assertEqual(['Kākāpō'], [link.target for link in scan_wikilinks('[[ [[Kākāpō]] }} ]')])
+        self.assertEqual(['Kākāpō'], [link.target for link in scan_wikilinks('{{cite|[[Kākāpō|kakapo]]')])
+        self.assertEqual(['x {{y'], [link.target for link in scan_wikilinks('[[x {{y]]')])
+
+
+if __name__ == '__main__':
+    unittest.main()